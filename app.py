@@ -11,13 +11,11 @@ from data_platform.databricks.stack import DatabricksStack
 
 # from data_platform.airflow.stack import AirflowStack
 from data_platform.redshift.stack import RedshiftStack
+from data_platform import sizing
 
 app = core.App()
 data_lake_stack = DataLakeStack(app)
 common_stack = CommonStack(app)
-kinesis_stack = KinesisStack(
-    app, data_lake_raw_bucket=data_lake_stack.data_lake_raw_bucket
-)
 dms_stack = DmsStack(
     app,
     common_stack=common_stack,
@@ -27,9 +25,18 @@ glue_catalog_stack = GlueCatalogStack(
     app,
     raw_data_lake_bucket=data_lake_stack.data_lake_raw_bucket,
     staged_data_lake_bucket=data_lake_stack.data_lake_raw_staged,
+    curated_data_lake_bucket=data_lake_stack.data_lake_raw_curated,
+    raw_object_created_topic=data_lake_stack.data_lake_raw_object_created_topic,
+)
+kinesis_stack = KinesisStack(
+    app,
+    data_lake_raw_bucket=data_lake_stack.data_lake_raw_bucket,
+    atomic_events_table=glue_catalog_stack.atomic_events_parquet_table,
 )
 athena_stack = AthenaStack(app)
-databricks_stack = DatabricksStack(app)
+databricks_stack = DatabricksStack(
+    app, raw_object_created_topic=data_lake_stack.data_lake_raw_object_created_topic
+)
 # airflow_stack = AirflowStack(
 #     app,
 #     data_lake_raw_bucket=data_lake_stack.data_lake_raw_bucket,
@@ -40,5 +47,7 @@ redshift_stack = RedshiftStack(
     data_lake_raw=data_lake_stack.data_lake_raw_bucket,
     common_stack=common_stack,
     data_lake_processed=data_lake_stack.data_lake_raw_staged,
+    raw_glue_database=glue_catalog_stack.raw_database,
 )
+sizing.report()
 app.synth()
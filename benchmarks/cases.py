@@ -0,0 +1,248 @@
+"""
+Benchmark cases. Each case receives a Recorder, does its work and returns the number of
+events (records, rows or day summaries) it processed.
+"""
+
+import importlib.util
+import inspect
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LOCAL_SCRIPTS = os.path.join(ROOT, "local_scripts")
+MERCADO_BITCOIN_DAG = os.path.join(
+    ROOT, "data_platform", "airflow", "dags", "mercado_bitcoin.py"
+)
+
+sys.path.insert(0, LOCAL_SCRIPTS)
+
+
+class Recorder:
+    """
+    Collects the latency of each operation of a case
+    """
+
+    def __init__(self) -> None:
+        self.latencies = []
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def measure(self):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started_at
+            with self.lock:
+                self.latencies.append(elapsed)
+
+
+def sample_event(index: int):
+    """
+    A web event with the same fields and a similar size as the ones fake_web_events
+    sends to Firehose
+    """
+    return {
+        "event_id": f"{index:032x}",
+        "event_timestamp": "2021-05-20 21:09:00.123456",
+        "event_type": "pageview",
+        "page_url": "http://www.dummywebsite.com/product_a",
+        "page_url_path": "/product_a",
+        "referer_url": "www.google.com",
+        "referer_url_scheme": "http",
+        "referer_url_port": "80",
+        "referer_medium": "search",
+        "utm_medium": "organic",
+        "utm_source": "google",
+        "utm_content": "ad_2",
+        "utm_campaign": "campaign_2",
+        "click_id": "b6b1a8ad-88ca-4fc7-b269-6c9efbbdad55",
+        "geo_latitude": "41.75338",
+        "geo_longitude": "-86.11084",
+        "geo_country": "US",
+        "geo_timezone": "America/Indiana/Indianapolis",
+        "geo_region_name": "Granger",
+        "ip_address": "209.139.207.244",
+        "browser_name": "Firefox",
+        "browser_user_agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:88.0) "
+        "Gecko/20100101 Firefox/88.0",
+        "browser_language": "en_US",
+        "os": "Windows 10",
+        "os_name": "Windows",
+        "os_timezone": "America/Indiana/Indianapolis",
+        "device_type": "Computer",
+        "device_is_mobile": False,
+        "user_custom_id": "vsnyder@hotmail.com",
+        "user_domain_id": "3d648067-9088-4d7e-ad32-45d009e8246a",
+    }
+
+
+def firehose_producer(recorder: Recorder, events: int = 50000):
+    """
+    FirehoseProducer from put_to_firehose.py against a stub client that takes
+    `latency` seconds per put_record_batch call, like a nearby Firehose endpoint.
+    Latency is measured per producer.put call, so it includes backpressure.
+    """
+    from firehose_producer import FirehoseProducer
+
+    class StubFirehose:
+        latency = 0.02
+
+        def put_record_batch(self, DeliveryStreamName, Records):
+            time.sleep(self.latency)
+            return {
+                "FailedPutCount": 0,
+                "RequestResponses": [{"RecordId": "0"} for _ in Records],
+            }
+
+    payload = [sample_event(index) for index in range(events)]
+    with FirehoseProducer(StubFirehose(), delivery_stream_name="benchmark") as producer:
+        for event in payload:
+            with recorder.measure():
+                producer.put(event)
+    return producer.records_sent
+
+
+def rds_insert(recorder: Recorder, rows: int = 100000, batch_size: int = 1000):
+    """
+    Batched order inserts from insert_to_rds.py. Runs against the Postgres given by
+    BENCHMARK_POSTGRES_DSN (using COPY like the bulk mode), or against a local SQLite
+    database as a stand-in. Latency is measured per batch transaction.
+    """
+    from orders import copy_batch, create_orders_table, random_order
+
+    postgres_dsn = os.environ.get("BENCHMARK_POSTGRES_DSN")
+    if postgres_dsn:
+        import psycopg2
+
+        conn = psycopg2.connect(postgres_dsn)
+        with conn.cursor() as cur:
+            create_orders_table(cur)
+            cur.execute("truncate orders_v2")
+        conn.commit()
+
+        def write(batch):
+            copy_batch(conn, batch)
+
+    else:
+        conn = sqlite3.connect(os.path.join(tempfile.mkdtemp(), "orders.db"))
+        conn.execute(
+            "create table orders_v2("
+            "created_at timestamp,"
+            "order_id text PRIMARY KEY,"
+            "product_name varchar(100),"
+            "value float)"
+        )
+
+        def write(batch):
+            conn.executemany("insert into orders_v2 values (?, ?, ?, ?)", batch)
+            conn.commit()
+
+    written = 0
+    while written < rows:
+        size = min(batch_size, rows - written)
+        batch = [
+            (created_at.isoformat(), order_id, product_name, value)
+            for created_at, order_id, product_name, value in (
+                random_order() for _ in range(size)
+            )
+        ]
+        with recorder.measure():
+            write(batch)
+        written += size
+    conn.close()
+    return written
+
+
+class DaySummaryHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        _, _, coin, _, year, month, day = self.path.split("/")
+        body = json.dumps(
+            {
+                "date": f"{year}-{month}-{day}",
+                "opening": 152700.0,
+                "closing": 153458.3,
+                "lowest": 151539.0,
+                "highest": 153975.0,
+                "volume": 5010596.04,
+                "quantity": 32.7,
+                "amount": 1590,
+                "avg_price": 153200.5,
+            }
+        ).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def mercado_bitcoin_extract(recorder: Recorder, days: int = 250, output_format="json"):
+    """
+    extract_and_load_to_s3 from the mercado_bitcoin DAG against a local HTTP server
+    and a moto S3 bucket. Latency is measured per coin/day task call.
+    """
+    try:
+        from moto import mock_aws
+    except ImportError:
+        from moto import mock_s3 as mock_aws
+
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), DaySummaryHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    spec = importlib.util.spec_from_file_location("mercado_bitcoin", MERCADO_BITCOIN_DAG)
+    dag_module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(dag_module)
+    dag_module.config.update(
+        {
+            "api_url": f"http://127.0.0.1:{server.server_port}/api",
+            "aws_conn_id": None,
+            "bucket": "benchmark",
+            "output_format": output_format,
+        }
+    )
+    # The 29 calls / 30 s API budget would dominate the timings, so the benchmark calls
+    # the request without its rate limit decorators
+    dag_module.fetch_daily_summary.__defaults__ = (
+        inspect.unwrap(dag_module.request_daily_summary),
+    )
+
+    processed = 0
+    with mock_aws():
+        import boto3
+
+        boto3.client("s3").create_bucket(Bucket="benchmark")
+        for offset in range(days):
+            date = time.strftime("%Y-%m-%d", time.gmtime(1609459200 + offset * 86400))
+            for coin in dag_module.config["coins"]:
+                with recorder.measure():
+                    dag_module.extract_and_load_to_s3(date=date, coin=coin)
+                processed += 1
+    server.shutdown()
+    return processed
+
+
+def mercado_bitcoin_extract_parquet(recorder: Recorder, days: int = 250):
+    return mercado_bitcoin_extract(recorder, days=days, output_format="parquet")
+
+
+CASES = {
+    "firehose_producer": firehose_producer,
+    "rds_insert": rds_insert,
+    "mercado_bitcoin_extract": mercado_bitcoin_extract,
+    "mercado_bitcoin_extract_parquet": mercado_bitcoin_extract_parquet,
+}
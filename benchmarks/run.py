@@ -0,0 +1,154 @@
+"""
+Runs the micro-benchmarks in benchmarks/cases.py and saves the results as JSON.
+
+    python benchmarks/run.py
+    python benchmarks/run.py --case firehose_producer --compare benchmarks/results/<sha>.json
+
+Each case runs in a fresh process, so its peak RSS is not polluted by other cases.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from cases import CASES, ROOT, Recorder  # noqa: E402
+
+# Metrics compared with --compare and whether a higher value is better
+COMPARED_METRICS = {
+    "events_per_second": True,
+    "p50_ms": False,
+    "p99_ms": False,
+    "peak_rss_mb": False,
+}
+
+
+def percentile(values: list, fraction: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        peak /= 1024
+    return peak / 1024
+
+
+def run_case(name: str, queue):
+    recorder = Recorder()
+    started_at = time.perf_counter()
+    events = CASES[name](recorder)
+    seconds = time.perf_counter() - started_at
+    p50 = percentile(recorder.latencies, 0.5)
+    p99 = percentile(recorder.latencies, 0.99)
+    queue.put(
+        {
+            "events": events,
+            "seconds": round(seconds, 3),
+            "events_per_second": round(events / seconds, 1),
+            "p50_ms": None if p50 is None else round(p50 * 1000, 3),
+            "p99_ms": None if p99 is None else round(p99 * 1000, 3),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+        }
+    )
+
+
+def run_isolated(name: str):
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=run_case, args=(name, queue))
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        raise RuntimeError(f"Benchmark {name} failed with exit code {process.exitcode}")
+    return queue.get()
+
+
+def current_commit():
+    try:
+        return (
+            subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT)
+            .decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results: dict, baseline: dict, threshold: float):
+    """
+    Prints the change of each metric against the baseline and returns the regressions
+    larger than `threshold`
+    """
+    regressions = []
+    for name, metrics in results.items():
+        if name not in baseline:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            before, after = baseline[name].get(metric), metrics.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            print(f"{name}.{metric}: {before} -> {after} ({change:+.1%})")
+            if (-change if higher_is_better else change) > threshold:
+                regressions.append(f"{name}.{metric}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--case", action="append", choices=sorted(CASES))
+    parser.add_argument("--output", help="defaults to benchmarks/results/<commit>.json")
+    parser.add_argument("--compare", help="results JSON of a previous run")
+    parser.add_argument(
+        "--threshold", type=float, default=0.2, help="relative change seen as regression"
+    )
+    args = parser.parse_args()
+
+    results = {}
+    for name in args.case or CASES:
+        print(f"Running {name}")
+        results[name] = run_isolated(name)
+        print(json.dumps(results[name]))
+
+    commit = current_commit()
+    output = args.output or os.path.join(ROOT, "benchmarks", "results", f"{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as results_file:
+        json.dump(
+            {
+                "commit": commit,
+                "created_at": datetime.utcnow().isoformat(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "results": results,
+            },
+            results_file,
+            indent=2,
+        )
+    print(f"Results saved to {output}")
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"Regressions above {args.threshold:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
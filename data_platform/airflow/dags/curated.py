@@ -0,0 +1,66 @@
+from airflow import DAG
+from airflow.operators.python_operator import PythonOperator
+from datetime import datetime
+import logging
+import os
+
+# data_platform is deployed next to the DAGs (see AirflowStack), and reads the
+# environment when imported
+os.environ.setdefault("ENVIRONMENT", "PRODUCTION")
+
+from data_platform.athena.client import AthenaQueryRunner  # noqa: E402
+from data_platform.athena.curated import CuratedBuilder  # noqa: E402
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+config = {
+    # Does not enforce its settings, which CTAS with external_location requires
+    "workgroup": "s3-belisco-production-data-lake-athena-workgroup-curated",
+    # Days checked for raw files newer than their curated partitions
+    "lookback_days": 3,
+}
+
+default_args = {
+    "owner": "andresionek91",
+    "start_date": datetime(2021, 1, 1),
+    "depends_on_past": False,
+}
+
+dag = DAG(
+    "curated_dag",
+    description="Reconstroi as particoes afetadas do atomic_events e rollups do curated.",
+    schedule_interval="0 6 * * *",
+    catchup=False,
+    default_args=default_args,
+)
+
+
+def builder() -> CuratedBuilder:
+    return CuratedBuilder(AthenaQueryRunner(workgroup=config["workgroup"]))
+
+
+def build_event_tables():
+    curated = builder()
+    days = curated.affected_dates(config["lookback_days"])
+    logger.info(f"Rebuilding event dates {days}")
+    for day in days:
+        curated.build_atomic_events(day)
+        curated.build_rollups(day)
+
+
+def build_orders():
+    builder().build_orders()
+
+
+build_event_tables_task = PythonOperator(
+    task_id="build_event_tables",
+    python_callable=build_event_tables,
+    dag=dag,
+)
+
+build_orders_task = PythonOperator(
+    task_id="build_orders",
+    python_callable=build_orders,
+    dag=dag,
+)
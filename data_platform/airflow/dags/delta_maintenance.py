@@ -0,0 +1,61 @@
+from airflow import DAG
+from airflow.contrib.operators.databricks_operator import DatabricksSubmitRunOperator
+from datetime import datetime
+
+config = {
+    "databricks_conn_id": "databricks_default",
+    "ingestion_path": "s3://s3-production-belisquito-databricks-bucket-turma-5/ingestion",
+    "staged_path": "s3://s3-belisquito-turma-5-production-data-lake-staged",
+    # <table>: (Z-order column, partition column)
+    "tables": {
+        "atomic_events": ("user_domain_id", "event_date"),
+        "orders": ("order_id", "created_date"),
+    },
+    # Streaming writes only reach the last few partitions, older ones are compacted
+    "partition_days": 3,
+    "retention_hours": 168,
+}
+
+default_args = {
+    "owner": "andresionek91",
+    "start_date": datetime(2021, 1, 1),
+    "depends_on_past": False,
+}
+
+dag = DAG(
+    "delta_maintenance_dag",
+    description="Compacta, aplica Z-order e VACUUM nas tabelas Delta do staged.",
+    schedule_interval="0 5 * * *",
+    catchup=False,
+    default_args=default_args,
+)
+
+new_cluster = {
+    "spark_version": "8.2.x-scala2.12",
+    "node_type_id": "i3.xlarge",
+    "num_workers": 2,
+    "aws_attributes": {
+        # ARN of iam-<env>-databricks-data-lake-access-instance-profile
+        "instance_profile_arn": "{{ var.value.databricks_instance_profile_arn }}",
+    },
+}
+
+for table, (zorder_column, partition_column) in config["tables"].items():
+    DatabricksSubmitRunOperator(
+        task_id=f"optimize_{table}",
+        dag=dag,
+        databricks_conn_id=config["databricks_conn_id"],
+        run_name=f"delta_maintenance_{table}",
+        new_cluster=new_cluster,
+        spark_python_task={
+            "python_file": f"{config['ingestion_path']}/delta_maintenance.py",
+            "parameters": [
+                "--table",
+                f"{config['staged_path']}/{table},{zorder_column},{partition_column}",
+                "--partition-days",
+                str(config["partition_days"]),
+                "--retention-hours",
+                str(config["retention_hours"]),
+            ],
+        },
+    )
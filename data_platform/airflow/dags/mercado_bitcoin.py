@@ -1,19 +1,38 @@
 from airflow import DAG
 from airflow.operators.python_operator import PythonOperator
 from airflow.hooks.S3_hook import S3Hook
+import pyarrow as pa
+import pyarrow.parquet as pq
 import requests
-from backoff import on_exception, constant
+from requests.adapters import HTTPAdapter
+from backoff import on_exception, constant, expo
 from ratelimit import limits, RateLimitException
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 import logging
 import json
+import threading
+import time
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 config = {
     "bucket": "s3-belisquito-turma-5-production-data-lake-raw",
+    "api_url": "https://www.mercadobitcoin.net/api",
     "coins": ["BCH", "BTC", "ETH", "LTC"],
+    # "fused" extracts and loads in a single task. "two_step" keeps the original
+    # get_daily_summary >> upload_to_s3 tasks (passing data by XCom) for debugging
+    "extraction_mode": "fused",
+    # "json" keeps the API response as is. "parquet" writes it with DAILY_SUMMARY_SCHEMA
+    "output_format": "json",
+    "aws_conn_id": "aws_default",
+    "backfill_workers": 8,
+    "backfill_chunk_days": 30,
+    # (connect, read) seconds, so a hung connection fails and is retried
+    "request_timeout": (5, 30),
+    # MWAA workers are ephemeral and not shared, so the cache lives in the bucket
+    "cache_prefix": "cache/mercado_bitcoin",
 }
 
 default_args = {
@@ -27,44 +46,377 @@ dag = DAG(
     "mercado_bitcoin_dag",
     description="Extrai dados do sumario diario do mercado bitcoin.",
     schedule_interval="0 0 * * *",
-    catchup=True,
+    catchup=False,
     default_args=default_args,
 )
 
+compaction_dag = DAG(
+    "mercado_bitcoin_compaction_dag",
+    description="Compacta os arquivos diarios do mercado bitcoin em um arquivo por mes.",
+    schedule_interval="0 3 1 * *",
+    catchup=False,
+    default_args=default_args,
+)
+
+backfill_dag = DAG(
+    "mercado_bitcoin_backfill_dag",
+    description="Extrai o historico do sumario diario do mercado bitcoin em uma unica task.",
+    schedule_interval=None,
+    catchup=False,
+    default_args=default_args,
+)
+
+
+DAILY_SUMMARY_SCHEMA = pa.schema(
+    [
+        ("date", pa.date32()),
+        ("opening", pa.float64()),
+        ("closing", pa.float64()),
+        ("lowest", pa.float64()),
+        ("highest", pa.float64()),
+        ("volume", pa.float64()),
+        ("quantity", pa.float64()),
+        ("amount", pa.int64()),
+        ("avg_price", pa.float64()),
+    ]
+)
+
+# Keep-alive session shared by every request made from this worker process
+session = requests.Session()
+session.mount(
+    "https://",
+    HTTPAdapter(pool_connections=1, pool_maxsize=config["backfill_workers"]),
+)
+
+
+class DailySummaryCache:
+    """
+    S3 cache of day summary responses keyed by coin and date. Summaries of closed days
+    never change, so only those are stored and reruns or catch-up runs on any worker
+    read them from S3 instead of calling the API.
+    """
+
+    def __init__(self, s3, bucket: str, prefix: str):
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def key(self, date: str, coin: str):
+        return f"{self.prefix}/{coin}/{date}.json"
+
+    @staticmethod
+    def is_closed(date: str):
+        # Mercado Bitcoin days end at midnight in Brasilia (UTC-3)
+        day_end = datetime.strptime(date, "%Y-%m-%d") + timedelta(days=1, hours=3)
+        return day_end <= datetime.utcnow()
+
+    def get(self, date: str, coin: str):
+        try:
+            response = self.s3.get_object(Bucket=self.bucket, Key=self.key(date, coin))
+            body = response["Body"].read()
+        except self.s3.exceptions.NoSuchKey:
+            body = None
+        with self.lock:
+            if body is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return body
+
+    def put(self, date: str, coin: str, body: bytes):
+        if not self.is_closed(date):
+            return
+        self.s3.put_object(Bucket=self.bucket, Key=self.key(date, coin), Body=body)
+
+    @classmethod
+    def from_config(cls, s3=None):
+        s3 = s3 or S3Hook(aws_conn_id=config["aws_conn_id"]).get_conn()
+        return cls(s3, config["bucket"], config["cache_prefix"])
+
+    def log_stats(self):
+        logger.info(f"Day summary cache: {self.hits} hits, {self.misses} misses")
+
+
+# Server errors, dropped connections and timeouts are retried with backoff
+RETRYABLE_ERRORS = (
+    requests.exceptions.HTTPError,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+)
+
+
+def is_client_error(exception: requests.exceptions.RequestException):
+    """
+    Gives up on client errors, except 429 Too Many Requests
+    """
+    if not isinstance(exception, requests.exceptions.HTTPError):
+        return False
+    status_code = exception.response.status_code
+    return status_code < 500 and status_code != 429
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket shared by every request of a backfill. It holds a single
+    token and refills at (calls - 1) / period, so no window of `period` seconds ever
+    sees more than `calls` requests.
+    """
+
+    def __init__(self, calls: int, period: float):
+        self.fill_rate = (calls - 1) / period
+        self.tokens = 1.0
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    1.0, self.tokens + (now - self.updated_at) * self.fill_rate
+                )
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.fill_rate
+            time.sleep(wait)
+
 
 @on_exception(constant, RateLimitException, interval=30, max_tries=1)
 @limits(calls=29, period=30)
-@on_exception(constant, requests.exceptions.HTTPError, interval=0.5, max_tries=60)
-def get_daily_summary(date: str, coin: str):
+@on_exception(
+    expo,
+    RETRYABLE_ERRORS,
+    max_tries=8,
+    max_value=30,
+    giveup=is_client_error,
+)
+def request_daily_summary(date: str, coin: str):
     year, month, day = date.split("-")
-    endpoint = (
-        f"https://www.mercadobitcoin.net/api/{coin}/day-summary/{year}/{month}/{day}"
-    )
+    endpoint = f"{config['api_url']}/{coin}/day-summary/{year}/{month}/{day}"
 
     logger.info(f"Getting data from API with: {endpoint}")
 
-    response = requests.get(endpoint)
+    response = session.get(endpoint, timeout=config["request_timeout"])
     response.raise_for_status()
-    logger.info(f"Data downloaded from API: {response.text}")
+    return response.content
+
+
+def fetch_daily_summary(
+    date: str, coin: str, cache: DailySummaryCache, request=request_daily_summary
+):
+    """
+    Returns the raw day summary, from the cache when the day is closed and was fetched
+    before, otherwise from the API
+    """
+    body = cache.get(date, coin)
+    if body is None:
+        body = request(date, coin)
+        cache.put(date, coin, body)
+    return body
+
+
+def get_daily_summary(date: str, coin: str):
+    cache = DailySummaryCache.from_config()
+    body = fetch_daily_summary(date, coin, cache)
+    source = "cache" if cache.hits else "API"
+    logger.info(
+        f"Data read from {source} ({cache.hits} hits, {cache.misses} misses): {body}"
+    )
 
-    return response.json()
+    return json.loads(body)
+
+
+def parse_daily_summary(body: bytes):
+    """
+    Converts an API response into a row following DAILY_SUMMARY_SCHEMA
+    """
+    summary = json.loads(body)
+    row = {
+        field.name: float(summary[field.name])
+        for field in DAILY_SUMMARY_SCHEMA
+        if field.type == pa.float64()
+    }
+    row["date"] = datetime.strptime(summary["date"], "%Y-%m-%d").date()
+    row["amount"] = int(summary["amount"])
+    return row
+
+
+def daily_summary_rows(key: str, body: bytes):
+    """
+    Parses a JSON or Parquet day summary file stored in S3
+    """
+    if key.endswith(".parquet"):
+        columns = pq.read_table(pa.BufferReader(body)).to_pydict()
+        return [dict(zip(columns, values)) for values in zip(*columns.values())]
+    return [parse_daily_summary(body)]
+
+
+def to_parquet(rows: list):
+    table = pa.Table.from_pydict(
+        {name: [row[name] for row in rows] for name in DAILY_SUMMARY_SCHEMA.names},
+        schema=DAILY_SUMMARY_SCHEMA,
+    )
+    buffer = pa.BufferOutputStream()
+    pq.write_table(table, buffer, compression="snappy")
+    return buffer.getvalue().to_pybytes()
+
+
+def daily_summary_object(date: str, coin: str, body: bytes):
+    """
+    Returns the S3 key and content of a day summary in the configured output format
+    """
+    prefix = f"mercado_bitcoin/coin={coin}/execution_date={date}"
+    if config["output_format"] == "parquet":
+        key = f"{prefix}/mercado_bitcoin_{coin}_{date}.parquet"
+        return key, to_parquet([parse_daily_summary(body)])
+
+    now_string = datetime.now().strftime("%Y-%m-%d-%H-%M-%S-%f")
+    return f"{prefix}/mercado_bitcoin_{coin}_{now_string}.json", body
 
 
 def upload_to_s3(date, coin, **context):
     logger.info(f"Getting context from previous task")
     json_data = context["ti"].xcom_pull(task_ids=f"get_daily_summary_{coin}")
-    string_data = json.dumps(json_data)
-    now_string = datetime.now().strftime("%Y-%m-%d-%H-%M-%S-%f")
+    key, data = daily_summary_object(date, coin, json.dumps(json_data).encode("utf-8"))
     logger.info(f"Uploading to S3")
-    S3Hook(aws_conn_id="aws_default").load_string(
-        string_data=string_data,
-        key=f"mercado_bitcoin/coin={coin}/execution_date={date}/mercado_bitcoin_{coin}_{now_string}.json",
+    S3Hook(aws_conn_id=config["aws_conn_id"]).load_bytes(
+        bytes_data=data,
+        key=key,
         bucket_name=config["bucket"],
+        replace=True,
+    )
+
+
+def extract_and_load_to_s3(date, coin, **context):
+    """
+    Sends the API response body straight to S3, skipping the XCom round trip
+    """
+    cache = DailySummaryCache.from_config()
+    body = fetch_daily_summary(date, coin, cache)
+    cache.log_stats()
+    key, data = daily_summary_object(date, coin, body)
+    logger.info("Uploading to S3")
+    S3Hook(aws_conn_id=config["aws_conn_id"]).load_bytes(
+        bytes_data=data,
+        key=key,
+        bucket_name=config["bucket"],
+        replace=True,
+    )
+
+
+def backfill_daily_summaries(start_date: str, end_date: str, **context):
+    """
+    Fetches every coin for every day between start_date and end_date (inclusive) in a
+    single task. Requests share the pooled session, the day summary cache and a token
+    bucket that keeps the 29 calls / 30 s budget of the API, and each chunk of days is
+    written to S3 before the next one is fetched.
+    """
+    start = datetime.strptime(start_date, "%Y-%m-%d")
+    end = datetime.strptime(end_date, "%Y-%m-%d")
+    dates = [
+        (start + timedelta(days=offset)).strftime("%Y-%m-%d")
+        for offset in range((end - start).days + 1)
+    ]
+    logger.info(f"Backfilling {len(dates)} days for {config['coins']}")
+
+    workers = config["backfill_workers"]
+    rate_limiter = TokenBucket(calls=29, period=30)
+    s3 = S3Hook(aws_conn_id=config["aws_conn_id"]).get_conn()
+    cache = DailySummaryCache.from_config(s3)
+
+    @on_exception(
+        expo,
+        RETRYABLE_ERRORS,
+        max_tries=8,
+        max_value=30,
+        giveup=is_client_error,
+    )
+    def request(date: str, coin: str):
+        year, month, day = date.split("-")
+        rate_limiter.acquire()
+        response = session.get(
+            f"{config['api_url']}/{coin}/day-summary/{year}/{month}/{day}",
+            timeout=config["request_timeout"],
+        )
+        response.raise_for_status()
+        return response.content
+
+    def fetch(date: str, coin: str):
+        return date, coin, fetch_daily_summary(date, coin, cache, request=request)
+
+    def upload(item):
+        key, data = daily_summary_object(*item)
+        s3.put_object(Bucket=config["bucket"], Key=key, Body=data)
+
+    chunk_days = config["backfill_chunk_days"]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for chunk_start in range(0, len(dates), chunk_days):
+            chunk_end = chunk_start + chunk_days
+            chunk = [
+                (date, coin)
+                for date in dates[chunk_start:chunk_end]
+                for coin in config["coins"]
+            ]
+            results = list(executor.map(lambda args: fetch(*args), chunk))
+            list(executor.map(upload, results))
+            logger.info(f"Uploaded {len(results)} summaries up to {chunk[-1][0]}")
+    cache.log_stats()
+
+
+def compact_month(month: str, coin: str, **context):
+    """
+    Merges every daily file of a coin in a month (JSON or Parquet) into a single Parquet
+    file under mercado_bitcoin_monthly, read by the mercado_bitcoin Glue table
+    """
+    hook = S3Hook(aws_conn_id=config["aws_conn_id"])
+    prefix = f"mercado_bitcoin/coin={coin}/execution_date={month}-"
+    paginator = hook.get_conn().get_paginator("list_objects_v2")
+    objects = [
+        item
+        for page in paginator.paginate(Bucket=config["bucket"], Prefix=prefix)
+        for item in page.get("Contents", [])
+    ]
+
+    # A day may have JSON and Parquet files, named differently, so the latest
+    # extraction is the last one written
+    latest_keys = {}
+    for item in sorted(objects, key=lambda item: (item["LastModified"], item["Key"])):
+        latest_keys[item["Key"].split("/")[2]] = item["Key"]
+
+    rows = []
+    for key in latest_keys.values():
+        body = hook.get_key(key, bucket_name=config["bucket"]).get()["Body"].read()
+        rows.extend(daily_summary_rows(key, body))
+    if not rows:
+        logger.info(f"No daily files found under {prefix}")
+        return
+
+    rows.sort(key=lambda row: row["date"])
+    logger.info(f"Compacting {len(latest_keys)} daily files of {coin} in {month}")
+    hook.load_bytes(
+        bytes_data=to_parquet(rows),
+        key=f"mercado_bitcoin_monthly/coin={coin}/month={month}/mercado_bitcoin_{coin}_{month}.parquet",
+        bucket_name=config["bucket"],
+        replace=True,
     )
 
 
 for coin in config["coins"]:
     logger.info(f"Starting extractions tasks for {coin}")
+    if config["extraction_mode"] == "fused":
+        PythonOperator(
+            task_id=f"extract_and_load_to_s3_{coin}",
+            dag=dag,
+            python_callable=extract_and_load_to_s3,
+            op_kwargs={"date": "{{ ds }}", "coin": coin},
+        )
+        continue
+
     task_1 = PythonOperator(
         task_id=f"get_daily_summary_{coin}",
         dag=dag,
@@ -81,3 +433,21 @@ for coin in config["coins"]:
     )
 
     task_1 >> task_2
+
+backfill = PythonOperator(
+    task_id="backfill_daily_summaries",
+    dag=backfill_dag,
+    python_callable=backfill_daily_summaries,
+    op_kwargs={
+        "start_date": "{{ (dag_run.conf or {}).get('start_date', '2021-01-01') }}",
+        "end_date": "{{ (dag_run.conf or {}).get('end_date', macros.ds_add(ds, -1)) }}",
+    },
+)
+
+for coin in config["coins"]:
+    PythonOperator(
+        task_id=f"compact_month_{coin}",
+        dag=compaction_dag,
+        python_callable=compact_month,
+        op_kwargs={"month": "{{ execution_date.strftime('%Y-%m') }}", "coin": coin},
+    )
@@ -11,9 +11,20 @@ from aws_cdk import (
 from common_stack import CommonStack
 from data_platform.data_lake.base import BaseDataLakeBucket
 from data_platform.active_environment import active_environment
+from data_platform.sizing import sizing_profile
 import os
 from zipfile import ZipFile
 
+# Modules of the platform imported by the DAGs, deployed under dags/ with their paths
+DAG_MODULES = [
+    "data_platform/__init__.py",
+    "data_platform/active_environment.py",
+    "data_platform/athena/__init__.py",
+    "data_platform/athena/client.py",
+    "data_platform/athena/curated.py",
+    "data_platform/glue_catalog/schemas.py",
+]
+
 
 class AirflowStack(core.Stack):
     def __init__(
@@ -95,6 +106,54 @@ class AirflowStack(core.Stack):
                         f"{self.data_lake_raw_bucket.bucket_arn}/*",
                     ],
                 ),
+                # curated_dag builds the curated layer with Athena
+                iam.PolicyStatement(
+                    actions=[
+                        "athena:GetWorkGroup",
+                        "athena:StartQueryExecution",
+                        "athena:GetQueryExecution",
+                        "athena:GetQueryResults",
+                    ],
+                    resources=[
+                        f"arn:aws:athena:{self.region}:{self.account}:workgroup/s3-belisco-{self.deploy_env.value}-data-lake-athena-workgroup-curated"
+                    ],
+                ),
+                iam.PolicyStatement(
+                    actions=[
+                        "glue:GetDatabase",
+                        "glue:GetTable",
+                        "glue:GetTables",
+                        "glue:CreateTable",
+                        "glue:UpdateTable",
+                        "glue:DeleteTable",
+                        "glue:GetPartition",
+                        "glue:GetPartitions",
+                        "glue:CreatePartition",
+                        "glue:UpdatePartition",
+                        "glue:BatchCreatePartition",
+                    ],
+                    resources=[
+                        f"arn:aws:glue:{self.region}:{self.account}:catalog",
+                        f"arn:aws:glue:{self.region}:{self.account}:database/glue_belisco_{self.deploy_env.value}_data_lake_*",
+                        f"arn:aws:glue:{self.region}:{self.account}:table/glue_belisco_{self.deploy_env.value}_data_lake_*",
+                    ],
+                ),
+                iam.PolicyStatement(
+                    actions=[
+                        "s3:GetBucketLocation",
+                        "s3:ListBucket",
+                        "s3:GetObject",
+                        "s3:PutObject",
+                        "s3:DeleteObject",
+                        "s3:AbortMultipartUpload",
+                    ],
+                    resources=[
+                        f"arn:aws:s3:::s3-belisquito-turma-5-{self.deploy_env.value}-data-lake-curated",
+                        f"arn:aws:s3:::s3-belisquito-turma-5-{self.deploy_env.value}-data-lake-curated/*",
+                        f"arn:aws:s3:::s3-belisquito-{self.deploy_env.value}-data-lake-athena-results",
+                        f"arn:aws:s3:::s3-belisquito-{self.deploy_env.value}-data-lake-athena-results/*",
+                    ],
+                ),
                 iam.PolicyStatement(
                     actions=["airflow:PublishMetrics"],
                     resources=[
@@ -155,7 +214,7 @@ class AirflowStack(core.Stack):
             name=f"{self.deploy_env.value}-airflow",
             airflow_version="1.10.12",
             dag_s3_path="dags",
-            environment_class="mw1.small",
+            environment_class=sizing_profile.airflow.environment_class,
             execution_role_arn=self.execution_role.role_arn,
             logging_configuration=mwaa.CfnEnvironment.LoggingConfigurationProperty(
                 dag_processing_logs=self.logging_configuration,
@@ -164,8 +223,8 @@ class AirflowStack(core.Stack):
                 webserver_logs=self.logging_configuration,
                 worker_logs=self.logging_configuration,
             ),
-            max_workers=2,
-            min_workers=1,
+            max_workers=sizing_profile.airflow.max_workers,
+            min_workers=sizing_profile.airflow.min_workers,
             network_configuration=mwaa.CfnEnvironment.NetworkConfigurationProperty(
                 security_group_ids=[self.security_group.security_group_id],
                 subnet_ids=[
@@ -192,6 +251,8 @@ class AirflowStack(core.Stack):
                 zipObj2.write(
                     f"data_platform/airflow/dags/{file}", arcname=f"dags/{file}"
                 )
+            for module in DAG_MODULES:
+                zipObj2.write(module, arcname=f"dags/{module}")
 
         s3deploy.BucketDeployment(
             self,
@@ -21,7 +21,15 @@ class BaseAthenaBucket(s3.Bucket):
             **kwargs,
         )
 
-        self.add_lifecycle_rule(expiration=core.Duration.days(60))
+        # Covers the CSV results, the AthenaQueryRunner cache/ index and the unload/
+        # Parquet of every workgroup prefix. The bucket is versioned, so overwritten
+        # and expired objects are also removed after a while
+        self.add_lifecycle_rule(
+            id="expire-query-results",
+            expiration=core.Duration.days(60),
+            noncurrent_version_expiration=core.Duration.days(7),
+            abort_incomplete_multipart_upload_after=core.Duration.days(1),
+        )
 
     @staticmethod
     def default_block_public_access():
@@ -51,17 +59,24 @@ class BaseAthenaWorkgroup(athena.CfnWorkGroup):
         scope: core.Construct,
         athena_bucket: BaseAthenaBucket,
         gb_scanned_cutoff_per_query: int,
+        team: str = None,
+        description: str = "Workgroup padrao para execucao de queries",
+        enforce_configuration: bool = True,
         **kwargs,
     ) -> None:
         self.gb_scanned_cutoff_per_query = gb_scanned_cutoff_per_query
+        self.enforce_configuration = enforce_configuration
         self.deploy_env = scope.deploy_env
         self.athena_bucket = athena_bucket
+        self.team = team
         self.obj_name = f"s3-belisco-{self.deploy_env.value}-data-lake-athena-workgroup"
+        if self.team:
+            self.obj_name = f"{self.obj_name}-{self.team}"
         super().__init__(
             scope,
             id=self.obj_name,
             name=self.obj_name,
-            description="Workgroup padrao para execucao de queries",
+            description=description,
             recursive_delete_option=True,
             state="ENABLED",
             work_group_configuration=self.default_workgroup_configuration,
@@ -72,7 +87,7 @@ class BaseAthenaWorkgroup(athena.CfnWorkGroup):
     def default_workgroup_configuration(self):
         return athena.CfnWorkGroup.WorkGroupConfigurationProperty(
             bytes_scanned_cutoff_per_query=self.bytes_scanned_cutoff_per_query,
-            enforce_work_group_configuration=True,
+            enforce_work_group_configuration=self.enforce_configuration,
             publish_cloud_watch_metrics_enabled=True,
             result_configuration=self.default_result_configuration,
         )
@@ -83,9 +98,18 @@ class BaseAthenaWorkgroup(athena.CfnWorkGroup):
             encryption_configuration=athena.CfnWorkGroup.EncryptionConfigurationProperty(
                 encryption_option="SSE_S3"
             ),
-            output_location=f"s3://{self.athena_bucket.bucket_name}",
+            output_location=self.output_location,
         )
 
+    @property
+    def output_location(self):
+        """
+        Each team writes its results, and the AthenaQueryRunner cache, to its own prefix
+        """
+        if self.team:
+            return f"s3://{self.athena_bucket.bucket_name}/{self.team}/"
+        return f"s3://{self.athena_bucket.bucket_name}"
+
     @property
     def bytes_scanned_cutoff_per_query(self):
         return self.gb_scanned_cutoff_per_query * 1000000000
@@ -0,0 +1,320 @@
+"""
+Runs Athena queries in a workgroup, reusing the results of previous executions.
+
+Results are cached by the hash of the normalized SQL, the workgroup, the database and a
+watermark given by the caller (e.g. the latest partition of the tables read). A repeated
+query with the same watermark reads the CSV Athena already wrote to the workgroup
+output location instead of scanning the data lake again. The cache index is kept in
+memory and under cache/ in the output location, so other processes reuse it too, and it
+expires with the results bucket lifecycle.
+
+    runner = AthenaQueryRunner(workgroup=workgroup_name, database=database_name)
+    for row in runner.query(sql, watermark=latest_event_date):
+        ...
+
+Large results are better read with UNLOAD, which writes Parquet under unload/ in the
+output location. iter_record_batches streams it as Arrow record batches, one file at a
+time, that convert to pandas (batch.to_pandas()) or Polars (polars.from_arrow(batch))
+without building the whole result:
+
+    for batch in runner.iter_record_batches(sql, watermark=latest_event_date):
+        ...
+
+The boto3 clients can be injected, e.g. with botocore Stubber in tests.
+"""
+
+import codecs
+import csv
+import hashlib
+import json
+import logging
+import re
+import time
+from datetime import datetime, timezone
+from typing import Dict, Iterator, Optional
+from urllib.parse import urlparse
+
+import boto3
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+# Literals and quoted identifiers, kept as is by the normalization, and comments. The
+# pattern is matched from left to right, so quotes inside a comment and comment markers
+# inside a literal are part of the token they are in
+SQL_TOKEN_PATTERN = re.compile(
+    r"(?P<quoted>'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")|(?P<comment>--[^\n]*|/\*.*?\*/)",
+    re.DOTALL,
+)
+
+# Statements whose output Athena writes as CSV
+CACHEABLE_STATEMENTS = ("select", "with")
+
+
+class AthenaQueryError(Exception):
+    def __init__(self, query_execution_id: str, state: str, reason: str):
+        self.query_execution_id = query_execution_id
+        self.state = state
+        super().__init__(f"Query {query_execution_id} {state}: {reason}")
+
+
+def normalize_sql(sql: str) -> str:
+    """
+    Removes comments, repeated whitespace, letter case and the trailing semicolon
+    outside of string literals, so formatting changes hit the same cache entry
+    """
+    normalized = []
+    start = 0
+    for token in SQL_TOKEN_PATTERN.finditer(sql):
+        end = token.start()
+        normalized.append(" ".join(sql[start:end].lower().split()))
+        if token.group("quoted"):
+            normalized.append(token.group("quoted"))
+        start = token.end()
+    normalized.append(" ".join(sql[start:].lower().split()))
+    return " ".join(part for part in normalized if part).rstrip("; ")
+
+
+def split_s3_uri(uri: str):
+    parsed = urlparse(uri)
+    return parsed.netloc, parsed.path.lstrip("/")
+
+
+class AthenaQueryRunner:
+    def __init__(
+        self,
+        workgroup: str,
+        database: Optional[str] = None,
+        athena_client=None,
+        s3_client=None,
+        poll_interval_seconds: float = 0.5,
+        page_size: int = 1000,
+    ):
+        self.workgroup = workgroup
+        self.database = database
+        self.athena = athena_client or boto3.client("athena")
+        self.s3 = s3_client or boto3.client("s3")
+        self.poll_interval_seconds = poll_interval_seconds
+        self.page_size = page_size
+        self.memory_cache: Dict[str, str] = {}
+        self._output_location = None
+
+    @property
+    def output_location(self) -> str:
+        """
+        Result location enforced by the workgroup
+        """
+        if self._output_location is None:
+            workgroup = self.athena.get_work_group(WorkGroup=self.workgroup)["WorkGroup"]
+            location = workgroup["Configuration"]["ResultConfiguration"]["OutputLocation"]
+            self._output_location = location.rstrip("/") + "/"
+        return self._output_location
+
+    def cache_key(self, sql: str, watermark: Optional[str], result_format="csv") -> str:
+        content = "\n".join(
+            [
+                self.workgroup,
+                self.database or "",
+                str(watermark),
+                result_format,
+                normalize_sql(sql),
+            ]
+        )
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def cache_index_location(self, key: str):
+        bucket, prefix = split_s3_uri(self.output_location)
+        return bucket, f"{prefix}cache/{key}.json"
+
+    def output_exists(self, output: str) -> bool:
+        """
+        Checks a CSV result file, or an UNLOAD prefix when output ends with /
+        """
+        bucket, key = split_s3_uri(output)
+        if key.endswith("/"):
+            listing = self.s3.list_objects_v2(Bucket=bucket, Prefix=key, MaxKeys=1)
+            return listing["KeyCount"] > 0
+        self.s3.head_object(Bucket=bucket, Key=key)
+        return True
+
+    def cached_output(self, key: str) -> Optional[str]:
+        """
+        Output of a previous execution of the query, if it still exists
+        """
+        if key in self.memory_cache:
+            return self.memory_cache[key]
+        bucket, index_key = self.cache_index_location(key)
+        try:
+            entry = json.load(self.s3.get_object(Bucket=bucket, Key=index_key)["Body"])
+            if not self.output_exists(entry["output"]):
+                return None
+        except ClientError as error:
+            if error.response["Error"]["Code"] in ("NoSuchKey", "404", "NotFound"):
+                return None
+            raise
+        self.memory_cache[key] = entry["output"]
+        return entry["output"]
+
+    def store_output(self, key: str, sql: str, execution: dict, output: str = None):
+        output = output or execution["ResultConfiguration"]["OutputLocation"]
+        self.memory_cache[key] = output
+        bucket, index_key = self.cache_index_location(key)
+        entry = {
+            "output": output,
+            "query_execution_id": execution["QueryExecutionId"],
+            "sql": normalize_sql(sql),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+        }
+        self.s3.put_object(Bucket=bucket, Key=index_key, Body=json.dumps(entry).encode())
+
+    def start(self, sql: str) -> str:
+        parameters = {"QueryString": sql, "WorkGroup": self.workgroup}
+        if self.database:
+            parameters["QueryExecutionContext"] = {"Database": self.database}
+        return self.athena.start_query_execution(**parameters)["QueryExecutionId"]
+
+    def wait(self, query_execution_id: str) -> dict:
+        while True:
+            execution = self.athena.get_query_execution(
+                QueryExecutionId=query_execution_id
+            )["QueryExecution"]
+            state = execution["Status"]["State"]
+            if state == "SUCCEEDED":
+                statistics = execution.get("Statistics", {})
+                logger.info(
+                    "Query %s scanned %s bytes in %s ms",
+                    query_execution_id,
+                    statistics.get("DataScannedInBytes"),
+                    statistics.get("EngineExecutionTimeInMillis"),
+                )
+                return execution
+            if state in ("FAILED", "CANCELLED"):
+                reason = execution["Status"].get("StateChangeReason", "")
+                raise AthenaQueryError(query_execution_id, state, reason)
+            time.sleep(self.poll_interval_seconds)
+
+    def execute(self, sql: str) -> dict:
+        """
+        Runs the query without the cache and returns its execution once finished
+        """
+        return self.wait(self.start(sql))
+
+    def iter_results(self, query_execution_id: str) -> Iterator[dict]:
+        """
+        Streams the rows of a finished query page by page as dicts of strings
+        """
+        paginator = self.athena.get_paginator("get_query_results")
+        columns = None
+        for page in paginator.paginate(
+            QueryExecutionId=query_execution_id,
+            PaginationConfig={"PageSize": self.page_size},
+        ):
+            rows = [
+                [datum.get("VarCharValue") for datum in row["Data"]]
+                for row in page["ResultSet"]["Rows"]
+            ]
+            if columns is None:
+                columns = [
+                    column["Name"]
+                    for column in page["ResultSet"]["ResultSetMetadata"]["ColumnInfo"]
+                ]
+                # The first row of a SELECT repeats the column names
+                if rows and rows[0] == columns:
+                    rows.pop(0)
+            for row in rows:
+                yield dict(zip(columns, row))
+
+    def iter_csv(self, output_location: str) -> Iterator[dict]:
+        """
+        Streams the rows of a CSV result file from S3 as dicts of strings. Athena
+        writes NULL as an empty field, so it reads as an empty string
+        """
+        bucket, key = split_s3_uri(output_location)
+        body = self.s3.get_object(Bucket=bucket, Key=key)["Body"]
+        try:
+            yield from csv.DictReader(codecs.getreader("utf-8")(body))
+        finally:
+            body.close()
+
+    def query(self, sql: str, watermark: Optional[str] = None) -> Iterator[dict]:
+        """
+        Streams the rows of the query from its CSV output, reusing the output of a
+        previous execution with the same normalized SQL and watermark when there is one
+        """
+        if not normalize_sql(sql).startswith(CACHEABLE_STATEMENTS):
+            yield from self.iter_results(self.execute(sql)["QueryExecutionId"])
+            return
+
+        key = self.cache_key(sql, watermark)
+        output = self.cached_output(key)
+        if output is not None:
+            logger.info("Reusing %s for query %s", output, key)
+            yield from self.iter_csv(output)
+            return
+
+        execution = self.execute(sql)
+        self.store_output(key, sql, execution)
+        yield from self.iter_csv(execution["ResultConfiguration"]["OutputLocation"])
+
+    def unload_location(self, key: str) -> str:
+        return f"{self.output_location}unload/{key}/"
+
+    def delete_prefix(self, location: str):
+        bucket, prefix = split_s3_uri(location)
+        paginator = self.s3.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            objects = [{"Key": item["Key"]} for item in page.get("Contents", [])]
+            if objects:
+                self.s3.delete_objects(Bucket=bucket, Delete={"Objects": objects})
+
+    def unload(self, sql: str, watermark: Optional[str] = None) -> str:
+        """
+        Writes the result of a SELECT as Parquet files and returns their prefix,
+        reusing the files of a previous UNLOAD of the same query and watermark
+        """
+        if not normalize_sql(sql).startswith(CACHEABLE_STATEMENTS):
+            raise ValueError("Only SELECT queries can be unloaded")
+
+        key = self.cache_key(sql, watermark, result_format="parquet")
+        output = self.cached_output(key)
+        if output is not None:
+            logger.info("Reusing %s for query %s", output, key)
+            return output
+
+        location = self.unload_location(key)
+        # UNLOAD fails on a non-empty prefix, e.g. files left by a failed attempt
+        self.delete_prefix(location)
+        select = sql.strip().rstrip(";")
+        execution = self.execute(
+            f"UNLOAD ({select}) TO '{location}' "
+            "WITH (format = 'PARQUET', compression = 'SNAPPY')"
+        )
+        self.store_output(key, sql, execution, output=location)
+        return location
+
+    def iter_parquet(self, location: str, batch_size: int = 65536):
+        """
+        Streams the Parquet files under location as Arrow record batches, holding a
+        single file in memory at a time
+        """
+        # pyarrow is only needed by the UNLOAD path
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        bucket, prefix = split_s3_uri(location)
+        paginator = self.s3.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            for item in page.get("Contents", []):
+                if item["Size"] == 0:
+                    continue
+                body = self.s3.get_object(Bucket=bucket, Key=item["Key"])["Body"]
+                parquet_file = pq.ParquetFile(pa.BufferReader(body.read()))
+                yield from parquet_file.iter_batches(batch_size=batch_size)
+
+    def iter_record_batches(
+        self, sql: str, watermark: Optional[str] = None, batch_size: int = 65536
+    ):
+        """
+        Streams the result of a SELECT as Arrow record batches through UNLOAD
+        """
+        yield from self.iter_parquet(self.unload(sql, watermark), batch_size)
@@ -0,0 +1,375 @@
+"""
+Builds the curated layer of the data lake with Athena CTAS and INSERT INTO queries, so
+analysts query partitioned/bucketed Parquet in the curated glue database instead of
+the raw files.
+
+- atomic_events: partitioned by event_date. Each run writes the day to a new
+  run=<ts>/ prefix with a CTAS staging table and then points the glue partition to
+  it, so reruns do not duplicate events and the day is never empty or lost on
+  failure. Only atomic_events_parquet is read: the gzipped JSON history that Firehose
+  delivered before the parquet conversion (raw atomic_events, partitioned by arrival
+  date) is not in the curated layer, read it through stg__atomic_events.
+- orders: latest state of each order from the orders_v2 CDC, bucketed by order_id.
+  The CDC is read from orders_v2_compacted, except for the last COMPACTION_LAG_DAYS
+  days, which the daily compaction may not have covered yet. Orders unchanged since
+  the DMS full load only have a row in its LOAD files (orders_v2_load).
+  Athena can not INSERT INTO bucketed tables, so each run creates a new orders_v<ts>
+  table with CTAS and swaps the orders view to it, keeping the previous version for
+  the queries still reading it.
+- atomic_events_daily and atomic_events_hourly: event and user counts of the curated
+  atomic_events by utm_source, device_type, geo_country and page_url_path, partitioned
+  by event_date. Dashboards sum these small partitions instead of scanning events.
+  users counts the distinct users of its row only and must not be summed, a user is
+  in several rows. Merge the users_sketch HyperLogLog of the rows instead:
+
+    SELECT event_date, utm_source, sum(events) AS events,
+        cardinality(merge(CAST(users_sketch AS HyperLogLog))) AS users
+    FROM atomic_events_daily
+    GROUP BY 1, 2
+
+By default only the event_date partitions affected since the last run are rebuilt:
+the days of the lookback window whose raw files are newer than their curated
+partitions, e.g. events delivered late by Firehose. --date rebuilds a single day. The
+curated_dag Airflow DAG runs the default build daily.
+
+    python -m data_platform.athena.curated
+    python -m data_platform.athena.curated --date 2021-05-20 --tables atomic_events
+"""
+
+import argparse
+import logging
+import re
+from datetime import date, datetime, timedelta, timezone
+
+import boto3
+
+from data_platform.active_environment import active_environment
+from data_platform.athena.client import AthenaQueryRunner, split_s3_uri
+from data_platform.glue_catalog.schemas import TABLES
+
+logger = logging.getLogger(__name__)
+
+ORDERS_BUCKET_COUNT = 16
+# orders_v<ts> tables kept besides the one the view points to
+ORDERS_PREVIOUS_VERSIONS = 1
+ORDERS_VERSION_PATTERN = re.compile(r"orders_v\d+$")
+# Recent days read from the raw tables instead of their _compacted table
+COMPACTION_LAG_DAYS = 2
+# orders_v2_load also reads the CDC date folders under its location
+FULL_LOAD_PATH_PATTERN = r"/LOAD[0-9]+\.parquet$"
+
+PARQUET = "format = 'PARQUET', parquet_compression = 'SNAPPY'"
+
+ROLLUP_DIMENSIONS = ["utm_source", "device_type", "geo_country", "page_url_path"]
+# Rollup table: time grain columns added to the dimensions
+ROLLUPS = {
+    "atomic_events_daily": [],
+    "atomic_events_hourly": ["date_trunc('hour', event_timestamp) AS event_hour"],
+}
+
+# Tables rebuilt for each affected event_date, in this order
+EVENT_TABLES = ["atomic_events"] + list(ROLLUPS)
+
+
+class CuratedBuilder:
+    def __init__(self, runner: AthenaQueryRunner, glue_client=None):
+        self.runner = runner
+        self.glue = glue_client or boto3.client("glue")
+        self.deploy_env = active_environment
+        self.raw_database = f"glue_belisco_{self.deploy_env.value}_data_lake_raw"
+        self.curated_database = f"glue_belisco_{self.deploy_env.value}_data_lake_curated"
+        self.curated_bucket = (
+            f"s3-belisquito-turma-5-{self.deploy_env.value}-data-lake-curated"
+        )
+        self.raw_bucket = f"s3-belisquito-turma-5-{self.deploy_env.value}-data-lake-raw"
+
+    def location(self, *parts: str) -> str:
+        return f"s3://{self.curated_bucket}/{'/'.join(parts)}/"
+
+    def get_table(self, name: str):
+        try:
+            response = self.glue.get_table(DatabaseName=self.curated_database, Name=name)
+        except self.glue.exceptions.EntityNotFoundException:
+            return None
+        return response["Table"]
+
+    def partition_built_at(self, table: str, value: str):
+        """
+        Time of the swap to the partition's current run, which update_partition does
+        not reflect in its CreationTime
+        """
+        try:
+            response = self.glue.get_partition(
+                DatabaseName=self.curated_database,
+                TableName=table,
+                PartitionValues=[value],
+            )
+        except self.glue.exceptions.EntityNotFoundException:
+            return None
+        partition = response["Partition"]
+        built_at = partition.get("Parameters", {}).get("built_at")
+        if built_at is None:
+            return partition["CreationTime"]
+        return datetime.fromisoformat(built_at)
+
+    def raw_modified_at(self, day: str):
+        """
+        Last time Firehose wrote a raw file of the event_date
+        """
+        paginator = self.runner.s3.get_paginator("list_objects_v2")
+        modified = [
+            item["LastModified"]
+            for page in paginator.paginate(
+                Bucket=self.raw_bucket, Prefix=f"atomic_events_parquet/event_date={day}/"
+            )
+            for item in page.get("Contents", [])
+        ]
+        return max(modified, default=None)
+
+    def affected_dates(self, lookback_days: int) -> list:
+        """
+        Days of the lookback window with raw files newer than any of their curated
+        partitions, or missing from a curated table
+        """
+        affected = []
+        for days_ago in range(lookback_days, 0, -1):
+            day = (date.today() - timedelta(days=days_ago)).isoformat()
+            raw_modified_at = self.raw_modified_at(day)
+            if raw_modified_at is None:
+                continue
+            built_at = [self.partition_built_at(table, day) for table in EVENT_TABLES]
+            if None in built_at or raw_modified_at > min(built_at):
+                affected.append(day)
+        return affected
+
+    def swap_partition(self, table: str, value: str, location: str):
+        """
+        Points the partition to location and returns its previous location, if any
+        """
+        storage = dict(self.get_table(table)["StorageDescriptor"], Location=location)
+        partition = {
+            "Values": [value],
+            "StorageDescriptor": storage,
+            "Parameters": {"built_at": datetime.now(timezone.utc).isoformat()},
+        }
+        try:
+            previous = self.glue.get_partition(
+                DatabaseName=self.curated_database,
+                TableName=table,
+                PartitionValues=[value],
+            )["Partition"]
+        except self.glue.exceptions.EntityNotFoundException:
+            self.glue.create_partition(
+                DatabaseName=self.curated_database,
+                TableName=table,
+                PartitionInput=partition,
+            )
+            return None
+        self.glue.update_partition(
+            DatabaseName=self.curated_database,
+            TableName=table,
+            PartitionValueList=[value],
+            PartitionInput=partition,
+        )
+        return previous["StorageDescriptor"]["Location"]
+
+    def delete_other_runs(self, location: str, keep: list):
+        """
+        Deletes the objects under location outside of the keep locations
+        """
+        bucket, prefix = split_s3_uri(location)
+        kept = tuple(split_s3_uri(kept_location)[1] for kept_location in keep)
+        paginator = self.runner.s3.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            objects = [
+                {"Key": item["Key"]}
+                for item in page.get("Contents", [])
+                if not item["Key"].startswith(kept)
+            ]
+            if objects:
+                self.runner.s3.delete_objects(Bucket=bucket, Delete={"Objects": objects})
+
+    def adopt_columns(self, table: str, staging: str):
+        """
+        Gives the table the columns of the staging table when select changed, e.g. a
+        new rollup column. Parquet columns are read by name, so the older partitions
+        read the new ones as null
+        """
+        current = self.get_table(table)
+        columns = self.get_table(staging)["StorageDescriptor"]["Columns"]
+        if current["StorageDescriptor"]["Columns"] == columns:
+            return
+        table_input = {
+            key: current[key]
+            for key in ("Name", "Description", "PartitionKeys", "TableType", "Parameters")
+            if key in current
+        }
+        table_input["StorageDescriptor"] = dict(
+            current["StorageDescriptor"], Columns=columns
+        )
+        self.glue.update_table(DatabaseName=self.curated_database, TableInput=table_input)
+        logger.info("Updated the columns of %s", table)
+
+    def build_partition(self, table: str, partition_key: str, value: str, select: str):
+        """
+        Builds the partition of `select` in a new run prefix and then points the glue
+        partition to it, so readers see the previous version until the swap and a
+        failed run leaves it in place. The partition key must be the last column of
+        select
+        """
+        if self.get_table(table) is None:
+            # CTAS fails on a non-empty location, e.g. left by a dropped table
+            self.runner.delete_prefix(self.location(table))
+            self.runner.execute(
+                f"CREATE TABLE {self.curated_database}.{table} WITH ({PARQUET}, "
+                f"external_location = '{self.location(table)}', "
+                f"partitioned_by = ARRAY['{partition_key}']) AS {select} WITH NO DATA"
+            )
+
+        run = f"{datetime.utcnow():%Y%m%d%H%M%S}"
+        run_location = self.location(table, f"{partition_key}={value}", f"run={run}")
+        staging = f"{table}__{value.replace('-', '')}_{run}"
+        self.runner.execute(
+            f"CREATE TABLE {self.curated_database}.{staging} WITH ({PARQUET}, "
+            f"external_location = '{run_location}', "
+            f"partitioned_by = ARRAY['{partition_key}']) AS {select}"
+        )
+        self.adopt_columns(table, staging)
+        # The data now belongs to the partition, deleting the table keeps it
+        self.glue.delete_table(DatabaseName=self.curated_database, Name=staging)
+
+        previous = self.swap_partition(
+            table, value, f"{run_location}{partition_key}={value}/"
+        )
+        # The previous run is kept for the queries still reading it
+        self.delete_other_runs(
+            self.location(table, f"{partition_key}={value}"),
+            keep=[run_location] + ([previous] if previous else []),
+        )
+        logger.info("Built %s partition %s=%s in %s", table, partition_key, value, run)
+
+    def build_atomic_events(self, day: str):
+        columns = ", ".join(
+            column.name for column in TABLES["atomic_events_parquet"].columns
+        )
+        self.build_partition(
+            "atomic_events",
+            "event_date",
+            day,
+            f"SELECT {columns}, event_date "
+            f"FROM {self.raw_database}.atomic_events_parquet "
+            f"WHERE event_date = '{day}'",
+        )
+
+    def build_rollups(self, day: str):
+        for table, grain in ROLLUPS.items():
+            keys = grain + ROLLUP_DIMENSIONS
+            # Presto groups by position, event_date is the last column
+            group_by = list(range(1, len(keys) + 1)) + [len(keys) + 4]
+            self.build_partition(
+                table,
+                "event_date",
+                day,
+                f"SELECT {', '.join(keys)}, count(1) AS events, "
+                "count(DISTINCT user_domain_id) AS users, "
+                "CAST(approx_set(user_domain_id) AS varbinary) AS users_sketch, "
+                "event_date "
+                f"FROM {self.curated_database}.atomic_events "
+                f"WHERE event_date = '{day}' "
+                f"GROUP BY {', '.join(map(str, group_by))}",
+            )
+
+    def orders_cdc(self) -> str:
+        """
+        orders_v2 full load and changes, from the compacted table for the days it
+        already covers
+        """
+        columns = ", ".join(column.name for column in TABLES["orders_v2"].columns)
+        compacted_until = date.today() - timedelta(days=COMPACTION_LAG_DAYS)
+        return (
+            f"SELECT {columns} FROM {self.raw_database}.orders_v2_load "
+            f"WHERE regexp_like(\"$path\", '{FULL_LOAD_PATH_PATTERN}') "
+            "UNION ALL "
+            f"SELECT {columns} FROM {self.raw_database}.orders_v2_compacted "
+            f"WHERE extracted_date < '{compacted_until}' "
+            "UNION ALL "
+            f"SELECT {columns} FROM {self.raw_database}.orders_v2 "
+            f"WHERE extracted_date >= DATE '{compacted_until}'"
+        )
+
+    def build_orders(self, bucket_count: int = ORDERS_BUCKET_COUNT) -> str:
+        version = f"orders_v{datetime.utcnow():%Y%m%d%H%M%S}"
+        self.runner.execute(
+            f"CREATE TABLE {self.curated_database}.{version} WITH ({PARQUET}, "
+            f"external_location = '{self.location('orders', version)}', "
+            f"bucketed_by = ARRAY['order_id'], bucket_count = {bucket_count}) AS "
+            "SELECT order_id, created_at, product_name, value, extracted_at, "
+            "CAST(created_at AS date) AS created_date "
+            "FROM ("
+            "SELECT *, row_number() OVER ("
+            "PARTITION BY order_id ORDER BY extracted_at DESC) AS row_rank "
+            f"FROM ({self.orders_cdc()})"
+            ") "
+            "WHERE row_rank = 1 AND coalesce(op, 'I') <> 'D'"
+        )
+        self.runner.execute(
+            f"CREATE OR REPLACE VIEW {self.curated_database}.orders AS "
+            f"SELECT * FROM {self.curated_database}.{version}"
+        )
+        logger.info("Swapped the orders view to %s", version)
+        self.drop_old_orders_versions(keep=ORDERS_PREVIOUS_VERSIONS + 1)
+        return version
+
+    def drop_old_orders_versions(self, keep: int):
+        paginator = self.glue.get_paginator("get_tables")
+        versions = [
+            table
+            for page in paginator.paginate(
+                DatabaseName=self.curated_database, Expression="orders_v.*"
+            )
+            for table in page["TableList"]
+            if ORDERS_VERSION_PATTERN.match(table["Name"])
+        ]
+        # Timestamped names sort by creation
+        versions.sort(key=lambda table: table["Name"], reverse=True)
+        for table in versions[keep:]:
+            self.glue.delete_table(DatabaseName=self.curated_database, Name=table["Name"])
+            self.runner.delete_prefix(table["StorageDescriptor"]["Location"])
+            logger.info("Dropped %s", table["Name"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--workgroup",
+        default=f"s3-belisco-{active_environment.value}-data-lake-athena-workgroup-curated",
+    )
+    parser.add_argument(
+        "--date", help="event_date rebuilt, the affected ones of the lookback by default"
+    )
+    parser.add_argument("--lookback-days", type=int, default=3)
+    parser.add_argument(
+        "--tables",
+        nargs="+",
+        choices=["atomic_events", "rollups", "orders"],
+        default=None,
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    builder = CuratedBuilder(AthenaQueryRunner(workgroup=args.workgroup))
+    tables = args.tables or ["atomic_events", "rollups", "orders"]
+    if "atomic_events" in tables or "rollups" in tables:
+        days = [args.date] if args.date else builder.affected_dates(args.lookback_days)
+        logger.info("Rebuilding event dates %s", days)
+        for day in days:
+            if "atomic_events" in tables:
+                builder.build_atomic_events(day)
+            if "rollups" in tables:
+                builder.build_rollups(day)
+    if "orders" in tables:
+        builder.build_orders()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,22 @@ from aws_cdk import core
 from data_platform.athena.base import BaseAthenaBucket, BaseAthenaWorkgroup
 from data_platform.active_environment import active_environment
 
+# Workgroup of each team querying the data lake, with its own scan cutoff per query
+TEAM_WORKGROUPS = {
+    "analytics": {"gb_scanned_cutoff_per_query": 10, "description": "Analises ad hoc"},
+    "dashboards": {"gb_scanned_cutoff_per_query": 1, "description": "Dashboards"},
+    "data-engineering": {
+        "gb_scanned_cutoff_per_query": 50,
+        "description": "Cargas e backfills da plataforma",
+    },
+    # CTAS with external_location fails when the workgroup enforces its settings
+    "curated": {
+        "gb_scanned_cutoff_per_query": 50,
+        "description": "Cargas do curated com CTAS em external_location",
+        "enforce_configuration": False,
+    },
+}
+
 
 class AthenaStack(core.Stack):
     def __init__(self, scope: core.Construct, **kwargs) -> None:
@@ -16,3 +32,10 @@ class AthenaStack(core.Stack):
         self.athena_workgroup = BaseAthenaWorkgroup(
             self, athena_bucket=self.athena_bucket, gb_scanned_cutoff_per_query=1
         )
+
+        self.team_workgroups = {
+            team: BaseAthenaWorkgroup(
+                self, athena_bucket=self.athena_bucket, team=team, **settings
+            )
+            for team, settings in TEAM_WORKGROUPS.items()
+        }
@@ -1,6 +1,8 @@
 from aws_cdk import core
 from aws_cdk import (
     aws_s3 as s3,
+    aws_s3_notifications as s3n,
+    aws_sns as sns,
 )
 from data_platform.data_lake.base import BaseDataLakeBucket, DataLakeLayer
 
@@ -31,3 +33,16 @@ class DataLakeStack(core.Stack):
         self.data_lake_raw_staged = BaseDataLakeBucket(self, layer=DataLakeLayer.STAGED)
 
         self.data_lake_raw_curated = BaseDataLakeBucket(self, layer=DataLakeLayer.CURATED)
+
+        self.data_lake_raw_object_created_topic = sns.Topic(
+            self,
+            id=f"sns-{self.deploy_env.value}-data-lake-raw-object-created",
+            topic_name=f"sns-{self.deploy_env.value}-data-lake-raw-object-created",
+        )
+
+        # A single topic fans out the bucket events, since S3 only allows one
+        # notification per event type and prefix
+        self.data_lake_raw_bucket.add_event_notification(
+            s3.EventType.OBJECT_CREATED,
+            s3n.SnsDestination(self.data_lake_raw_object_created_topic),
+        )
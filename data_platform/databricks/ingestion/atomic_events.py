@@ -0,0 +1,189 @@
+"""
+Streams atomic events from the raw bucket into the staged Delta table with Auto Loader.
+
+The read schema is the pinned StructType generated from the table spec
+(data_platform/databricks/schemas/), so no inference pass runs over the raw history on
+restart. Drift is checked by inferring the schema of a few files from the latest
+partition only. New files come from the SQS queue subscribed to the raw bucket
+notifications (file notification mode), so the source prefix is never listed.
+
+Runs as a Databricks spark_python_task or from a notebook:
+
+    python atomic_events.py --schema-path s3://.../schemas/atomic_events_parquet.json \
+        --source-path s3://.../atomic_events_parquet --source-format parquet \
+        --queue-url https://sqs... --target-path s3://.../atomic_events \
+        --checkpoint-location dbfs:/checkpoints/atomic_events --once
+"""
+
+import argparse
+import json
+import logging
+from datetime import date, timedelta
+
+from pyspark.sql import DataFrame, SparkSession
+from pyspark.sql import functions as F
+from pyspark.sql.types import StructType
+
+logger = logging.getLogger(__name__)
+
+# Format of event_timestamp in the JSON sent by fake_web_events
+TIMESTAMP_FORMAT = "yyyy-MM-dd HH:mm:ss.SSSSSS"
+
+# Partition folder written by Firehose for each source format
+PARTITION_KEYS = {"json": "landing_date", "parquet": "event_date"}
+
+
+def load_schema(spark: SparkSession, path: str) -> StructType:
+    content = spark.sparkContext.wholeTextFiles(path).values().first()
+    return StructType.fromJson(json.loads(content))
+
+
+def sample_files(spark: SparkSession, source_path: str, source_format: str, files: int):
+    """
+    Returns up to `files` paths from the most recent partition of the last few days,
+    listing only those partition folders
+    """
+    jvm = spark.sparkContext._jvm
+    conf = spark.sparkContext._jsc.hadoopConfiguration()
+    for days_ago in range(3):
+        day = (date.today() - timedelta(days=days_ago)).isoformat()
+        folder = jvm.org.apache.hadoop.fs.Path(
+            f"{source_path}/{PARTITION_KEYS[source_format]}={day}"
+        )
+        fs = folder.getFileSystem(conf)
+        if not fs.exists(folder):
+            continue
+        statuses = sorted(
+            fs.listStatus(folder), key=lambda status: -status.getModificationTime()
+        )
+        paths = [str(status.getPath()) for status in statuses if status.isFile()]
+        if paths:
+            return paths[:files]
+    return []
+
+
+def detect_drift(
+    spark: SparkSession,
+    source_path: str,
+    source_format: str,
+    schema: StructType,
+    files: int = 10,
+) -> list:
+    """
+    Compares the pinned schema with the schema inferred from a small sample of recent
+    files and returns the differences
+    """
+    paths = sample_files(spark, source_path, source_format, files)
+    if not paths:
+        logger.warning("No recent files to check for schema drift")
+        return []
+    reader = spark.read.format(source_format)
+    if source_format == "json":
+        reader = reader.option("timestampFormat", TIMESTAMP_FORMAT)
+    sampled = {field.name: field.dataType for field in reader.load(paths).schema}
+    pinned = {field.name: field.dataType for field in schema}
+
+    drift = [f"new field {name}" for name in sampled if name not in pinned]
+    for name, data_type in pinned.items():
+        if name not in sampled:
+            drift.append(f"missing field {name}")
+        # JSON inference reads timestamps and numbers as strings, only parquet has types
+        elif source_format == "parquet" and sampled[name] != data_type:
+            drift.append(f"{name} is {sampled[name].simpleString()}")
+    return drift
+
+
+def read_stream(
+    spark: SparkSession,
+    source_path: str,
+    source_format: str,
+    schema: StructType,
+    queue_url: str,
+    region: str,
+) -> DataFrame:
+    return (
+        spark.readStream.format("cloudFiles")
+        .option("cloudFiles.format", source_format)
+        .option("cloudFiles.useNotifications", "true")
+        .option("cloudFiles.queueUrl", queue_url)
+        .option("cloudFiles.region", region)
+        .option("timestampFormat", TIMESTAMP_FORMAT)
+        .schema(schema)
+        .load(source_path)
+    )
+
+
+def add_etl_columns(df: DataFrame) -> DataFrame:
+    return (
+        df.withColumn("etl_timestamp", F.current_timestamp())
+        .withColumn("event_date", F.to_date(F.col("event_timestamp")))
+        .withColumn("source_filename", F.input_file_name())
+    )
+
+
+def write_stream(df: DataFrame, target_path: str, checkpoint_location: str, once: bool):
+    writer = (
+        df.writeStream.format("delta")
+        .partitionBy("event_date")
+        .option("checkpointLocation", checkpoint_location)
+    )
+    if once:
+        writer = writer.trigger(once=True)
+    return writer.start(target_path)
+
+
+def run(
+    spark: SparkSession,
+    schema_path: str,
+    source_path: str,
+    source_format: str,
+    queue_url: str,
+    region: str,
+    target_path: str,
+    checkpoint_location: str,
+    once: bool = False,
+    fail_on_drift: bool = False,
+):
+    schema = load_schema(spark, schema_path)
+    drift = detect_drift(spark, source_path, source_format, schema)
+    if drift:
+        message = f"Schema drift in {source_path}: {', '.join(drift)}"
+        if fail_on_drift:
+            raise ValueError(message)
+        logger.warning(message)
+
+    df = read_stream(spark, source_path, source_format, schema, queue_url, region)
+    return write_stream(add_etl_columns(df), target_path, checkpoint_location, once)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Streams atomic events into Delta")
+    parser.add_argument("--schema-path", required=True)
+    parser.add_argument("--source-path", required=True)
+    parser.add_argument("--source-format", choices=sorted(PARTITION_KEYS), default="json")
+    parser.add_argument("--queue-url", required=True)
+    parser.add_argument("--region", default="us-east-1")
+    parser.add_argument("--target-path", required=True)
+    parser.add_argument("--checkpoint-location", required=True)
+    parser.add_argument("--once", action="store_true", help="process new files and stop")
+    parser.add_argument("--fail-on-drift", action="store_true")
+    args = parser.parse_args(argv)
+
+    spark = SparkSession.builder.getOrCreate()
+    query = run(
+        spark,
+        schema_path=args.schema_path,
+        source_path=args.source_path,
+        source_format=args.source_format,
+        queue_url=args.queue_url,
+        region=args.region,
+        target_path=args.target_path,
+        checkpoint_location=args.checkpoint_location,
+        once=args.once,
+        fail_on_drift=args.fail_on_drift,
+    )
+    query.awaitTermination()
+
+
+if __name__ == "__main__":
+    main()
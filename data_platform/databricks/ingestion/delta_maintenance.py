@@ -0,0 +1,147 @@
+"""
+Compacts the staged Delta tables written by the streaming jobs, Z-ordering them on
+their lookup key, and removes the files no longer referenced after the retention.
+
+Streaming microbatches leave many small files in every partition. OPTIMIZE rewrites
+the recent partitions into large files clustered by the Z-order column, so queries
+filtering on it (user_domain_id, the cookie_id sessionized by conversion.sql, and
+order_id, the key of the CDC merge) skip most files. File counts and the time of a
+point lookup are logged before and after.
+
+Runs as a Databricks spark_python_task, scheduled by the delta_maintenance DAG:
+
+    python delta_maintenance.py \
+        --table s3://.../atomic_events,user_domain_id,event_date \
+        --table s3://.../orders,order_id,created_date \
+        --partition-days 7 --retention-hours 168
+"""
+
+import argparse
+import logging
+import time
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import Optional
+
+from pyspark.sql import SparkSession
+from pyspark.sql import functions as F
+
+logger = logging.getLogger(__name__)
+
+# Delta refuses to vacuum less than 7 days, the longest a streaming reader may lag
+MIN_RETENTION_HOURS = 168
+
+
+@dataclass(frozen=True)
+class MaintainedTable:
+    path: str
+    zorder_column: str
+    partition_column: Optional[str] = None
+
+    @classmethod
+    def parse(cls, value: str) -> "MaintainedTable":
+        """
+        Reads <path>,<zorder column>[,<partition column>]
+        """
+        return cls(*value.split(","))
+
+
+@dataclass(frozen=True)
+class TableStats:
+    files: int
+    size_bytes: int
+    lookup_seconds: float
+
+
+def table_stats(spark: SparkSession, table: MaintainedTable, lookup_value) -> TableStats:
+    detail = spark.sql(f"DESCRIBE DETAIL delta.`{table.path}`").first()
+    start = time.monotonic()
+    if lookup_value is not None:
+        (
+            spark.read.format("delta")
+            .load(table.path)
+            .filter(F.col(table.zorder_column) == lookup_value)
+            .count()
+        )
+    return TableStats(
+        files=detail["numFiles"],
+        size_bytes=detail["sizeInBytes"],
+        lookup_seconds=time.monotonic() - start,
+    )
+
+
+def partition_predicate(table: MaintainedTable, partition_days: Optional[int]) -> str:
+    """
+    Restricts OPTIMIZE to the partitions still receiving streaming writes, the older
+    ones were already compacted by previous runs
+    """
+    if not table.partition_column or not partition_days:
+        return ""
+    since = (date.today() - timedelta(days=partition_days)).isoformat()
+    return f" WHERE {table.partition_column} >= '{since}'"
+
+
+def maintain(
+    spark: SparkSession,
+    table: MaintainedTable,
+    retention_hours: int = MIN_RETENTION_HOURS,
+    partition_days: Optional[int] = None,
+):
+    # The same key is looked up before and after, so the timings are comparable
+    sample = (
+        spark.read.format("delta").load(table.path).select(table.zorder_column).first()
+    )
+    lookup_value = sample[0] if sample else None
+
+    before = table_stats(spark, table, lookup_value)
+    spark.sql(
+        f"OPTIMIZE delta.`{table.path}`{partition_predicate(table, partition_days)} "
+        f"ZORDER BY ({table.zorder_column})"
+    )
+    spark.sql(f"VACUUM delta.`{table.path}` RETAIN {retention_hours} HOURS")
+    after = table_stats(spark, table, lookup_value)
+
+    logger.info(
+        "%s: %d -> %d files, %.1f -> %.1f MB, lookup on %s %.2fs -> %.2fs",
+        table.path,
+        before.files,
+        after.files,
+        before.size_bytes / 2**20,
+        after.size_bytes / 2**20,
+        table.zorder_column,
+        before.lookup_seconds,
+        after.lookup_seconds,
+    )
+    return before, after
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Optimizes and vacuums Delta tables")
+    parser.add_argument(
+        "--table",
+        action="append",
+        required=True,
+        type=MaintainedTable.parse,
+        help="<path>,<zorder column>[,<partition column>], repeatable",
+    )
+    parser.add_argument("--retention-hours", type=int, default=MIN_RETENTION_HOURS)
+    parser.add_argument(
+        "--partition-days",
+        type=int,
+        default=None,
+        help="only optimizes partitions of the last N days, all of them by default",
+    )
+    args = parser.parse_args(argv)
+    if args.retention_hours < MIN_RETENTION_HOURS:
+        parser.error(f"--retention-hours must be at least {MIN_RETENTION_HOURS}")
+
+    logging.basicConfig(level=logging.INFO)
+    spark = SparkSession.builder.getOrCreate()
+    # Timings must read from S3, not from the disk cache warmed by the first lookup
+    spark.conf.set("spark.databricks.io.cache.enabled", "false")
+    for table in args.table:
+        maintain(spark, table, args.retention_hours, args.partition_days)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""
+Merges the orders_v2 changes captured by DMS into the staged orders Delta table.
+
+Each microbatch keeps only the latest change of every order_id, then inserts, updates
+or deletes it according to the DMS op column (I/U/D), unless the target row has a
+newer extracted_at, e.g. when files are reprocessed. The merge condition lists the
+created_date partitions touched by the batch, so Delta only reads the files of those
+partitions instead of the whole table.
+
+Runs as a Databricks spark_python_task or from a notebook:
+
+    python orders_cdc.py --schema-path s3://.../schemas/orders_v2.json \
+        --source-path s3://.../orders/public/orders_v2 --target-path s3://.../orders \
+        --checkpoint-location dbfs:/checkpoints/orders_v2 --once
+"""
+
+import argparse
+import json
+import logging
+from dataclasses import dataclass
+
+from delta.tables import DeltaTable
+from pyspark.sql import DataFrame, SparkSession
+from pyspark.sql import functions as F
+from pyspark.sql.types import StructType
+from pyspark.sql.window import Window
+
+logger = logging.getLogger(__name__)
+
+KEY_COLUMN = "order_id"
+PARTITION_COLUMN = "created_date"
+
+# Full load rows have no op, they are inserts
+IS_DELETE = "coalesce(updates.op, 'I') = 'D'"
+IS_UPSERT = "coalesce(updates.op, 'I') != 'D'"
+# A change replayed or delivered out of order must not overwrite a newer one
+IS_NEWER = "updates.extracted_at >= target.extracted_at"
+
+
+@dataclass(frozen=True)
+class MergeMetrics:
+    batch_id: int
+    rows_in: int
+    rows_merged: int
+    rows_inserted: int
+    rows_updated: int
+    rows_deleted: int
+    files_added: int
+    files_removed: int
+    partitions: int
+
+
+def load_schema(spark: SparkSession, path: str) -> StructType:
+    content = spark.sparkContext.wholeTextFiles(path).values().first()
+    return StructType.fromJson(json.loads(content))
+
+
+def add_etl_columns(df: DataFrame) -> DataFrame:
+    return (
+        df.withColumn("etl_timestamp", F.current_timestamp())
+        .withColumn(PARTITION_COLUMN, F.to_date(F.col("created_at")))
+        .withColumn("source_filename", F.input_file_name())
+    )
+
+
+def latest_changes(microbatch: DataFrame) -> DataFrame:
+    """
+    Keeps the last change of each order in the batch. DMS writes extracted_at with
+    microseconds, the file name breaks ties between changes of the same instant
+    """
+    window = Window.partitionBy(KEY_COLUMN).orderBy(
+        F.col("extracted_at").desc(), F.col("source_filename").desc()
+    )
+    return (
+        microbatch.withColumn("row_rank", F.row_number().over(window))
+        .filter(F.col("row_rank") == 1)
+        .drop("row_rank")
+    )
+
+
+def batch_partitions(changes: DataFrame) -> list:
+    """
+    created_date partitions touched by the batch, or an empty list when some change
+    has none. DMS may write deletes with the primary key only
+    """
+    dates = [
+        row[PARTITION_COLUMN]
+        for row in changes.select(PARTITION_COLUMN).distinct().collect()
+    ]
+    if None in dates:
+        return []
+    return sorted(dates)
+
+
+def merge_condition(partitions: list) -> str:
+    """
+    Joins on the key and restricts the target to the given partitions, so the merge
+    only reads their files
+    """
+    condition = f"target.{KEY_COLUMN} = updates.{KEY_COLUMN}"
+    if not partitions:
+        return condition
+    values = ", ".join(f"'{day.isoformat()}'" for day in partitions)
+    return f"{condition} AND target.{PARTITION_COLUMN} IN ({values})"
+
+
+def commit_tag(batch_id: int) -> str:
+    return f"orders_cdc batch {batch_id}"
+
+
+def merge_metrics(target: DeltaTable, batch_id: int, rows_in: int, partitions: int):
+    """
+    Reads the metrics of the MERGE commit tagged with the batch, the latest commit may
+    be another operation such as an OPTIMIZE
+    """
+    commit = (
+        target.history(20)
+        .filter(
+            (F.col("operation") == "MERGE")
+            & (F.col("userMetadata") == commit_tag(batch_id))
+        )
+        .orderBy(F.col("version").desc())
+        .select("operationMetrics")
+        .first()
+    )
+    if commit is None:
+        logger.warning("No MERGE commit found for orders batch %s", batch_id)
+    operation_metrics = (commit and commit[0]) or {}
+
+    def metric(name):
+        return int(operation_metrics.get(name, 0))
+
+    inserted = metric("numTargetRowsInserted")
+    updated = metric("numTargetRowsUpdated")
+    deleted = metric("numTargetRowsDeleted")
+    return MergeMetrics(
+        batch_id=batch_id,
+        rows_in=rows_in,
+        rows_merged=inserted + updated + deleted,
+        rows_inserted=inserted,
+        rows_updated=updated,
+        rows_deleted=deleted,
+        files_added=metric("numTargetFilesAdded"),
+        files_removed=metric("numTargetFilesRemoved"),
+        partitions=partitions,
+    )
+
+
+def merge_batch(target: DeltaTable, microbatch: DataFrame, batch_id: int) -> MergeMetrics:
+    spark = microbatch.sql_ctx.sparkSession
+    # The microbatch is counted, ranked and merged, so its files are read only once
+    microbatch.persist()
+    changes = latest_changes(microbatch).persist()
+    try:
+        rows_in = microbatch.count()
+        partitions = batch_partitions(changes)
+        condition = merge_condition(partitions)
+        spark.conf.set(
+            "spark.databricks.delta.commitInfo.userMetadata", commit_tag(batch_id)
+        )
+        try:
+            (
+                target.alias("target")
+                .merge(changes.alias("updates"), condition)
+                .whenMatchedDelete(condition=f"{IS_DELETE} AND {IS_NEWER}")
+                .whenMatchedUpdateAll(condition=f"{IS_UPSERT} AND {IS_NEWER}")
+                .whenNotMatchedInsertAll(condition=IS_UPSERT)
+                .execute()
+            )
+        finally:
+            spark.conf.unset("spark.databricks.delta.commitInfo.userMetadata")
+    finally:
+        changes.unpersist()
+        microbatch.unpersist()
+    metrics = merge_metrics(target, batch_id, rows_in, len(partitions))
+    logger.info("Merged orders batch: %s", metrics)
+    return metrics
+
+
+def upsert(spark: SparkSession, target_path: str, on_metrics=None):
+    """
+    Returns the foreachBatch function merging into the Delta table at target_path.
+    on_metrics, if given, receives the MergeMetrics of every batch
+    """
+    target = DeltaTable.forPath(spark, target_path)
+
+    def _upsert(microbatch: DataFrame, batch_id: int):
+        metrics = merge_batch(target, microbatch, batch_id)
+        if on_metrics:
+            on_metrics(metrics)
+
+    return _upsert
+
+
+def read_stream(spark: SparkSession, source_path: str, schema: StructType) -> DataFrame:
+    # DMS writes date folders (e.g. 2021-05-20/), not key=value partitions
+    return (
+        spark.readStream.format("parquet")
+        .option("recursiveFileLookup", "true")
+        .schema(schema)
+        .load(source_path)
+    )
+
+
+def run(
+    spark: SparkSession,
+    schema_path: str,
+    source_path: str,
+    target_path: str,
+    checkpoint_location: str,
+    once: bool = False,
+    on_metrics=None,
+):
+    schema = load_schema(spark, schema_path)
+    df = add_etl_columns(read_stream(spark, source_path, schema))
+    if not DeltaTable.isDeltaTable(spark, target_path):
+        spark.createDataFrame([], df.schema).write.format("delta").partitionBy(
+            PARTITION_COLUMN
+        ).save(target_path)
+
+    writer = (
+        df.writeStream.option("checkpointLocation", checkpoint_location)
+        .outputMode("update")
+        .foreachBatch(upsert(spark, target_path, on_metrics))
+    )
+    if once:
+        writer = writer.trigger(once=True)
+    return writer.start()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Merges the orders CDC into Delta")
+    parser.add_argument("--schema-path", required=True)
+    parser.add_argument("--source-path", required=True)
+    parser.add_argument("--target-path", required=True)
+    parser.add_argument("--checkpoint-location", required=True)
+    parser.add_argument("--once", action="store_true", help="process new files and stop")
+    args = parser.parse_args(argv)
+
+    spark = SparkSession.builder.getOrCreate()
+    query = run(
+        spark,
+        schema_path=args.schema_path,
+        source_path=args.source_path,
+        target_path=args.target_path,
+        checkpoint_location=args.checkpoint_location,
+        once=args.once,
+    )
+    query.awaitTermination()
+
+
+if __name__ == "__main__":
+    main()
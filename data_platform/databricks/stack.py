@@ -1,10 +1,17 @@
 from aws_cdk import core
+import os
+
 from aws_cdk import (
     aws_iam as iam,
     aws_s3 as s3,
+    aws_s3_deployment as s3deploy,
+    aws_sns as sns,
+    aws_sqs as sqs,
 )
 from data_platform.active_environment import active_environment
 
+DATABRICKS_DIR = os.path.dirname(__file__)
+
 
 class DatabricksStack(core.Stack):
     """
@@ -21,8 +28,14 @@ class DatabricksStack(core.Stack):
     https://docs.aws.amazon.com/glue/latest/dg/aws-glue-programming-etl-glue-data-catalog-hive.html
     """
 
-    def __init__(self, scope: core.Construct, **kwargs) -> None:
+    def __init__(
+        self,
+        scope: core.Construct,
+        raw_object_created_topic: sns.ITopic,
+        **kwargs,
+    ) -> None:
         self.deploy_env = active_environment
+        self.raw_object_created_topic = raw_object_created_topic
         super().__init__(scope, id=f"{self.deploy_env.value}-databricks-stack", **kwargs)
 
         cross_account_role = iam.Role(
@@ -226,3 +239,72 @@ class DatabricksStack(core.Stack):
         )
 
         cross_account_role.attach_inline_policy(cross_account_policy_data_access)
+
+        # Auto Loader file notification mode reads new raw objects from this queue
+        # instead of listing the bucket. It gets the raw S3 events through the topic,
+        # since the bucket already sends its notifications there
+        self.raw_object_created_queue = sqs.Queue(
+            self,
+            id=f"sqs-{self.deploy_env.value}-databricks-raw-object-created",
+            queue_name=f"sqs-{self.deploy_env.value}-databricks-raw-object-created",
+            retention_period=core.Duration.days(14),
+        )
+        self.raw_object_created_queue.add_to_resource_policy(
+            iam.PolicyStatement(
+                actions=["sqs:SendMessage"],
+                principals=[iam.ServicePrincipal("sns.amazonaws.com")],
+                resources=[self.raw_object_created_queue.queue_arn],
+                conditions={
+                    "ArnEquals": {
+                        "aws:SourceArn": self.raw_object_created_topic.topic_arn
+                    }
+                },
+            )
+        )
+        raw_object_created_subscription = sns.Subscription(
+            self,
+            id=f"sns-{self.deploy_env.value}-databricks-raw-object-created-subscription",
+            topic=self.raw_object_created_topic,
+            endpoint=self.raw_object_created_queue.queue_arn,
+            protocol=sns.SubscriptionProtocol.SQS,
+            raw_message_delivery=True,
+        )
+        # The topic gets every object of the raw bucket, Auto Loader only reads
+        # atomic_events_parquet. S3 events carry no message attributes, so the policy
+        # filters on the message body, which CDK does not support yet
+        raw_object_created_subscription.node.default_child.add_property_override(
+            "FilterPolicyScope", "MessageBody"
+        )
+        raw_object_created_subscription.node.default_child.add_property_override(
+            "FilterPolicy",
+            {
+                "Records": {
+                    "s3": {"object": {"key": [{"prefix": "atomic_events_parquet/"}]}}
+                }
+            },
+        )
+        self.raw_object_created_queue.grant_consume_messages(access_role)
+        self.raw_object_created_queue.grant(access_role, "sqs:GetQueueUrl")
+
+        # Ingestion entry points and their pinned schemas, read by the clusters
+        bucket.grant_read(access_role, "ingestion/*")
+        s3deploy.BucketDeployment(
+            self,
+            id=f"{self.deploy_env.value}-databricks-ingestion",
+            destination_bucket=bucket,
+            destination_key_prefix="ingestion/",
+            # Keeps ingestion/schemas/, uploaded by the deployment below
+            prune=False,
+            sources=[
+                s3deploy.Source.asset(
+                    os.path.join(DATABRICKS_DIR, "ingestion"), exclude=["__pycache__"]
+                )
+            ],
+        )
+        s3deploy.BucketDeployment(
+            self,
+            id=f"{self.deploy_env.value}-databricks-ingestion-schemas",
+            destination_bucket=bucket,
+            destination_key_prefix="ingestion/schemas/",
+            sources=[s3deploy.Source.asset(os.path.join(DATABRICKS_DIR, "schemas"))],
+        )
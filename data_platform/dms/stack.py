@@ -10,6 +10,7 @@ import json
 from common_stack import CommonStack
 from data_platform.data_lake.base import BaseDataLakeBucket
 from data_platform.active_environment import active_environment
+from data_platform.sizing import sizing_profile
 
 
 class RawDMSRole(iam.Role):
@@ -94,7 +95,7 @@ class OrdersDMS(dms.CfnReplicationTask):
             endpoint_type="target",
             engine_name="s3",
             endpoint_identifier=f"dms-target-{self.deploy_env.value}-orders-s3-endpoint",
-            extra_connection_attributes="DataFormat=parquet;maxFileSize=131072;timestampColumnName=extracted_at;includeOpForFullLoad=true;cdcMaxBatchInterval=120",
+            extra_connection_attributes=f"DataFormat=parquet;maxFileSize={sizing_profile.dms.max_file_size_kb};timestampColumnName=extracted_at;includeOpForFullLoad=true;cdcMaxBatchInterval={sizing_profile.dms.cdc_max_batch_interval_seconds};cdcMinFileSize={sizing_profile.dms.cdc_min_file_size_kb};DatePartitionEnabled=true;DatePartitionSequence=YYYYMMDD;DatePartitionDelimiter=DASH",
             s3_settings=dms.CfnEndpoint.S3SettingsProperty(
                 bucket_name=self.data_lake_raw_bucket.bucket_name,
                 bucket_folder="orders",
@@ -128,10 +129,10 @@ class OrdersDMS(dms.CfnReplicationTask):
         self.instance = dms.CfnReplicationInstance(
             scope,
             f"dms-replication-instance-{self.deploy_env.value}",
-            allocated_storage=100,
+            allocated_storage=sizing_profile.dms.allocated_storage_gb,
             publicly_accessible=False,
             engine_version="3.4.4",
-            replication_instance_class="dms.t2.small",
+            replication_instance_class=sizing_profile.dms.replication_instance_class,
             replication_instance_identifier=f"dms-{self.deploy_env.value}-replication-instance",
             vpc_security_group_ids=[self.dms_sg.security_group_id],
             replication_subnet_group_identifier=self.dms_subnet_group.replication_subnet_group_identifier,
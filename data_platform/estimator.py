@@ -0,0 +1,296 @@
+"""
+Estimates the files written to the data lake, their size, the worst-case Athena query
+cost and the ingestion headroom from the synthesized templates, without any AWS call.
+
+    cdk synth
+    python -m data_platform.estimator --events-per-second 200 --orders-per-second 20
+
+Only reads cdk.out, so it runs for any environment that was synthesized, e.g. to
+compare capacity changes in code review.
+"""
+
+import argparse
+import glob
+import json
+import os
+import re
+from collections import defaultdict
+
+# Average size of a fake_web_events JSON event and of an orders_v2 row
+EVENT_BYTES = 1100
+ORDER_BYTES = 120
+
+# Size of the written objects relative to the raw JSON/row bytes
+COMPRESSION_RATIO = {"GZIP": 0.12, "PARQUET": 0.15, "UNCOMPRESSED": 1.0}
+
+ATHENA_USD_PER_TB_SCANNED = 5.0
+
+# Default Firehose DirectPut quotas in us-east-1, per delivery stream
+FIREHOSE_MAX_RECORDS_PER_SECOND = 500000
+FIREHOSE_MAX_BYTES_PER_SECOND = 5 * 2**20
+
+# Concurrent tasks each MWAA worker runs by default
+MWAA_TASKS_PER_WORKER = {"mw1.small": 5, "mw1.medium": 10, "mw1.large": 20}
+
+REDSHIFT_SLICES_PER_NODE = {
+    "dc2.large": 2,
+    "dc2.8xlarge": 16,
+    "ds2.xlarge": 2,
+    "ds2.8xlarge": 16,
+    "ra3.xlplus": 2,
+    "ra3.4xlarge": 4,
+    "ra3.16xlarge": 16,
+}
+
+LAYER_PATTERN = re.compile(r"datalake(raw|staged|curated)")
+
+
+def load_resources(cdk_out: str):
+    """
+    Yields (stack, logical id, type, properties) of every resource in cdk_out
+    """
+    templates = sorted(glob.glob(os.path.join(cdk_out, "*.template.json")))
+    if not templates:
+        raise FileNotFoundError(f"No templates in {cdk_out}, run cdk synth first")
+    for template in templates:
+        stack = os.path.basename(template)[: -len(".template.json")]
+        with open(template) as template_file:
+            resources = json.load(template_file).get("Resources", {})
+        for logical_id, resource in resources.items():
+            yield stack, logical_id, resource["Type"], resource.get("Properties", {})
+
+
+def bucket_layer(reference) -> str:
+    """
+    Data lake layer of a bucket name/arn, resolved from the logical id of the
+    BaseDataLakeBucket it references
+    """
+    match = LAYER_PATTERN.search(json.dumps(reference).replace("-", "").lower())
+    return match.group(1) if match else "unknown"
+
+
+def flush_period(bytes_per_second: float, interval_seconds: int, size_bytes: int):
+    """
+    Seconds between two objects of a buffer that flushes on whichever of the interval
+    or size limits is reached first
+    """
+    if bytes_per_second <= 0:
+        return interval_seconds
+    return min(interval_seconds, size_bytes / bytes_per_second)
+
+
+def parse_attributes(attributes: str) -> dict:
+    return dict(
+        attribute.split("=", 1) for attribute in attributes.split(";") if "=" in attribute
+    )
+
+
+def firehose_writers(resources: list, events_per_second: float, active_partitions: int):
+    for stack, logical_id, resource_type, properties in resources:
+        if resource_type != "AWS::KinesisFirehose::DeliveryStream":
+            continue
+        destination = properties.get("ExtendedS3DestinationConfiguration", {})
+        hints = destination.get("BufferingHints", {})
+        interval = hints.get("IntervalInSeconds", 300)
+        size_mb = hints.get("SizeInMBs", 5)
+        conversion = destination.get("DataFormatConversionConfiguration", {})
+        if conversion.get("Enabled"):
+            output_format = "PARQUET"
+        else:
+            output_format = destination.get("CompressionFormat", "UNCOMPRESSED")
+        partitioned = destination.get("DynamicPartitioningConfiguration", {}).get(
+            "Enabled", False
+        )
+        partitions = active_partitions if partitioned else 1
+        # Each dynamic partition has its own buffer filled by its share of the events
+        bytes_per_second = events_per_second * EVENT_BYTES / partitions
+        period = flush_period(bytes_per_second, interval, size_mb * 2**20)
+        yield {
+            "name": f"{stack}/{logical_id}",
+            "layer": bucket_layer(destination.get("BucketARN")),
+            "settings": f"buffer {interval}s/{size_mb}MB, {output_format}, "
+            f"{partitions} partition(s)",
+            "files_per_hour": partitions * 3600 / period,
+            "bytes_per_hour": events_per_second
+            * EVENT_BYTES
+            * 3600
+            * COMPRESSION_RATIO.get(output_format, 1.0),
+            "headroom": (
+                min(
+                    FIREHOSE_MAX_RECORDS_PER_SECOND / events_per_second,
+                    FIREHOSE_MAX_BYTES_PER_SECOND / (events_per_second * EVENT_BYTES),
+                )
+                if events_per_second
+                else None
+            ),
+        }
+
+
+def dms_writers(resources: list, orders_per_second: float, cdc_tables: int):
+    for stack, logical_id, resource_type, properties in resources:
+        if resource_type != "AWS::DMS::Endpoint" or properties.get("EngineName") != "s3":
+            continue
+        attributes = parse_attributes(properties.get("ExtraConnectionAttributes", ""))
+        # CDC files are flushed on the batch interval or the minimum file size, the
+        # maxFileSize limit only splits full load files
+        interval = int(attributes.get("cdcMaxBatchInterval", 60))
+        min_file_kb = int(attributes.get("cdcMinFileSize", 32000))
+        output_format = attributes.get("DataFormat", "csv").upper()
+        if output_format != "PARQUET":
+            output_format = "GZIP"
+        # DMS writes one object per table and batch
+        bytes_per_second = orders_per_second * ORDER_BYTES / cdc_tables
+        period = flush_period(bytes_per_second, interval, min_file_kb * 1024)
+        yield {
+            "name": f"{stack}/{logical_id}",
+            "layer": bucket_layer(properties.get("S3Settings", {}).get("BucketName")),
+            "settings": f"cdc batch {interval}s/{min_file_kb}KB, {output_format}, "
+            f"{cdc_tables} table(s)",
+            "files_per_hour": cdc_tables * 3600 / period,
+            "bytes_per_hour": orders_per_second
+            * ORDER_BYTES
+            * 3600
+            * COMPRESSION_RATIO[output_format],
+            "headroom": None,
+        }
+
+
+def athena_workgroups(resources: list):
+    for stack, logical_id, resource_type, properties in resources:
+        if resource_type != "AWS::Athena::WorkGroup":
+            continue
+        configuration = properties.get("WorkGroupConfiguration", {})
+        cutoff = configuration.get("BytesScannedCutoffPerQuery")
+        yield {
+            "name": f"{stack}/{properties.get('Name', logical_id)}",
+            "cutoff_bytes": cutoff,
+            "worst_case_usd": (
+                None if cutoff is None else cutoff / 1e12 * ATHENA_USD_PER_TB_SCANNED
+            ),
+        }
+
+
+def compute_capacity(resources: list):
+    for stack, logical_id, resource_type, properties in resources:
+        if resource_type == "AWS::DMS::ReplicationInstance":
+            yield f"{stack}/{logical_id}", (
+                f"{properties.get('ReplicationInstanceClass')}, "
+                f"{properties.get('AllocatedStorage')} GB"
+            )
+        elif resource_type == "AWS::MWAA::Environment":
+            environment_class = properties.get("EnvironmentClass", "mw1.small")
+            max_workers = properties.get("MaxWorkers", 10)
+            slots = max_workers * MWAA_TASKS_PER_WORKER.get(environment_class, 5)
+            yield f"{stack}/{logical_id}", (
+                f"{environment_class}, {properties.get('MinWorkers', 1)}-{max_workers} "
+                f"workers, up to {slots} concurrent tasks"
+            )
+        elif resource_type == "AWS::Redshift::Cluster":
+            node_type = properties.get("NodeType")
+            nodes = properties.get("NumberOfNodes", 1)
+            slices = nodes * REDSHIFT_SLICES_PER_NODE.get(node_type, 2)
+            yield f"{stack}/{logical_id}", f"{nodes} x {node_type}, {slices} slices"
+
+
+def estimate(
+    cdk_out: str,
+    events_per_second: float,
+    orders_per_second: float,
+    active_partitions: int = 1,
+    cdc_tables: int = 1,
+) -> dict:
+    resources = list(load_resources(cdk_out))
+    writers = list(
+        firehose_writers(resources, events_per_second, active_partitions)
+    ) + list(dms_writers(resources, orders_per_second, cdc_tables))
+
+    layers = defaultdict(lambda: {"files_per_hour": 0.0, "bytes_per_hour": 0.0})
+    for writer in writers:
+        layers[writer["layer"]]["files_per_hour"] += writer["files_per_hour"]
+        layers[writer["layer"]]["bytes_per_hour"] += writer["bytes_per_hour"]
+    for layer in layers.values():
+        layer["average_object_bytes"] = (
+            layer["bytes_per_hour"] / layer["files_per_hour"]
+            if layer["files_per_hour"]
+            else 0
+        )
+
+    return {
+        "writers": writers,
+        "layers": dict(layers),
+        "athena": list(athena_workgroups(resources)),
+        "compute": dict(compute_capacity(resources)),
+    }
+
+
+def human_bytes(size: float) -> str:
+    for unit in ["B", "KB", "MB", "GB"]:
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+def print_report(report: dict) -> None:
+    print("Writers:")
+    for writer in report["writers"]:
+        headroom = (
+            "" if writer["headroom"] is None else f", headroom {writer['headroom']:.0f}x"
+        )
+        print(
+            f"  {writer['name']} -> {writer['layer']} ({writer['settings']}): "
+            f"{writer['files_per_hour']:.0f} files/h{headroom}"
+        )
+    print("Data lake layers:")
+    for name, layer in sorted(report["layers"].items()):
+        print(
+            f"  {name}: {layer['files_per_hour']:.0f} files/h, "
+            f"{human_bytes(layer['bytes_per_hour'])}/h, "
+            f"average object {human_bytes(layer['average_object_bytes'])}"
+        )
+    print("Athena:")
+    for workgroup in report["athena"]:
+        if workgroup["cutoff_bytes"] is None:
+            print(f"  {workgroup['name']}: no scan cutoff, cost per query is unbounded")
+        else:
+            print(
+                f"  {workgroup['name']}: worst case {human_bytes(workgroup['cutoff_bytes'])} "
+                f"scanned, ${workgroup['worst_case_usd']:.4f} per query"
+            )
+    print("Compute:")
+    for name, capacity in sorted(report["compute"].items()):
+        print(f"  {name}: {capacity}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--cdk-out", default="cdk.out")
+    parser.add_argument("--events-per-second", type=float, required=True)
+    parser.add_argument("--orders-per-second", type=float, required=True)
+    parser.add_argument(
+        "--active-partitions",
+        type=int,
+        default=1,
+        help="event dates receiving events at once, with Firehose dynamic partitioning",
+    )
+    parser.add_argument(
+        "--cdc-tables", type=int, default=1, help="tables receiving changes through DMS"
+    )
+    parser.add_argument("--json", action="store_true", help="prints the report as JSON")
+    args = parser.parse_args()
+
+    report = estimate(
+        args.cdk_out,
+        events_per_second=args.events_per_second,
+        orders_per_second=args.orders_per_second,
+        active_partitions=args.active_partitions,
+        cdc_tables=args.cdc_tables,
+    )
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
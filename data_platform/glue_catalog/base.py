@@ -1,9 +1,17 @@
+import os
+
 from aws_cdk import core
 from aws_cdk import (
     aws_glue as glue,
     aws_iam as iam,
+    aws_s3_assets as s3_assets,
+    aws_lambda as lambda_,
+    aws_sns as sns,
+    aws_sns_subscriptions as sns_subscriptions,
+    custom_resources as cr,
 )
 from data_platform.data_lake.base import BaseDataLakeBucket
+from data_platform.glue_catalog.schemas import TableSpec
 
 
 class BaseDataLakeGlueDatabase(glue.Database):
@@ -64,9 +72,18 @@ class BaseDataLakeGlueRole(iam.Role):
             policy_name=f"iam-{self.deploy_env.value}-glue-data-lake-{self.layer.value}-policy",
             statements=[
                 iam.PolicyStatement(
-                    actions=["s3:ListBucket", "s3:GetObject", "s3:PutObject"],
+                    actions=[
+                        "s3:ListBucket",
+                        "s3:GetObject",
+                        "s3:PutObject",
+                    ],
                     resources=[self.bucket_arn, f"{self.bucket_arn}/*"],
                 ),
+                # Only the compaction job output is ever deleted
+                iam.PolicyStatement(
+                    actions=["s3:DeleteObject"],
+                    resources=[f"{self.bucket_arn}/compacted/*"],
+                ),
                 iam.PolicyStatement(
                     actions=["cloudwatch:PutMetricData"],
                     resources=["arn:aws:cloudwatch:*"],
@@ -141,102 +158,306 @@ class BaseGlueCrawler(glue.CfnCrawler):
         )
 
 
-class OrdersTable(glue.Table):
+DATA_FORMATS = {"parquet": glue.DataFormat.PARQUET, "json": glue.DataFormat.JSON}
+
+
+def glue_columns(columns: tuple) -> list:
+    return [
+        glue.Column(
+            name=column.name,
+            type=glue.Type(input_string=column.type, is_primitive=True),
+        )
+        for column in columns
+    ]
+
+
+class DataLakeTable(glue.Table):
+    """
+    Glue table generated from its TableSpec in schemas.py
+    """
+
     def __init__(
         self,
         scope: core.Construct,
         glue_database: BaseDataLakeGlueDatabase,
         glue_role: BaseDataLakeGlueRole,
+        spec: TableSpec,
         **kwargs,
     ) -> None:
         self.glue_role = glue_role
         self.glue_database = glue_database
+        self.spec = spec
         self.deploy_env = self.glue_database.deploy_env
         self.data_lake_bucket = self.glue_database.data_lake_bucket
-        self.obj_name = f"glue-{self.deploy_env.value}-orders-table"
+        self.obj_name = f"glue-{self.deploy_env.value}-{self.spec.name}-table"
         super().__init__(
             scope,
             self.obj_name,
-            table_name="orders",
-            description="orders captured from Postgres using DMS CDC",
+            table_name=self.spec.name,
+            description=self.spec.description,
             database=self.glue_database,
-            compressed=True,
-            data_format=glue.DataFormat.PARQUET,
-            s3_prefix="orders/public/orders",
+            compressed=self.spec.compressed,
+            data_format=DATA_FORMATS[self.spec.data_format],
+            s3_prefix=self.spec.s3_prefix,
             bucket=self.data_lake_bucket,
-            columns=[
-                glue.Column(
-                    name="op", type=glue.Type(input_string="string", is_primitive=True)
-                ),
-                glue.Column(
-                    name="extracted_at",
-                    type=glue.Type(input_string="string", is_primitive=True),
-                ),
-                glue.Column(
-                    name="created_at",
-                    type=glue.Type(input_string="timestamp", is_primitive=True),
-                ),
-                glue.Column(
-                    name="order_id", type=glue.Type(input_string="int", is_primitive=True)
-                ),
-                glue.Column(
-                    name="product_name",
-                    type=glue.Type(input_string="string", is_primitive=True),
-                ),
-                glue.Column(
-                    name="value", type=glue.Type(input_string="double", is_primitive=True)
-                ),
-            ],
+            columns=glue_columns(self.spec.columns),
+            partition_keys=glue_columns(self.spec.partition_keys) or None,
             **kwargs,
         )
+        self.add_partition_projection()
 
+    def add_partition_projection(self):
+        """
+        Lets Athena compute the partitions from the spec, so new ones are visible
+        without a crawler or adding partitions
+        """
+        parameters = self.spec.projection_parameters
+        if not parameters:
+            return
+        if not self.spec.hive_partitions:
+            folders = "/".join(f"${{{key.name}}}" for key in self.spec.partition_keys)
+            parameters["storage.location.template"] = (
+                f"s3://{self.data_lake_bucket.bucket_name}/{self.spec.s3_prefix}/{folders}/"
+            )
+        self.node.default_child.add_property_override("TableInput.Parameters", parameters)
+
+
+class CompactedTable(glue.Table):
+    """
+    Parquet table written by the compaction job. Its partitions point to symlink
+    manifests listing the files of the latest compaction run
+    """
 
-class OrdersV2Table(glue.Table):
     def __init__(
         self,
         scope: core.Construct,
         glue_database: BaseDataLakeGlueDatabase,
         glue_role: BaseDataLakeGlueRole,
+        source_table_name: str,
+        columns: list,
+        partition_key: str,
         **kwargs,
     ) -> None:
         self.glue_role = glue_role
         self.glue_database = glue_database
+        self.source_table_name = source_table_name
+        self.partition_key = partition_key
         self.deploy_env = self.glue_database.deploy_env
         self.data_lake_bucket = self.glue_database.data_lake_bucket
-        self.obj_name = f"glue-{self.deploy_env.value}-orders_v2-table"
+        self.obj_name = (
+            f"glue-{self.deploy_env.value}-{source_table_name}_compacted-table"
+        )
         super().__init__(
             scope,
             self.obj_name,
-            table_name="orders_v2",
-            description="orders captured from Postgres using DMS CDC",
+            table_name=f"{source_table_name}_compacted",
+            description=f"{source_table_name} compacted into large parquet files per day",
             database=self.glue_database,
-            compressed=True,
-            data_format=glue.DataFormat.PARQUET,
-            s3_prefix="orders/public/orders_v2",
-            bucket=self.data_lake_bucket,
-            columns=[
-                glue.Column(
-                    name="op", type=glue.Type(input_string="string", is_primitive=True)
+            data_format=glue.DataFormat(
+                input_format=glue.InputFormat(
+                    "org.apache.hadoop.hive.ql.io.SymlinkTextInputFormat"
                 ),
-                glue.Column(
-                    name="extracted_at",
-                    type=glue.Type(input_string="string", is_primitive=True),
-                ),
-                glue.Column(
-                    name="created_at",
-                    type=glue.Type(input_string="timestamp", is_primitive=True),
-                ),
-                glue.Column(
-                    name="order_id",
-                    type=glue.Type(input_string="string", is_primitive=True),
+                output_format=glue.OutputFormat(
+                    "org.apache.hadoop.hive.ql.io.HiveIgnoreKeyTextOutputFormat"
                 ),
+                serialization_library=glue.SerializationLibrary.PARQUET,
+            ),
+            s3_prefix=f"{self.dataset_prefix}/manifest",
+            bucket=self.data_lake_bucket,
+            columns=columns,
+            partition_keys=[
                 glue.Column(
-                    name="product_name",
+                    name=partition_key,
                     type=glue.Type(input_string="string", is_primitive=True),
                 ),
-                glue.Column(
-                    name="value", type=glue.Type(input_string="double", is_primitive=True)
-                ),
             ],
             **kwargs,
         )
+
+    @property
+    def dataset_prefix(self):
+        return f"compacted/{self.source_table_name}"
+
+
+class CompactionJob(glue.CfnJob):
+    """
+    Glue job running jobs/compact_partitions.py. Each dataset to compact gets a daily
+    trigger with its own arguments
+    """
+
+    def __init__(
+        self,
+        scope: core.Construct,
+        glue_database: BaseDataLakeGlueDatabase,
+        glue_role: BaseDataLakeGlueRole,
+        **kwargs,
+    ) -> None:
+        self.glue_role = glue_role
+        self.glue_database = glue_database
+        self.deploy_env = self.glue_database.deploy_env
+        self.data_lake_bucket = self.glue_database.data_lake_bucket
+        self.obj_name = f"glue-{self.deploy_env.value}-{self.data_lake_bucket.layer.value}-compaction-job"
+        self.script = s3_assets.Asset(
+            scope,
+            f"{self.obj_name}-script",
+            path=os.path.join(os.path.dirname(__file__), "jobs", "compact_partitions.py"),
+        )
+        self.script.grant_read(self.glue_role)
+        super().__init__(
+            scope,
+            self.obj_name,
+            name=self.obj_name,
+            description="Compacts changed days of the data lake into large parquet files",
+            role=self.glue_role.role_arn,
+            command=glue.CfnJob.JobCommandProperty(
+                name="glueetl",
+                python_version="3",
+                script_location=self.script.s3_object_url,
+            ),
+            glue_version="2.0",
+            worker_type="G.1X",
+            number_of_workers=2,
+            max_retries=1,
+            timeout=120,
+            execution_property=glue.CfnJob.ExecutionPropertyProperty(
+                max_concurrent_runs=4
+            ),
+            default_arguments={
+                "--bucket": self.data_lake_bucket.bucket_name,
+                "--database_name": self.glue_database.database_name,
+                # Days with raw files newer than their manifest, late files included
+                "--partition_date": "changed",
+                "--target_file_mb": "256",
+            },
+            **kwargs,
+        )
+
+    def add_daily_trigger(
+        self,
+        table: CompactedTable,
+        source_prefix: str,
+        source_layout: str,
+        input_format: str,
+        sort_columns: list,
+        schedule_expression: str = "cron(0 4 * * ? *)",
+    ):
+        trigger_name = (
+            f"glue-{self.deploy_env.value}-{table.source_table_name}-compaction-trigger"
+        )
+        trigger = glue.CfnTrigger(
+            self.stack,
+            trigger_name,
+            name=trigger_name,
+            type="SCHEDULED",
+            schedule=schedule_expression,
+            start_on_creation=True,
+            actions=[
+                glue.CfnTrigger.ActionProperty(
+                    job_name=self.ref,
+                    arguments={
+                        "--source_prefix": source_prefix,
+                        "--source_layout": source_layout,
+                        "--input_format": input_format,
+                        "--partition_key": table.partition_key,
+                        "--sort_columns": ",".join(sort_columns),
+                        "--dataset_prefix": table.dataset_prefix,
+                        "--table_name": table.table_name,
+                    },
+                )
+            ],
+        )
+        trigger.node.add_dependency(table)
+        return trigger
+
+
+class PartitionRegistrar(lambda_.Function):
+    """
+    Adds the partitions of new objects to the given tables, for readers that ignore
+    partition projection like Spectrum and Spark
+    """
+
+    def __init__(
+        self,
+        scope: core.Construct,
+        glue_database: BaseDataLakeGlueDatabase,
+        object_created_topic: sns.ITopic,
+        tables: list,
+        **kwargs,
+    ) -> None:
+        self.glue_database = glue_database
+        self.tables = tables
+        self.deploy_env = self.glue_database.deploy_env
+        self.data_lake_bucket = self.glue_database.data_lake_bucket
+        self.obj_name = f"lambda-{self.deploy_env.value}-{self.data_lake_bucket.layer.value}-partition-registrar"
+        super().__init__(
+            scope,
+            self.obj_name,
+            function_name=self.obj_name,
+            description="Registers Glue partitions of objects created in the data lake",
+            runtime=lambda_.Runtime.PYTHON_3_8,
+            handler="index.handler",
+            code=lambda_.Code.from_asset(
+                os.path.join(
+                    os.path.dirname(__file__), "functions", "partition_registrar"
+                )
+            ),
+            # Long enough for the backfill of the existing partitions
+            timeout=core.Duration.minutes(5),
+            environment={
+                "DATABASE_NAME": self.glue_database.database_name,
+                "TABLES": core.Stack.of(scope).to_json_string(
+                    {table.s3_prefix: table.table_name for table in self.tables}
+                ),
+            },
+            **kwargs,
+        )
+        self.add_policy()
+        object_created_topic.add_subscription(sns_subscriptions.LambdaSubscription(self))
+
+    def add_policy(self):
+        self.add_to_role_policy(
+            iam.PolicyStatement(
+                actions=[
+                    "glue:GetTable",
+                    "glue:CreatePartition",
+                    "glue:BatchCreatePartition",
+                ],
+                resources=[
+                    self.glue_database.catalog_arn,
+                    self.glue_database.database_arn,
+                ]
+                + [table.table_arn for table in self.tables],
+            )
+        )
+        self.add_to_role_policy(
+            iam.PolicyStatement(
+                actions=["s3:ListBucket"], resources=[self.data_lake_bucket.bucket_arn]
+            )
+        )
+
+
+class PartitionBackfill(core.CustomResource):
+    """
+    Registers the partitions already in S3 of the tables of a PartitionRegistrar, which
+    only sees new objects. Runs on every deploy that changes its tables, e.g. when a
+    table is recreated without its partitions
+    """
+
+    def __init__(
+        self, scope: core.Construct, registrar: PartitionRegistrar, **kwargs
+    ) -> None:
+        self.deploy_env = registrar.deploy_env
+        self.obj_name = f"{registrar.obj_name}-backfill"
+        self.provider = cr.Provider(
+            scope, f"{self.obj_name}-provider", on_event_handler=registrar
+        )
+        super().__init__(
+            scope,
+            id=self.obj_name,
+            service_token=self.provider.service_token,
+            properties={
+                "Bucket": registrar.data_lake_bucket.bucket_name,
+                "Tables": [table.table_name for table in registrar.tables],
+            },
+            **kwargs,
+        )
@@ -0,0 +1,147 @@
+"""
+Adds Glue partitions for objects created in the data lake, for readers that ignore
+partition projection like Spectrum and Spark. Receives the S3 events of the bucket
+through SNS.
+
+TABLES maps the S3 prefix of each table to its name in DATABASE_NAME. Hive style
+folders (key=value/) after the prefix give the partition values.
+
+It is also the handler of the PartitionBackfill custom resource, which registers the
+partitions already in S3 on deploy.
+"""
+
+import json
+import os
+from urllib.parse import unquote_plus
+
+import boto3
+
+glue = boto3.client("glue")
+s3 = boto3.client("s3")
+
+DATABASE_NAME = os.environ["DATABASE_NAME"]
+TABLES = json.loads(os.environ["TABLES"])
+
+# Kept between invocations of the same container, so each partition is created once
+registered = set()
+tables = {}
+
+
+def get_table(table_name: str) -> dict:
+    if table_name not in tables:
+        tables[table_name] = glue.get_table(DatabaseName=DATABASE_NAME, Name=table_name)[
+            "Table"
+        ]
+    return tables[table_name]
+
+
+def partition_of(key: str):
+    """
+    Returns the table name, the partition values and the partition folder of a key,
+    or None when the key is not in a partition of a known table
+    """
+    for prefix, table_name in sorted(TABLES.items(), key=lambda item: -len(item[0])):
+        if not key.startswith(f"{prefix}/"):
+            continue
+        partition_keys = [
+            column["Name"] for column in get_table(table_name)["PartitionKeys"]
+        ]
+        folders = key.split("/", prefix.count("/") + 1)[-1].split("/")
+        folders = folders[: len(partition_keys)]
+        values = dict(folder.split("=", 1) for folder in folders if "=" in folder)
+        if list(values) != partition_keys:
+            return None
+        return (
+            table_name,
+            [values[name] for name in partition_keys],
+            (f"{prefix}/{'/'.join(folders)}/"),
+        )
+    return None
+
+
+def register(bucket: str, table_name: str, values: list, folder: str) -> None:
+    storage = dict(get_table(table_name)["StorageDescriptor"])
+    storage["Location"] = f"s3://{bucket}/{folder}"
+    try:
+        glue.create_partition(
+            DatabaseName=DATABASE_NAME,
+            TableName=table_name,
+            PartitionInput={"Values": values, "StorageDescriptor": storage},
+        )
+        print(f"Registered {table_name} {values}")
+    except glue.exceptions.AlreadyExistsException:
+        pass
+
+
+def partition_folders(bucket: str, prefix: str, table_name: str):
+    """
+    Yields the partition values and folder of every hive partition under the prefix
+    """
+    partition_keys = [column["Name"] for column in get_table(table_name)["PartitionKeys"]]
+    paginator = s3.get_paginator("list_objects_v2")
+    folders = [f"{prefix}/"]
+    for name in partition_keys:
+        folders = [
+            common_prefix["Prefix"]
+            for folder in folders
+            for page in paginator.paginate(
+                Bucket=bucket, Prefix=f"{folder}{name}=", Delimiter="/"
+            )
+            for common_prefix in page.get("CommonPrefixes", [])
+        ]
+    depth = len(partition_keys)
+    for folder in folders:
+        partition = folder.rstrip("/").split("/")[-depth:]
+        yield [part.split("=", 1)[1] for part in partition], folder
+
+
+def backfill(event) -> dict:
+    """
+    Custom resource handler, registers the existing partitions on Create and Update
+    """
+    if event["RequestType"] != "Delete":
+        bucket = event["ResourceProperties"]["Bucket"]
+        for prefix, table_name in TABLES.items():
+            storage = get_table(table_name)["StorageDescriptor"]
+            partitions = [
+                {
+                    "Values": values,
+                    "StorageDescriptor": dict(
+                        storage, Location=f"s3://{bucket}/{folder}"
+                    ),
+                }
+                for values, folder in partition_folders(bucket, prefix, table_name)
+            ]
+            while partitions:
+                batch, partitions = partitions[:100], partitions[100:]
+                response = glue.batch_create_partition(
+                    DatabaseName=DATABASE_NAME,
+                    TableName=table_name,
+                    PartitionInputList=batch,
+                )
+                errors = [
+                    error
+                    for error in response.get("Errors", [])
+                    if error["ErrorDetail"]["ErrorCode"] != "AlreadyExistsException"
+                ]
+                if errors:
+                    raise RuntimeError(
+                        f"Could not register {table_name} partitions: {errors}"
+                    )
+            print(f"Registered the existing partitions of {table_name}")
+    return {"PhysicalResourceId": f"{DATABASE_NAME}-partition-backfill"}
+
+
+def handler(event, context):
+    if "RequestType" in event:
+        return backfill(event)
+    for record in event["Records"]:
+        message = json.loads(record["Sns"]["Message"])
+        for s3_record in message.get("Records", []):
+            bucket = s3_record["s3"]["bucket"]["name"]
+            key = unquote_plus(s3_record["s3"]["object"]["key"])
+            partition = partition_of(key)
+            if partition is None or (bucket, partition[2]) in registered:
+                continue
+            register(bucket, *partition)
+            registered.add((bucket, partition[2]))
@@ -0,0 +1,232 @@
+"""
+Glue job that rewrites days of a raw data lake dataset into a few large parquet files,
+range partitioned and sorted by --sort_columns.
+
+With --partition_date changed, every closed day whose raw objects were modified after
+its manifest (or that has no manifest yet) is compacted again, so files delivered late
+(e.g. Firehose buffers flushed after midnight, DMS files of an old date folder) reach
+the day's manifest however old the day is. Days whose inputs did not change since the
+last run are skipped.
+
+Each run writes to <dataset_prefix>/data/<partition>/run_id=<hash of the inputs>/, so
+running it again for the same inputs does nothing. Readers use the compacted table,
+whose partitions point to a symlink manifest. Replacing the manifest is a single S3
+put, so readers move from the old files to the new ones at once.
+
+--source_layout is "hive" when the inputs are under <source_prefix>/<partition>/,
+"date_folder" when they are under <source_prefix>/<yyyy-MM-dd>/ like the DMS CDC files,
+or "modified_date" for flat prefixes, where the day is taken from the last modified
+date of each object.
+"""
+
+import hashlib
+import math
+import sys
+from datetime import date, timedelta
+
+import boto3
+from awsglue.context import GlueContext
+from awsglue.utils import getResolvedOptions
+from pyspark.context import SparkContext
+
+args = getResolvedOptions(
+    sys.argv,
+    [
+        "JOB_NAME",
+        "bucket",
+        "source_prefix",
+        "source_layout",
+        "input_format",
+        "partition_key",
+        "partition_date",
+        "sort_columns",
+        "dataset_prefix",
+        "database_name",
+        "table_name",
+        "target_file_mb",
+    ],
+)
+
+s3 = boto3.client("s3")
+glue = boto3.client("glue")
+
+
+def list_objects(prefix: str):
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=args["bucket"], Prefix=prefix):
+        yield from page.get("Contents", [])
+
+
+def partition_of(obj: dict) -> str:
+    """Day of a source object, or None when it is not in a partition of the layout"""
+    if args["source_layout"] == "modified_date":
+        return obj["LastModified"].date().isoformat()
+    depth = args["source_prefix"].count("/") + 1
+    parts = obj["Key"].split("/")[depth:]
+    if len(parts) < 2:
+        # Object at the root of the prefix, e.g. a DMS full load file
+        return None
+    if args["source_layout"] == "hive":
+        key, _, day = parts[0].partition("=")
+        return day if key == args["partition_key"] and day else None
+    return parts[0]
+
+
+def is_input(obj: dict) -> bool:
+    return obj["Size"] > 0 and not obj["Key"].endswith("/")
+
+
+def changed_partitions() -> dict:
+    """
+    Objects of the closed days whose inputs were modified after their manifest, by day
+    """
+    objects = {}
+    for obj in list_objects(f"{args['source_prefix']}/"):
+        day = partition_of(obj)
+        if day and is_input(obj):
+            objects.setdefault(day, []).append(obj)
+
+    manifests_prefix = f"{args['dataset_prefix']}/manifest/"
+    compacted_at = {
+        obj["Key"].split("/")[-2].split("=")[-1]: obj["LastModified"]
+        for obj in list_objects(manifests_prefix)
+        if obj["Key"].endswith("/symlink.txt")
+    }
+    today = date.today().isoformat()
+    return {
+        day: sorted(day_objects, key=lambda obj: obj["Key"])
+        for day, day_objects in sorted(objects.items())
+        if day < today
+        and (
+            day not in compacted_at
+            or max(obj["LastModified"] for obj in day_objects) > compacted_at[day]
+        )
+    }
+
+
+def input_objects(day: str) -> list:
+    if args["source_layout"] == "hive":
+        prefix = f"{args['source_prefix']}/{args['partition_key']}={day}/"
+        objects = list_objects(prefix)
+    elif args["source_layout"] == "date_folder":
+        objects = list_objects(f"{args['source_prefix']}/{day}/")
+    else:
+        objects = (
+            obj
+            for obj in list_objects(f"{args['source_prefix']}/")
+            if obj["LastModified"].date().isoformat() == day
+        )
+    return sorted(filter(is_input, objects), key=lambda obj: obj["Key"])
+
+
+def run_id(objects: list) -> str:
+    inputs = "\n".join(f"{obj['Key']}:{obj['ETag']}" for obj in objects)
+    return hashlib.sha256(inputs.encode("utf-8")).hexdigest()[:16]
+
+
+def read_manifest(key: str) -> str:
+    try:
+        return s3.get_object(Bucket=args["bucket"], Key=key)["Body"].read().decode()
+    except s3.exceptions.NoSuchKey:
+        return ""
+
+
+def compact(objects: list, output_prefix: str) -> None:
+    spark = GlueContext(SparkContext.getOrCreate()).spark_session
+    paths = [f"s3://{args['bucket']}/{obj['Key']}" for obj in objects]
+    if args["input_format"] == "parquet":
+        df = spark.read.option("mergeSchema", "true").parquet(*paths)
+    else:
+        df = spark.read.json(paths)
+
+    total_bytes = sum(obj["Size"] for obj in objects)
+    files = max(1, math.ceil(total_bytes / (int(args["target_file_mb"]) * 2**20)))
+    sort_columns = args["sort_columns"].split(",")
+    (
+        df.repartitionByRange(files, *sort_columns)
+        .sortWithinPartitions(*sort_columns)
+        .write.mode("overwrite")
+        .parquet(f"s3://{args['bucket']}/{output_prefix}")
+    )
+
+
+def register_partition(day: str, manifest_prefix: str) -> None:
+    """
+    Adds the partition of the day to the compacted table. Its location is the manifest
+    folder, which does not change between runs
+    """
+    table = glue.get_table(DatabaseName=args["database_name"], Name=args["table_name"])
+    storage = dict(table["Table"]["StorageDescriptor"])
+    storage["Location"] = f"s3://{args['bucket']}/{manifest_prefix}"
+    try:
+        glue.create_partition(
+            DatabaseName=args["database_name"],
+            TableName=args["table_name"],
+            PartitionInput={"Values": [day], "StorageDescriptor": storage},
+        )
+    except glue.exceptions.AlreadyExistsException:
+        pass
+
+
+def remove_old_runs(partition_prefix: str, keep: set) -> None:
+    """
+    Deletes the output of runs no longer referenced by the current or the previous
+    manifest, so queries started before the swap can still finish
+    """
+    stale = [
+        {"Key": obj["Key"]}
+        for obj in list_objects(partition_prefix)
+        if not keep.intersection(obj["Key"].split("/"))
+    ]
+    while stale:
+        batch, stale = stale[:1000], stale[1000:]
+        s3.delete_objects(Bucket=args["bucket"], Delete={"Objects": batch})
+
+
+def compact_partition(day: str, objects: list) -> None:
+    partition = f"{args['partition_key']}={day}"
+    if not objects:
+        print(f"No input for {partition}")
+        return
+
+    current_run = f"run_id={run_id(objects)}"
+    data_prefix = f"{args['dataset_prefix']}/data/{partition}/"
+    manifest_prefix = f"{args['dataset_prefix']}/manifest/{partition}/"
+    manifest_key = f"{manifest_prefix}symlink.txt"
+
+    previous_manifest = read_manifest(manifest_key)
+    if f"/{current_run}/" in previous_manifest:
+        print(f"{partition} already compacted by {current_run}")
+        return
+
+    compact(objects, f"{data_prefix}{current_run}/")
+    files = [
+        f"s3://{args['bucket']}/{obj['Key']}"
+        for obj in list_objects(f"{data_prefix}{current_run}/")
+        if obj["Key"].endswith(".parquet")
+    ]
+    s3.put_object(
+        Bucket=args["bucket"], Key=manifest_key, Body="\n".join(files).encode("utf-8")
+    )
+    register_partition(day, manifest_prefix)
+
+    previous_runs = {
+        part for part in previous_manifest.split("/") if part.startswith("run_id=")
+    }
+    remove_old_runs(data_prefix, keep={current_run} | previous_runs)
+    print(f"{partition}: {len(objects)} objects compacted into {len(files)} files")
+
+
+def main():
+    if args["partition_date"] == "changed":
+        partitions = changed_partitions()
+    else:
+        day = args["partition_date"]
+        if day == "yesterday":
+            day = (date.today() - timedelta(days=1)).isoformat()
+        partitions = {day: input_objects(day)}
+    for day, objects in partitions.items():
+        compact_partition(day, objects)
+
+
+main()
@@ -0,0 +1,368 @@
+"""
+Single spec of the data lake tables. It generates the Glue tables (DataLakeTable in
+base.py), the dbt sources in projeto_dbt/models/staging/staging.yml and the Spark read
+schemas in data_platform/databricks/schemas/. After changing a table, regenerate the
+files with
+
+    python -m data_platform.glue_catalog.schemas
+
+and use --check in CI to fail when they are out of date.
+"""
+
+import argparse
+import json
+import os
+import sys
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import yaml
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+DBT_SOURCES_PATH = os.path.join(ROOT, "projeto_dbt", "models", "staging", "staging.yml")
+SPARK_SCHEMAS_PATH = os.path.join(ROOT, "data_platform", "databricks", "schemas")
+
+# Glue/Hive types used by the tables and their Spark SQL names
+SPARK_TYPES = {
+    "string": "string",
+    "timestamp": "timestamp",
+    "date": "date",
+    "boolean": "boolean",
+    "int": "integer",
+    "bigint": "long",
+    "double": "double",
+}
+
+
+@dataclass(frozen=True)
+class DateProjection:
+    format: str
+    range_start: str
+    interval_unit: str = "DAYS"
+
+
+@dataclass(frozen=True)
+class EnumProjection:
+    values: Tuple[str, ...]
+
+
+@dataclass(frozen=True)
+class Column:
+    name: str
+    type: str
+    description: Optional[str] = None
+    tests: Tuple[str, ...] = ()
+    projection: Optional[object] = None
+
+
+@dataclass(frozen=True)
+class TableSpec:
+    name: str
+    s3_prefix: str
+    description: str
+    # "parquet" or "json"
+    data_format: str
+    columns: Tuple[Column, ...]
+    partition_keys: Tuple[Column, ...] = ()
+    compressed: bool = True
+    # False when partitions are plain folders (e.g. 2021-05-20/) instead of key=value/
+    hive_partitions: bool = True
+    dbt_description: Optional[str] = None
+    spark_schema: bool = False
+
+    @property
+    def projection_parameters(self) -> dict:
+        """
+        Athena partition projection parameters of the partition keys
+        """
+        parameters = {}
+        for key in self.partition_keys:
+            if isinstance(key.projection, DateProjection):
+                parameters.update(
+                    {
+                        f"projection.{key.name}.type": "date",
+                        f"projection.{key.name}.format": key.projection.format,
+                        f"projection.{key.name}.range": f"{key.projection.range_start},NOW",
+                        f"projection.{key.name}.interval": "1",
+                        f"projection.{key.name}.interval.unit": key.projection.interval_unit,
+                    }
+                )
+            elif isinstance(key.projection, EnumProjection):
+                parameters.update(
+                    {
+                        f"projection.{key.name}.type": "enum",
+                        f"projection.{key.name}.values": ",".join(key.projection.values),
+                    }
+                )
+        if parameters:
+            parameters["projection.enabled"] = "true"
+        return parameters
+
+    @property
+    def spark_struct(self) -> dict:
+        """
+        Spark StructType (as loaded by StructType.fromJson) of the data columns
+        """
+        return {
+            "type": "struct",
+            "fields": [
+                {
+                    "name": column.name,
+                    "type": SPARK_TYPES[column.type],
+                    "nullable": True,
+                    "metadata": {},
+                }
+                for column in self.columns
+            ],
+        }
+
+
+ATOMIC_EVENTS_COLUMNS = (
+    Column("event_id", "string", description="Id do evento", tests=("not_null",)),
+    Column(
+        "event_timestamp",
+        "timestamp",
+        description="Timestamp em que o evento ocorreu",
+        tests=("not_null",),
+    ),
+    Column("event_type", "string"),
+    Column("page_url", "string"),
+    Column("page_url_path", "string"),
+    Column("referer_url", "string"),
+    Column("referer_url_scheme", "string"),
+    Column("referer_url_port", "string"),
+    Column("referer_medium", "string"),
+    Column("utm_medium", "string"),
+    Column("utm_source", "string"),
+    Column("utm_content", "string"),
+    Column("utm_campaign", "string"),
+    Column("click_id", "string"),
+    Column("geo_latitude", "string"),
+    Column("geo_longitude", "string"),
+    Column("geo_country", "string"),
+    Column("geo_timezone", "string"),
+    Column("geo_region_name", "string"),
+    Column("ip_address", "string"),
+    Column("browser_name", "string"),
+    Column("browser_user_agent", "string"),
+    Column("browser_language", "string"),
+    Column("os", "string"),
+    Column("os_name", "string"),
+    Column("os_timezone", "string"),
+    Column("device_type", "string"),
+    Column("device_is_mobile", "boolean"),
+    Column("user_custom_id", "string"),
+    Column("user_domain_id", "string"),
+)
+
+ORDERS_COLUMNS = (
+    Column("op", "string"),
+    Column("extracted_at", "string"),
+    Column("created_at", "timestamp"),
+    Column("order_id", "string"),
+    Column("product_name", "string"),
+    Column("value", "double"),
+)
+
+EXTRACTED_DATE = Column(
+    "extracted_date",
+    "date",
+    projection=DateProjection(format="yyyy-MM-dd", range_start="2021-01-01"),
+)
+
+TABLES = {
+    table.name: table
+    for table in [
+        TableSpec(
+            name="atomic_events",
+            s3_prefix="atomic_events",
+            description="atomic events delivered as gzipped JSON by Kinesis Firehose before "
+            "the parquet conversion, read together with atomic_events_parquet",
+            data_format="json",
+            columns=ATOMIC_EVENTS_COLUMNS,
+            partition_keys=(
+                Column(
+                    "landing_date",
+                    "string",
+                    projection=DateProjection(
+                        format="yyyy-MM-dd", range_start="2021-01-01"
+                    ),
+                ),
+            ),
+            dbt_description='{{ doc("source_atomic_events") }}',
+            spark_schema=True,
+        ),
+        TableSpec(
+            name="atomic_events_parquet",
+            s3_prefix="atomic_events_parquet",
+            description="atomic events converted to parquet by Kinesis Firehose",
+            data_format="parquet",
+            columns=ATOMIC_EVENTS_COLUMNS,
+            partition_keys=(
+                Column(
+                    "event_date",
+                    "string",
+                    projection=DateProjection(
+                        format="yyyy-MM-dd", range_start="2021-01-01"
+                    ),
+                ),
+            ),
+            spark_schema=True,
+        ),
+        TableSpec(
+            name="orders",
+            s3_prefix="orders/public/orders",
+            description="orders captured from Postgres using DMS CDC",
+            data_format="parquet",
+            columns=ORDERS_COLUMNS,
+            partition_keys=(EXTRACTED_DATE,),
+            hive_partitions=False,
+        ),
+        TableSpec(
+            name="orders_v2",
+            s3_prefix="orders/public/orders_v2",
+            description="orders captured from Postgres using DMS CDC",
+            data_format="parquet",
+            columns=ORDERS_COLUMNS,
+            partition_keys=(EXTRACTED_DATE,),
+            hive_partitions=False,
+            spark_schema=True,
+        ),
+        TableSpec(
+            name="orders_v2_load",
+            s3_prefix="orders/public/orders_v2",
+            description="full load of orders_v2, written by DMS to LOAD*.parquet files at "
+            "the root of the prefix. The location also holds the CDC date folders, so "
+            'keep the rows whose "$path" is a LOAD file',
+            data_format="parquet",
+            columns=ORDERS_COLUMNS,
+        ),
+        TableSpec(
+            name="mercado_bitcoin",
+            s3_prefix="mercado_bitcoin_monthly",
+            description="mercado bitcoin day summaries compacted into monthly files",
+            data_format="parquet",
+            columns=(
+                Column("date", "date"),
+                Column("opening", "double"),
+                Column("closing", "double"),
+                Column("lowest", "double"),
+                Column("highest", "double"),
+                Column("volume", "double"),
+                Column("quantity", "double"),
+                Column("amount", "bigint"),
+                Column("avg_price", "double"),
+            ),
+            partition_keys=(
+                Column(
+                    "coin",
+                    "string",
+                    projection=EnumProjection(values=("BCH", "BTC", "ETH", "LTC")),
+                ),
+                Column(
+                    "month",
+                    "string",
+                    projection=DateProjection(
+                        format="yyyy-MM", range_start="2021-01", interval_unit="MONTHS"
+                    ),
+                ),
+            ),
+        ),
+    ]
+}
+
+# Tables rewritten daily by the compaction job into <name>_compacted (CompactedTable in
+# base.py), which readers use for the days it already compacted
+COMPACTED_TABLES = ("atomic_events_parquet", "orders_v2")
+
+
+def dbt_sources() -> str:
+    """
+    staging.yml with a dbt source for every table of the raw Glue database, which
+    Redshift reads through the data_lake_raw external schema
+    """
+    tables = []
+    for table in TABLES.values():
+        source = {"name": table.name, "identifier": table.name}
+        source["description"] = table.dbt_description or table.description
+        columns = []
+        for column in table.columns + table.partition_keys:
+            if column.description is None and not column.tests:
+                continue
+            spec = {"name": column.name}
+            if column.description:
+                spec["description"] = column.description
+            if column.tests:
+                spec["tests"] = list(column.tests)
+            columns.append(spec)
+        if columns:
+            source["columns"] = columns
+        tables.append(source)
+    for name in COMPACTED_TABLES:
+        tables.append(
+            {
+                "name": f"{name}_compacted",
+                "identifier": f"{name}_compacted",
+                "description": (
+                    f"{name} compacted into large parquet files per day. Only has the "
+                    "days compacted so far, read the newer ones from the raw table"
+                ),
+            }
+        )
+    sources = {
+        "version": 2,
+        "sources": [
+            {
+                "name": "data_lake_raw",
+                "schema": "data_lake_raw",
+                "loader": "kinesis",
+                "tables": tables,
+            }
+        ],
+    }
+    header = "# Generated by python -m data_platform.glue_catalog.schemas, do not edit\n"
+    return header + yaml.safe_dump(sources, sort_keys=False, width=90)
+
+
+def spark_schemas() -> dict:
+    return {
+        f"{table.name}.json": json.dumps(table.spark_struct, indent=2) + "\n"
+        for table in TABLES.values()
+        if table.spark_schema
+    }
+
+
+def generated_files() -> dict:
+    files = {DBT_SOURCES_PATH: dbt_sources()}
+    for name, content in spark_schemas().items():
+        files[os.path.join(SPARK_SCHEMAS_PATH, name)] = content
+    return files
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--check", action="store_true", help="fails if a generated file is out of date"
+    )
+    args = parser.parse_args()
+
+    outdated = []
+    for path, content in generated_files().items():
+        current = open(path).read() if os.path.exists(path) else None
+        if current == content:
+            continue
+        outdated.append(os.path.relpath(path, ROOT))
+        if not args.check:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as generated:
+                generated.write(content)
+
+    if args.check and outdated:
+        print(f"Out of date, regenerate them: {', '.join(outdated)}")
+        sys.exit(1)
+    for path in outdated:
+        print(f"Wrote {path}")
+
+
+if __name__ == "__main__":
+    main()
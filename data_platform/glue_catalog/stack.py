@@ -1,14 +1,19 @@
 from aws_cdk import core
+from aws_cdk import aws_sns as sns
 
 from data_platform.active_environment import active_environment
 from data_platform.data_lake.base import BaseDataLakeBucket
 from data_platform.glue_catalog.base import (
     BaseDataLakeGlueDatabase,
     BaseDataLakeGlueRole,
-    BaseGlueCrawler,
-    OrdersTable,
-    OrdersV2Table,
+    DataLakeTable,
+    CompactedTable,
+    CompactionJob,
+    PartitionBackfill,
+    PartitionRegistrar,
+    glue_columns,
 )
+from data_platform.glue_catalog.schemas import TABLES
 
 
 class GlueCatalogStack(core.Stack):
@@ -17,10 +22,14 @@ class GlueCatalogStack(core.Stack):
         scope: core.Construct,
         raw_data_lake_bucket: BaseDataLakeBucket,
         staged_data_lake_bucket: BaseDataLakeBucket,
+        curated_data_lake_bucket: BaseDataLakeBucket,
+        raw_object_created_topic: sns.ITopic,
         **kwargs,
     ) -> None:
         self.raw_data_lake_bucket = raw_data_lake_bucket
+        self.raw_object_created_topic = raw_object_created_topic
         self.processed_data_lake_bucket = staged_data_lake_bucket
+        self.curated_data_lake_bucket = curated_data_lake_bucket
         self.deploy_env = active_environment
         super().__init__(
             scope, id=f"{self.deploy_env.value}-glue-catalog-stack", **kwargs
@@ -34,29 +43,80 @@ class GlueCatalogStack(core.Stack):
             self, data_lake_bucket=self.processed_data_lake_bucket
         )
 
+        # Tables are created by the CTAS queries of data_platform/athena/curated.py
+        self.curated_database = BaseDataLakeGlueDatabase(
+            self, data_lake_bucket=self.curated_data_lake_bucket
+        )
+
         self.role = BaseDataLakeGlueRole(self, data_lake_bucket=self.raw_data_lake_bucket)
 
-        self.atomic_events_crawler = BaseGlueCrawler(
-            self,
-            glue_database=self.raw_database,
-            glue_role=self.role,
-            table_name="atomic_events",
-            schedule_expression="cron(0/15 * * * ? *)",
-        )
+        self.raw_tables = {}
+        for name, spec in TABLES.items():
+            table = DataLakeTable(
+                self, glue_database=self.raw_database, glue_role=self.role, spec=spec
+            )
+            table.node.add_dependency(self.raw_database)
+            table.node.add_dependency(self.role)
+            self.raw_tables[name] = table
 
-        self.atomic_events_crawler.node.add_dependency(self.raw_database)
-        self.atomic_events_crawler.node.add_dependency(self.role)
+        self.atomic_events_table = self.raw_tables["atomic_events"]
+        self.atomic_events_parquet_table = self.raw_tables["atomic_events_parquet"]
+        self.orders_table = self.raw_tables["orders"]
+        self.orders_v2_table = self.raw_tables["orders_v2"]
+        self.mercado_bitcoin_table = self.raw_tables["mercado_bitcoin"]
 
-        self.orders_table = OrdersTable(
+        self.compaction_job = CompactionJob(
             self, glue_database=self.raw_database, glue_role=self.role
         )
 
-        self.orders_table.node.add_dependency(self.raw_database)
-        self.orders_table.node.add_dependency(self.role)
+        self.compaction_job.node.add_dependency(self.raw_database)
+        self.compaction_job.node.add_dependency(self.role)
 
-        self.orders_table = OrdersV2Table(
-            self, glue_database=self.raw_database, glue_role=self.role
+        self.atomic_events_compacted_table = CompactedTable(
+            self,
+            glue_database=self.raw_database,
+            glue_role=self.role,
+            source_table_name="atomic_events_parquet",
+            columns=glue_columns(TABLES["atomic_events_parquet"].columns),
+            partition_key="event_date",
+        )
+        self.compaction_job.add_daily_trigger(
+            self.atomic_events_compacted_table,
+            source_prefix="atomic_events_parquet",
+            source_layout="hive",
+            input_format="parquet",
+            sort_columns=["user_domain_id", "event_timestamp"],
         )
 
-        self.orders_table.node.add_dependency(self.raw_database)
-        self.orders_table.node.add_dependency(self.role)
+        self.orders_v2_compacted_table = CompactedTable(
+            self,
+            glue_database=self.raw_database,
+            glue_role=self.role,
+            source_table_name="orders_v2",
+            columns=glue_columns(TABLES["orders_v2"].columns),
+            partition_key="extracted_date",
+        )
+        self.compaction_job.add_daily_trigger(
+            self.orders_v2_compacted_table,
+            source_prefix="orders/public/orders_v2",
+            source_layout="date_folder",
+            input_format="parquet",
+            sort_columns=["order_id", "extracted_at"],
+        )
+
+        # Spectrum ignores partition projection. The registrar adds the partitions of new
+        # objects and the backfill the ones already in S3, e.g. the atomic_events history
+        # that Firehose no longer writes to
+        self.partition_registrar = PartitionRegistrar(
+            self,
+            glue_database=self.raw_database,
+            object_created_topic=self.raw_object_created_topic,
+            tables=[
+                self.atomic_events_table,
+                self.atomic_events_parquet_table,
+                self.mercado_bitcoin_table,
+            ],
+        )
+        self.partition_backfill = PartitionBackfill(
+            self, registrar=self.partition_registrar
+        )
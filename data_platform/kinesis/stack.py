@@ -2,9 +2,14 @@ from aws_cdk import core
 from aws_cdk import (
     aws_kinesisfirehose as firehose,
     aws_iam as iam,
+    aws_glue as glue,
 )
 from data_platform.active_environment import active_environment
 from data_platform.data_lake.base import BaseDataLakeBucket
+from data_platform.sizing import sizing_profile
+
+# Firehose only accepts buffers of at least 64 MB when converting records to parquet
+MIN_PARQUET_BUFFER_MB = 64
 
 
 class RawKinesisRole(iam.Role):
@@ -12,10 +17,12 @@ class RawKinesisRole(iam.Role):
         self,
         scope: core.Construct,
         data_lake_raw_bucket: BaseDataLakeBucket,
+        glue_table: glue.Table = None,
         **kwargs,
     ) -> None:
         self.deploy_env = active_environment
         self.data_lake_raw_bucket = data_lake_raw_bucket
+        self.glue_table = glue_table
         super().__init__(
             scope,
             id=f"iam-{self.deploy_env.value}-data-lake-raw-firehose-role",
@@ -46,47 +53,168 @@ class RawKinesisRole(iam.Role):
                 )
             ],
         )
+        if self.glue_table is not None:
+            policy.add_statements(
+                iam.PolicyStatement(
+                    actions=[
+                        "glue:GetTable",
+                        "glue:GetTableVersion",
+                        "glue:GetTableVersions",
+                    ],
+                    resources=[
+                        f"arn:aws:glue:{core.Aws.REGION}:{core.Aws.ACCOUNT_ID}:catalog",
+                        f"arn:aws:glue:{core.Aws.REGION}:{core.Aws.ACCOUNT_ID}:database/"
+                        f"{self.glue_table.database.database_name}",
+                        self.glue_table.table_arn,
+                    ],
+                )
+            )
         self.attach_inline_policy(policy)
 
         return policy
 
 
 class KinesisStack(core.Stack):
+    """
+    Delivers atomic events to the data lake raw bucket. Given the atomic_events_table,
+    records are converted to parquet with its schema and partitioned by the date of
+    the event instead of the arrival time, otherwise they land as gzipped JSON.
+
+    Firehose only enables dynamic partitioning when a stream is created, so the
+    parquet stream is a new firehose-<env>-raw-parquet-delivery-stream. Deploying it
+    creates that stream and then deletes the JSON one, so producers (see
+    local_scripts/put_to_firehose.py) must switch to the new name with the deploy.
+    """
+
     def __init__(
         self,
         scope: core.Construct,
         data_lake_raw_bucket: BaseDataLakeBucket,
+        atomic_events_table: glue.Table = None,
         **kwargs,
     ) -> None:
         self.deploy_env = active_environment
         self.data_lake_raw_bucket = data_lake_raw_bucket
+        self.atomic_events_table = atomic_events_table
         super().__init__(scope, id=f"{self.deploy_env.value}-kinesis-stack", **kwargs)
 
+        self.kinesis_role = RawKinesisRole(
+            self,
+            data_lake_raw_bucket=self.data_lake_raw_bucket,
+            glue_table=self.atomic_events_table,
+        )
+
         self.atomic_events = firehose.CfnDeliveryStream(
             self,
-            id=f"firehose-{self.deploy_env.value}-raw-delivery-stream",
-            delivery_stream_name=f"firehose-{self.deploy_env.value}-raw-delivery-stream",
+            id=self.delivery_stream_name,
+            delivery_stream_name=self.delivery_stream_name,
             delivery_stream_type="DirectPut",
             extended_s3_destination_configuration=self.s3_config,
         )
+        # Firehose validates access to the Glue table when the stream is created
+        self.atomic_events.node.add_dependency(self.kinesis_role)
+        if self.atomic_events_table is not None:
+            self.enable_dynamic_partitioning()
+
+    @property
+    def delivery_stream_name(self):
+        # A new name and logical id, since the JSON stream can not be updated in place
+        if self.atomic_events_table is not None:
+            return f"firehose-{self.deploy_env.value}-raw-parquet-delivery-stream"
+        return f"firehose-{self.deploy_env.value}-raw-delivery-stream"
+
+    @property
+    def buffering_hints(self):
+        interval_in_seconds = sizing_profile.firehose.buffer_interval_seconds
+        size_in_m_bs = sizing_profile.firehose.buffer_size_mb
+        if self.atomic_events_table is not None:
+            size_in_m_bs = max(size_in_m_bs, MIN_PARQUET_BUFFER_MB)
+        return firehose.CfnDeliveryStream.BufferingHintsProperty(
+            interval_in_seconds=interval_in_seconds, size_in_m_bs=size_in_m_bs
+        )
 
     @property
     def s3_config(self):
+        if self.atomic_events_table is not None:
+            return self.parquet_s3_config
         return firehose.CfnDeliveryStream.ExtendedS3DestinationConfigurationProperty(
             bucket_arn=self.data_lake_raw_bucket.bucket_arn,
             compression_format="GZIP",
             error_output_prefix="bad_records",
             prefix="atomic_events/landing_date=!{timestamp:yyyy}-!{timestamp:MM}-!{timestamp:dd}/",
-            buffering_hints=firehose.CfnDeliveryStream.BufferingHintsProperty(
-                interval_in_seconds=60, size_in_m_bs=1
-            ),
+            buffering_hints=self.buffering_hints,
             role_arn=self.kinesis_role.role_arn,
         )
 
     @property
-    def kinesis_role(self):
-        return RawKinesisRole(
-            self,
-            deploy_env=self.deploy_env,
-            data_lake_raw_bucket=self.data_lake_raw_bucket,
+    def parquet_s3_config(self):
+        return firehose.CfnDeliveryStream.ExtendedS3DestinationConfigurationProperty(
+            bucket_arn=self.data_lake_raw_bucket.bucket_arn,
+            # parquet files are compressed by the serializer instead
+            compression_format="UNCOMPRESSED",
+            error_output_prefix="bad_records/!{firehose:error-output-type}/",
+            prefix="atomic_events_parquet/event_date=!{partitionKeyFromQuery:event_date}/",
+            buffering_hints=self.buffering_hints,
+            role_arn=self.kinesis_role.role_arn,
+            data_format_conversion_configuration=self.data_format_conversion_config,
+            processing_configuration=self.event_date_extraction_config,
+        )
+
+    @property
+    def data_format_conversion_config(self):
+        return firehose.CfnDeliveryStream.DataFormatConversionConfigurationProperty(
+            enabled=True,
+            input_format_configuration=firehose.CfnDeliveryStream.InputFormatConfigurationProperty(
+                deserializer=firehose.CfnDeliveryStream.DeserializerProperty(
+                    hive_json_ser_de=firehose.CfnDeliveryStream.HiveJsonSerDeProperty()
+                )
+            ),
+            output_format_configuration=firehose.CfnDeliveryStream.OutputFormatConfigurationProperty(
+                serializer=firehose.CfnDeliveryStream.SerializerProperty(
+                    parquet_ser_de=firehose.CfnDeliveryStream.ParquetSerDeProperty(
+                        compression="SNAPPY"
+                    )
+                )
+            ),
+            schema_configuration=firehose.CfnDeliveryStream.SchemaConfigurationProperty(
+                catalog_id=core.Aws.ACCOUNT_ID,
+                region=core.Aws.REGION,
+                database_name=self.atomic_events_table.database.database_name,
+                table_name=self.atomic_events_table.table_name,
+                role_arn=self.kinesis_role.role_arn,
+                version_id="LATEST",
+            ),
+        )
+
+    @property
+    def event_date_extraction_config(self):
+        """
+        Reads the event date from event_timestamp ("yyyy-MM-dd HH:mm:ss.ffffff"), so
+        late events land in the partition of the day they happened
+        """
+        return firehose.CfnDeliveryStream.ProcessingConfigurationProperty(
+            enabled=True,
+            processors=[
+                firehose.CfnDeliveryStream.ProcessorProperty(
+                    type="MetadataExtraction",
+                    parameters=[
+                        firehose.CfnDeliveryStream.ProcessorParameterProperty(
+                            parameter_name="MetadataExtractionQuery",
+                            parameter_value="{event_date: .event_timestamp[0:10]}",
+                        ),
+                        firehose.CfnDeliveryStream.ProcessorParameterProperty(
+                            parameter_name="JsonParsingEngine",
+                            parameter_value="JQ-1.6",
+                        ),
+                    ],
+                )
+            ],
+        )
+
+    def enable_dynamic_partitioning(self):
+        # DynamicPartitioningConfiguration is not modelled by this CDK version yet. It
+        # can only be set when the stream is created, see delivery_stream_name
+        self.atomic_events.add_property_override(
+            "ExtendedS3DestinationConfiguration.DynamicPartitioningConfiguration",
+            {"Enabled": True, "RetryOptions": {"DurationInSeconds": 300}},
         )
@@ -0,0 +1,62 @@
+"""
+Custom resource provider creating an external schema over a Glue database with the
+Redshift Data API, authenticated with the cluster admin secret.
+
+executeStatement only queues the statements, so on_event returns their id and
+is_complete polls describeStatement until they finish. A failed statement fails the
+deploy instead of being reported as created. Only the IAM principal that ran a
+statement can describe it, so one function serves both, dispatched by handler.
+
+CREATE ... IF NOT EXISTS does nothing when the schema exists, so an update drops the
+schema and creates it again with the new Glue database or role.
+"""
+
+import boto3
+
+redshift_data = boto3.client("redshift-data")
+
+
+def on_event(event, context):
+    properties = event["ResourceProperties"]
+    schema_name = properties["SchemaName"]
+    drop = f"DROP SCHEMA IF EXISTS {schema_name}"
+    create = (
+        f"CREATE EXTERNAL SCHEMA IF NOT EXISTS {schema_name} "
+        f"FROM DATA CATALOG DATABASE '{properties['GlueDatabaseName']}' "
+        f"REGION '{properties['Region']}' IAM_ROLE '{properties['RoleArn']}'"
+    )
+    sqls = {"Create": [create], "Update": [drop, create], "Delete": [drop]}[
+        event["RequestType"]
+    ]
+    statement = redshift_data.batch_execute_statement(
+        ClusterIdentifier=properties["ClusterIdentifier"],
+        Database=properties["Database"],
+        SecretArn=properties["SecretArn"],
+        Sqls=sqls,
+    )
+    print(f"Started {statement['Id']}: {'; '.join(sqls)}")
+    return {
+        "PhysicalResourceId": (
+            f"{properties['ClusterIdentifier']}-{properties['Database']}-{schema_name}"
+        ),
+        "Data": {"StatementId": statement["Id"]},
+    }
+
+
+def handler(event, context):
+    """
+    The provider passes is_complete the on_event event with the Data it returned
+    """
+    if "StatementId" in event.get("Data", {}):
+        return is_complete(event, context)
+    return on_event(event, context)
+
+
+def is_complete(event, context):
+    statement_id = event["Data"]["StatementId"]
+    statement = redshift_data.describe_statement(Id=statement_id)
+    status = statement["Status"]
+    print(f"{statement_id} is {status}")
+    if status in ("FAILED", "ABORTED"):
+        raise RuntimeError(f"Statement {statement_id} {status}: {statement.get('Error')}")
+    return {"IsComplete": status == "FINISHED"}
@@ -1,16 +1,33 @@
+import os
+
 from aws_cdk import core
-from aws_cdk import aws_redshift as redshift, aws_ec2 as ec2, aws_iam as iam
+from aws_cdk import (
+    aws_redshift as redshift,
+    aws_ec2 as ec2,
+    aws_glue as glue,
+    aws_iam as iam,
+    aws_lambda as lambda_,
+    custom_resources as cr,
+)
 from data_platform.data_lake.base import BaseDataLakeBucket
 from data_platform.active_environment import active_environment
+from data_platform.sizing import sizing_profile
 
 from data_platform.common_stack import CommonStack
 
 """
-CREATE EXTERNAL SCHEMA data_lake_raw
+The data_lake_raw external schema read by dbt is created by ExternalSchema, running
+
+CREATE EXTERNAL SCHEMA IF NOT EXISTS data_lake_raw
 FROM DATA CATALOG
-DATABASE 'glue_belisco_develop_data_lake_raw'
-REGION 'us-east-1'
-IAM_ROLE 'arn:aws:iam::820187792016:role/develop-redshift-stack-iamdevelopredshiftspectrumr-SMTW4PNGK8YI'
+DATABASE 'glue_belisco_<env>_data_lake_raw'
+REGION '<region>'
+IAM_ROLE '<SpectrumRole arn>'
+
+through the Redshift Data API, failing the deploy when the statement fails. The hot
+dbt marts are local tables and materialized views (see
+projeto_dbt/macros/materialized_view.sql), so dashboards read local storage and only
+the incremental loads scan S3 through Spectrum.
 """
 
 
@@ -53,6 +70,78 @@ class SpectrumRole(iam.Role):
         self.attach_inline_policy(policy)
 
 
+class ExternalSchema(core.CustomResource):
+    """
+    Creates an external schema over a glue database with the Redshift Data API,
+    authenticated with the cluster admin secret. The provider waits for the statements
+    to finish, so a failed CREATE fails the deploy, and an update recreates the schema
+    """
+
+    def __init__(
+        self,
+        scope: core.Construct,
+        cluster: redshift.Cluster,
+        database_name: str,
+        schema_name: str,
+        glue_database: glue.Database,
+        role: iam.Role,
+        **kwargs,
+    ) -> None:
+        self.deploy_env = active_environment
+        self.cluster = cluster
+        self.schema_name = schema_name
+        self.obj_name = f"{self.deploy_env.value}-redshift-external-schema-{schema_name}"
+
+        # Only the principal that ran a statement can describe it, so a single function
+        # starts the statements and waits for them
+        self.function = lambda_.Function(
+            scope,
+            f"{self.obj_name}-function",
+            function_name=f"lambda-{self.obj_name}",
+            description=f"Runs the statements of the {schema_name} external schema",
+            runtime=lambda_.Runtime.PYTHON_3_8,
+            handler="index.handler",
+            code=lambda_.Code.from_asset(
+                os.path.join(os.path.dirname(__file__), "functions", "external_schema")
+            ),
+            timeout=core.Duration.seconds(60),
+        )
+        self.function.add_to_role_policy(
+            iam.PolicyStatement(
+                actions=[
+                    "redshift-data:BatchExecuteStatement",
+                    "redshift-data:DescribeStatement",
+                ],
+                resources=["*"],
+            )
+        )
+        cluster.secret.grant_read(self.function)
+
+        self.provider = cr.Provider(
+            scope,
+            f"{self.obj_name}-provider",
+            on_event_handler=self.function,
+            is_complete_handler=self.function,
+            query_interval=core.Duration.seconds(10),
+            total_timeout=core.Duration.minutes(10),
+        )
+        super().__init__(
+            scope,
+            id=self.obj_name,
+            service_token=self.provider.service_token,
+            properties={
+                "ClusterIdentifier": cluster.cluster_name,
+                "Database": database_name,
+                "SecretArn": cluster.secret.secret_arn,
+                "SchemaName": schema_name,
+                "GlueDatabaseName": glue_database.database_name,
+                "Region": core.Stack.of(scope).region,
+                "RoleArn": role.role_arn,
+            },
+        )
+        self.node.add_dependency(cluster)
+
+
 class RedshiftStack(core.Stack):
     def __init__(
         self,
@@ -60,9 +149,11 @@ class RedshiftStack(core.Stack):
         data_lake_raw: BaseDataLakeBucket,
         data_lake_processed: BaseDataLakeBucket,
         common_stack: CommonStack,
+        raw_glue_database: glue.Database,
         **kwargs,
     ) -> None:
         self.common_stack = common_stack
+        self.raw_glue_database = raw_glue_database
         self.data_lake_raw = data_lake_raw
         self.deploy_env = active_environment
         self.data_lake_processed = data_lake_processed
@@ -85,19 +176,32 @@ class RedshiftStack(core.Stack):
                 peer=ec2.Peer.ipv4(subnet.ipv4_cidr_block), connection=ec2.Port.tcp(5439)
             )
 
+        self.spectrum_role = SpectrumRole(
+            self, self.data_lake_raw, self.data_lake_processed
+        )
+
         self.redshift_cluster = redshift.Cluster(
             self,
             f"belisco-{self.deploy_env.value}-redshift",
             cluster_name=f"belisco-{self.deploy_env.value}-redshift",
             vpc=self.common_stack.custom_vpc,
             cluster_type=redshift.ClusterType.MULTI_NODE,
-            node_type=redshift.NodeType.DC2_LARGE,
+            node_type=sizing_profile.redshift.node_type,
             default_database_name="dw",
-            number_of_nodes=2,
+            number_of_nodes=sizing_profile.redshift.number_of_nodes,
             removal_policy=core.RemovalPolicy.DESTROY,
             master_user=redshift.Login(master_username="admin"),
             publicly_accessible=True,
-            roles=[SpectrumRole(self, self.data_lake_raw, self.data_lake_processed)],
+            roles=[self.spectrum_role],
             security_groups=[self.redshift_sg],
             vpc_subnets=ec2.SubnetSelection(subnet_type=ec2.SubnetType.PUBLIC),
         )
+
+        self.data_lake_raw_schema = ExternalSchema(
+            self,
+            cluster=self.redshift_cluster,
+            database_name="dw",
+            schema_name="data_lake_raw",
+            glue_database=self.raw_glue_database,
+            role=self.spectrum_role,
+        )
@@ -0,0 +1,100 @@
+"""
+Capacity settings of each stack per environment. Production runs bigger batches,
+instances and worker pools than develop and staging.
+"""
+
+import sys
+from dataclasses import asdict, dataclass
+
+from aws_cdk import aws_redshift as redshift
+
+from data_platform.active_environment import active_environment, Environment
+
+
+@dataclass(frozen=True)
+class FirehoseSizing:
+    # Larger buffers mean fewer, bigger files at the cost of a longer delay
+    buffer_interval_seconds: int
+    buffer_size_mb: int
+
+
+@dataclass(frozen=True)
+class DmsSizing:
+    replication_instance_class: str
+    allocated_storage_gb: int
+    # Full load files are split at max_file_size_kb. CDC files are written every
+    # cdc_max_batch_interval_seconds, or sooner once they reach cdc_min_file_size_kb
+    max_file_size_kb: int
+    cdc_max_batch_interval_seconds: int
+    cdc_min_file_size_kb: int
+
+
+@dataclass(frozen=True)
+class AirflowSizing:
+    environment_class: str
+    min_workers: int
+    max_workers: int
+
+
+@dataclass(frozen=True)
+class RedshiftSizing:
+    node_type: redshift.NodeType
+    number_of_nodes: int
+
+
+@dataclass(frozen=True)
+class SizingProfile:
+    firehose: FirehoseSizing
+    dms: DmsSizing
+    airflow: AirflowSizing
+    redshift: RedshiftSizing
+
+
+DEVELOP_PROFILE = SizingProfile(
+    firehose=FirehoseSizing(buffer_interval_seconds=60, buffer_size_mb=64),
+    dms=DmsSizing(
+        replication_instance_class="dms.t2.small",
+        allocated_storage_gb=100,
+        max_file_size_kb=131072,
+        cdc_max_batch_interval_seconds=120,
+        cdc_min_file_size_kb=32000,
+    ),
+    airflow=AirflowSizing(environment_class="mw1.small", min_workers=1, max_workers=2),
+    redshift=RedshiftSizing(node_type=redshift.NodeType.DC2_LARGE, number_of_nodes=2),
+)
+
+PROFILES = {
+    Environment.DEVELOP: DEVELOP_PROFILE,
+    Environment.STAGING: SizingProfile(
+        firehose=FirehoseSizing(buffer_interval_seconds=300, buffer_size_mb=64),
+        dms=DEVELOP_PROFILE.dms,
+        airflow=DEVELOP_PROFILE.airflow,
+        redshift=DEVELOP_PROFILE.redshift,
+    ),
+    Environment.PRODUCTION: SizingProfile(
+        firehose=FirehoseSizing(buffer_interval_seconds=900, buffer_size_mb=128),
+        dms=DmsSizing(
+            replication_instance_class="dms.c5.large",
+            allocated_storage_gb=200,
+            max_file_size_kb=262144,
+            cdc_max_batch_interval_seconds=300,
+            cdc_min_file_size_kb=64000,
+        ),
+        airflow=AirflowSizing(
+            environment_class="mw1.medium", min_workers=2, max_workers=5
+        ),
+        redshift=RedshiftSizing(node_type=redshift.NodeType.DC2_LARGE, number_of_nodes=4),
+    ),
+}
+
+sizing_profile = PROFILES[active_environment]
+
+
+def report(profile: SizingProfile = sizing_profile, stream=sys.stderr):
+    """
+    Prints the effective settings of each stack, written to stderr at synth time
+    """
+    print(f"Sizing profile for {active_environment.value}:", file=stream)
+    for stack, settings in asdict(profile).items():
+        values = ", ".join(f"{name}={value}" for name, value in settings.items())
+        print(f"  {stack}: {values}", file=stream)
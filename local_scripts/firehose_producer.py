@@ -0,0 +1,207 @@
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+# Firehose PutRecordBatch limits
+# https://docs.aws.amazon.com/firehose/latest/APIReference/API_PutRecordBatch.html
+MAX_BATCH_RECORDS = 500
+MAX_BATCH_BYTES = 4 * 1024 * 1024
+MAX_RECORD_BYTES = 1000 * 1024
+
+
+class FirehoseProducer:
+    """
+    Buffers records and sends them to a Firehose delivery stream using put_record_batch.
+
+    A batch is flushed when it reaches the record/size limit or when it has been waiting
+    for more than `linger_seconds`. Batches are sent from a bounded thread pool. Records
+    flagged with an ErrorCode in the response, or the whole batch when the call raises
+    (e.g. throttling), are retried with backoff and then counted as failed.
+
+    The client only needs a `put_record_batch` method, so a stub can be used locally.
+    """
+
+    def __init__(
+        self,
+        client,
+        delivery_stream_name: str,
+        max_batch_records: int = MAX_BATCH_RECORDS,
+        max_batch_bytes: int = MAX_BATCH_BYTES,
+        linger_seconds: float = 1.0,
+        max_workers: int = 4,
+        max_retries: int = 5,
+        retry_backoff_seconds: float = 0.1,
+    ) -> None:
+        self.client = client
+        self.delivery_stream_name = delivery_stream_name
+        self.max_batch_records = min(max_batch_records, MAX_BATCH_RECORDS)
+        self.max_batch_bytes = min(max_batch_bytes, MAX_BATCH_BYTES)
+        self.linger_seconds = linger_seconds
+        self.max_retries = max_retries
+        self.retry_backoff_seconds = retry_backoff_seconds
+
+        self.records_sent = 0
+        self.records_failed = 0
+        self.batches_sent = 0
+
+        self._buffer = []
+        self._buffer_bytes = 0
+        self._buffer_started_at = None
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        # In-flight batches and their number of records
+        self._futures = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        # Blocks the caller when every worker is busy and one batch is already queued
+        # per worker, so memory stays bounded when the stream is slower than the producer
+        self._slots = threading.BoundedSemaphore(max_workers * 2)
+        self._closed = threading.Event()
+        self._linger_thread = threading.Thread(target=self._flush_on_linger, daemon=True)
+        self._linger_thread.start()
+
+    def put(self, event: dict) -> None:
+        """
+        Serializes an event as a JSON line and adds it to the buffer
+        """
+        self.put_record((json.dumps(event) + "\n").encode("utf-8"))
+
+    def put_record(self, data: bytes) -> None:
+        """
+        Adds a raw record to the buffer, flushing it first if the record does not fit
+        """
+        if len(data) > MAX_RECORD_BYTES:
+            raise ValueError(
+                f"Record has {len(data)} bytes, Firehose accepts at most {MAX_RECORD_BYTES}"
+            )
+        if self._closed.is_set():
+            raise RuntimeError("Producer is closed")
+
+        full_batches = []
+        with self._lock:
+            # A record bigger than max_batch_bytes is sent alone
+            if self._buffer and (
+                len(self._buffer) >= self.max_batch_records
+                or self._buffer_bytes + len(data) > self.max_batch_bytes
+            ):
+                full_batches.append(self._drain())
+            if not self._buffer:
+                self._buffer_started_at = time.monotonic()
+            self._buffer.append(data)
+            self._buffer_bytes += len(data)
+            if len(self._buffer) >= self.max_batch_records:
+                full_batches.append(self._drain())
+
+        for batch in full_batches:
+            self._submit(batch)
+
+    def flush(self) -> None:
+        """
+        Sends whatever is buffered and waits for all in-flight batches
+        """
+        with self._lock:
+            batch = self._drain()
+        if batch:
+            self._submit(batch)
+
+        with self._lock:
+            futures = list(self._futures)
+        # Failed batches are counted in records_failed by _on_done
+        wait(futures)
+
+    def close(self) -> None:
+        self._closed.set()
+        self._linger_thread.join()
+        self.flush()
+        self._executor.shutdown(wait=True)
+        logger.info(
+            f"Producer closed: {self.records_sent} records sent in {self.batches_sent} "
+            f"batches, {self.records_failed} records failed"
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _drain(self) -> list:
+        """
+        Empties the buffer and returns its records. Must be called holding self._lock
+        """
+        batch = self._buffer
+        self._buffer = []
+        self._buffer_bytes = 0
+        self._buffer_started_at = None
+        return batch
+
+    def _submit(self, batch: list) -> None:
+        self._slots.acquire()
+        future = self._executor.submit(self._send, batch)
+        with self._lock:
+            self._futures[future] = len(batch)
+        future.add_done_callback(self._on_done)
+
+    def _on_done(self, future) -> None:
+        with self._lock:
+            records = self._futures.pop(future, 0)
+        self._slots.release()
+        error = future.exception()
+        if error is not None:
+            logger.error(f"Batch of {records} records failed: {error!r}")
+            self._record_stats(failed=records)
+
+    def _flush_on_linger(self) -> None:
+        while not self._closed.wait(timeout=self.linger_seconds / 4):
+            with self._lock:
+                expired = (
+                    self._buffer_started_at is not None
+                    and time.monotonic() - self._buffer_started_at >= self.linger_seconds
+                )
+                batch = self._drain() if expired else []
+            if batch:
+                self._submit(batch)
+
+    def _send(self, records: list) -> None:
+        attempt = 0
+        while True:
+            try:
+                response = self.client.put_record_batch(
+                    DeliveryStreamName=self.delivery_stream_name,
+                    Records=[{"Data": record} for record in records],
+                )
+            except Exception as error:
+                # Throttling or service errors reject the whole batch
+                logger.warning(f"put_record_batch failed: {error!r}")
+                retry = records
+            else:
+                if response["FailedPutCount"] == 0:
+                    self._record_stats(batches=1, sent=len(records))
+                    return
+                retry = [
+                    record
+                    for record, result in zip(records, response["RequestResponses"])
+                    if result.get("ErrorCode")
+                ]
+                self._record_stats(batches=1, sent=len(records) - len(retry))
+
+            attempt += 1
+            if attempt > self.max_retries:
+                logger.error(
+                    f"Giving up on {len(retry)} records after {self.max_retries} retries"
+                )
+                self._record_stats(failed=len(retry))
+                return
+
+            logger.warning(f"Retrying {len(retry)} failed records (attempt {attempt})")
+            time.sleep(self.retry_backoff_seconds * 2 ** (attempt - 1))
+            records = retry
+
+    def _record_stats(self, batches: int = 0, sent: int = 0, failed: int = 0) -> None:
+        with self._stats_lock:
+            self.batches_sent += batches
+            self.records_sent += sent
+            self.records_failed += failed
@@ -1,54 +1,74 @@
-import psycopg2
-from datetime import datetime
-from random import choice
+import argparse
 import time
-import uuid
-
-dsn = (
-    "dbname={dbname} "
-    "user={user} "
-    "password={password} "
-    "port={port} "
-    "host={host} ".format(
-        dbname="orders",
-        user="postgres",
-        password=",MHCILqBEZ_L5Ev4r1eLMr=W2Ff-5A",
-        port=5432,
-        host="rds-production-orders-db.cjuefeiklqc5.us-east-1.rds.amazonaws.com",
-    )
+
+import psycopg2
+
+from orders import (
+    ThroughputReporter,
+    copy_batch,
+    create_orders_table,
+    dsn,
+    insert_batch,
+    positive_float,
+    random_order,
+)
+
+parser = argparse.ArgumentParser(description="Generates orders into orders_v2")
+parser.add_argument(
+    "--mode",
+    choices=["stream", "bulk"],
+    default="stream",
+    help="stream: keeps inserting at --rate rows/s. bulk: loads --rows with COPY",
+)
+parser.add_argument(
+    "--rate", type=positive_float, default=5, help="target rows/s in stream mode"
 )
+parser.add_argument("--rows", type=int, default=100000, help="rows to load in bulk mode")
+parser.add_argument("--batch-size", type=int, default=1000, help="rows per transaction")
+parser.add_argument(
+    "--report-every", type=float, default=5, help="seconds between reports"
+)
+args = parser.parse_args()
+
+
+def stream(conn, reporter):
+    """
+    Inserts orders at the target rate, sending up to --batch-size rows per transaction
+    """
+    while True:
+        due = int(args.rate * reporter.elapsed) - reporter.rows
+        if due <= 0:
+            time.sleep(min(1 / args.rate, 0.1))
+            continue
+        batch = [random_order() for _ in range(min(due, args.batch_size))]
+        insert_batch(conn, batch)
+        reporter.add(len(batch))
+
+
+def bulk(conn, reporter):
+    """
+    Loads --rows orders as fast as possible using COPY, one transaction per batch
+    """
+    while reporter.rows < args.rows:
+        size = min(args.batch_size, args.rows - reporter.rows)
+        copy_batch(conn, [random_order() for _ in range(size)])
+        reporter.add(size)
+
 
 conn = psycopg2.connect(dsn)
 print("connected")
-conn.set_session(autocommit=True)
-cur = conn.cursor()
-cur.execute(
-    "create table if not exists orders_v2("
-    "created_at timestamp,"
-    "order_id uuid PRIMARY KEY,"
-    "product_name varchar(100),"
-    "value float);"
-)
+with conn.cursor() as cur:
+    create_orders_table(cur)
+conn.commit()
 
-products = {
-    "casa": 500000.00,
-    "carro": 69900.00,
-    "moto": 7900.00,
-    "caminhao": 230000.00,
-    "laranja": 0.5,
-    "borracha": 0.3,
-    "iphone": 1000000.00,
-}
-
-
-while True:
-    order_id = uuid.uuid4()
-    created_at = datetime.now().isoformat()
-    product_name, value = choice(list(products.items()))
-    cur.execute(
-        f"insert into orders_v2 values ('{created_at}', '{order_id}', '{product_name}', {value})"
-    )
-    print(
-        f"insert into orders values ('{created_at}', '{order_id}', '{product_name}', {value})"
-    )
-    time.sleep(0.2)
+reporter = ThroughputReporter(report_every=args.report_every)
+try:
+    if args.mode == "stream":
+        stream(conn, reporter)
+    else:
+        bulk(conn, reporter)
+except KeyboardInterrupt:
+    pass
+finally:
+    reporter.summary()
+    conn.close()
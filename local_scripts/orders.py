@@ -0,0 +1,123 @@
+import argparse
+import csv
+import io
+import threading
+import time
+import uuid
+from datetime import datetime
+from random import choice
+
+from psycopg2.extras import execute_values
+
+dsn = (
+    "dbname={dbname} "
+    "user={user} "
+    "password={password} "
+    "port={port} "
+    "host={host} ".format(
+        dbname="orders",
+        user="postgres",
+        password=",MHCILqBEZ_L5Ev4r1eLMr=W2Ff-5A",
+        port=5432,
+        host="rds-production-orders-db.cjuefeiklqc5.us-east-1.rds.amazonaws.com",
+    )
+)
+
+products = {
+    "casa": 500000.00,
+    "carro": 69900.00,
+    "moto": 7900.00,
+    "caminhao": 230000.00,
+    "laranja": 0.5,
+    "borracha": 0.3,
+    "iphone": 1000000.00,
+}
+
+product_items = list(products.items())
+
+columns = ("created_at", "order_id", "product_name", "value")
+
+
+def positive_float(value: str) -> float:
+    """
+    argparse type for rates, which the scripts divide by
+    """
+    number = float(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"must be greater than 0, got {value}")
+    return number
+
+
+def create_orders_table(cur):
+    cur.execute(
+        "create table if not exists orders_v2("
+        "created_at timestamp,"
+        "order_id uuid PRIMARY KEY,"
+        "product_name varchar(100),"
+        "value float);"
+    )
+
+
+def random_order():
+    """
+    Returns a new order as a tuple in the orders_v2 column order
+    """
+    product_name, value = choice(product_items)
+    return datetime.now(), str(uuid.uuid4()), product_name, value
+
+
+def insert_batch(conn, batch):
+    with conn.cursor() as cur:
+        execute_values(
+            cur,
+            f"insert into orders_v2 ({', '.join(columns)}) values %s",
+            batch,
+            page_size=len(batch),
+        )
+    conn.commit()
+
+
+def copy_batch(conn, batch):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(batch)
+    buffer.seek(0)
+    with conn.cursor() as cur:
+        cur.copy_expert(
+            f"copy orders_v2 ({', '.join(columns)}) from stdin with (format csv)", buffer
+        )
+    conn.commit()
+
+
+class ThroughputReporter:
+    """
+    Counts written rows and prints the achieved rows/s every `report_every` seconds
+    """
+
+    def __init__(self, report_every: float, unit: str = "rows") -> None:
+        self.lock = threading.Lock()
+        self.unit = unit
+        self.report_every = report_every
+        self.started_at = time.monotonic()
+        self.last_report_at = self.started_at
+        self.last_report_rows = 0
+        self.rows = 0
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def add(self, rows: int) -> None:
+        with self.lock:
+            self.rows += rows
+            now = time.monotonic()
+            if now - self.last_report_at >= self.report_every:
+                rate = (self.rows - self.last_report_rows) / (now - self.last_report_at)
+                print(f"{self.rows} {self.unit} written, {rate:.0f} {self.unit}/s")
+                self.last_report_at = now
+                self.last_report_rows = self.rows
+
+    def summary(self) -> None:
+        print(
+            f"{self.rows} {self.unit} written in {self.elapsed:.1f}s "
+            f"({self.rows / self.elapsed:.0f} {self.unit}/s)"
+        )
@@ -1,22 +1,46 @@
+import argparse
+import logging
+import time
+
 import boto3
-import json
+from botocore.config import Config
 from fake_web_events import Simulation
 
-client = boto3.client("firehose")
+from firehose_producer import FirehoseProducer
+
+logging.basicConfig(level=logging.INFO)
 
+parser = argparse.ArgumentParser(description="Sends fake web events to Firehose")
+parser.add_argument(
+    "--delivery-stream-name", default="firehose-production-raw-parquet-delivery-stream"
+)
+parser.add_argument("--duration-seconds", type=int, default=10000)
+parser.add_argument("--user-pool-size", type=int, default=100)
+parser.add_argument("--sessions-per-day", type=int, default=1000)
+parser.add_argument("--max-workers", type=int, default=8)
+parser.add_argument("--linger-seconds", type=float, default=1.0)
+args = parser.parse_args()
 
-def put_record(event):
-    data = json.dumps(event) + "\n"
-    response = client.put_record(
-        DeliveryStreamName="firehose-production-raw-delivery-stream",
-        Record={"Data": data},
-    )
-    print(event)
-    return response
+client = boto3.client("firehose", config=Config(max_pool_connections=args.max_workers))
 
+simulation = Simulation(
+    user_pool_size=args.user_pool_size, sessions_per_day=args.sessions_per_day
+)
+events = simulation.run(duration_seconds=args.duration_seconds)
 
-simulation = Simulation(user_pool_size=100, sessions_per_day=1000)
-events = simulation.run(duration_seconds=10000)
+started_at = time.monotonic()
+with FirehoseProducer(
+    client,
+    delivery_stream_name=args.delivery_stream_name,
+    max_workers=args.max_workers,
+    linger_seconds=args.linger_seconds,
+) as producer:
+    for event in events:
+        producer.put(event)
 
-for event in events:
-    put_record(event)
+elapsed = time.monotonic() - started_at
+print(
+    f"{producer.records_sent} events sent in {elapsed:.1f}s "
+    f"({producer.records_sent / elapsed:.0f} events/s), "
+    f"{producer.records_failed} failed"
+)
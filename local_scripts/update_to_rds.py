@@ -1,34 +1,252 @@
-import psycopg2
-
-dsn = (
-    "dbname={dbname} "
-    "user={user} "
-    "password={password} "
-    "port={port} "
-    "host={host} ".format(
-        dbname="orders",
-        user="postgres",
-        password=",MHCILqBEZ_L5Ev4r1eLMr=W2Ff-5A",
-        port=5432,
-        host="rds-production-orders-db.cjuefeiklqc5.us-east-1.rds.amazonaws.com",
-    )
+import argparse
+import logging
+import random
+import threading
+import time
+from collections import Counter
+
+from psycopg2.extras import execute_batch, execute_values
+from psycopg2.pool import ThreadedConnectionPool
+
+from orders import (
+    ThroughputReporter,
+    columns,
+    create_orders_table,
+    dsn,
+    positive_float,
+    random_order,
 )
 
-conn = psycopg2.connect(dsn)
-print("connected")
-conn.set_session(autocommit=True)
-cur = conn.cursor()
-
-# cur.execute(
-#     f"update orders_v2 set value = 500000 where order_id='86a9a8a0-682e-435d-955e-dd61d888412b'"
-# )
-# cur.execute(
-#     f"update orders_v2 set value = 200 where order_id='86a9a8a0-682e-435d-955e-dd61d888412b'"
-# )
-# cur.execute(
-#     f"delete from orders_v2 where order_id='87744bf8-05b4-4e51-807e-5a07960fb450'"
-# )
-
-cur.execute(
-    f"delete from orders_v2 where order_id='65bd991a-73cd-4db3-a92a-64dc96ab6a67'"
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+parser = argparse.ArgumentParser(
+    description="Replays a mix of inserts, updates and deletes against orders_v2"
+)
+parser.add_argument("--inserts", type=float, default=60, help="weight of inserts")
+parser.add_argument("--updates", type=float, default=30, help="weight of updates")
+parser.add_argument("--deletes", type=float, default=10, help="weight of deletes")
+parser.add_argument("--rate", type=positive_float, default=100, help="target ops/s")
+parser.add_argument("--batch-size", type=int, default=100, help="ops per transaction")
+parser.add_argument("--connections", type=int, default=4, help="connection pool size")
+parser.add_argument(
+    "--sample-size", type=int, default=10000, help="existing order_ids cached on start"
+)
+parser.add_argument(
+    "--duration", type=float, default=None, help="seconds to run, forever if not set"
+)
+parser.add_argument(
+    "--report-every", type=float, default=5, help="seconds between reports"
+)
+parser.add_argument(
+    "--max-retries",
+    type=int,
+    default=5,
+    help="retries of a failed batch before the run stops",
 )
+args = parser.parse_args()
+
+
+class KeySample:
+    """
+    In-memory sample of existing order_ids, so picking a target key never hits the database.
+    Committed inserts are added and deleted keys are removed as the workload runs. Once
+    the sample holds `max_size` keys, new keys replace random ones.
+    """
+
+    def __init__(self, keys: list, max_size: int) -> None:
+        self.keys = keys
+        self.max_size = max_size
+        self.lock = threading.Lock()
+
+    def add(self, keys: list) -> None:
+        with self.lock:
+            for key in keys:
+                if len(self.keys) < self.max_size:
+                    self.keys.append(key)
+                elif self.keys:
+                    self.keys[random.randrange(len(self.keys))] = key
+
+    def pick(self):
+        with self.lock:
+            return random.choice(self.keys) if self.keys else None
+
+    def pop(self):
+        with self.lock:
+            if not self.keys:
+                return None
+            index = random.randrange(len(self.keys))
+            self.keys[index], self.keys[-1] = self.keys[-1], self.keys[index]
+            return self.keys.pop()
+
+
+def load_key_sample(pool) -> KeySample:
+    conn = pool.getconn()
+    try:
+        with conn.cursor() as cur:
+            create_orders_table(cur)
+            cur.execute(
+                "select order_id from orders_v2 order by random() limit %s",
+                (args.sample_size,),
+            )
+            keys = [row[0] for row in cur.fetchall()]
+        conn.commit()
+    finally:
+        pool.putconn(conn)
+    print(f"{len(keys)} order_ids cached")
+    return KeySample(keys, max_size=args.sample_size)
+
+
+def build_batch(sample: KeySample, size: int):
+    """
+    Draws `size` ops from the configured mix. Updates and deletes fall back to inserts
+    when the sample is empty.
+    """
+    inserts, updates, deletes = [], [], []
+    ops = random.choices(
+        ["insert", "update", "delete"],
+        weights=[args.inserts, args.updates, args.deletes],
+        k=size,
+    )
+    for op in ops:
+        if op == "update":
+            key = sample.pick()
+            if key is not None:
+                updates.append((random_order()[3], key))
+                continue
+        elif op == "delete":
+            key = sample.pop()
+            if key is not None:
+                deletes.append((key,))
+                continue
+        inserts.append(random_order())
+    return inserts, updates, deletes
+
+
+def run_batch(pool, inserts, updates, deletes) -> None:
+    """
+    Runs the batch in one transaction. The rows to update and delete are locked first,
+    all together in order_id order, so concurrent batches can not deadlock on them
+    """
+    keys = sorted({key for _, key in updates} | {key for (key,) in deletes})
+    conn = pool.getconn()
+    try:
+        with conn.cursor() as cur:
+            if keys:
+                cur.execute(
+                    "select order_id from orders_v2 where order_id = any(%s::uuid[]) "
+                    "order by order_id for update",
+                    (keys,),
+                )
+            if inserts:
+                execute_values(
+                    cur,
+                    f"insert into orders_v2 ({', '.join(columns)}) values %s",
+                    inserts,
+                    page_size=len(inserts),
+                )
+            if updates:
+                execute_batch(
+                    cur,
+                    "update orders_v2 set value = %s where order_id = %s",
+                    updates,
+                    page_size=len(updates),
+                )
+            if deletes:
+                execute_batch(
+                    cur,
+                    "delete from orders_v2 where order_id = %s",
+                    deletes,
+                    page_size=len(deletes),
+                )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn)
+
+
+def run_batch_with_retries(pool, reporter, counts, inserts, updates, deletes) -> None:
+    """
+    Runs the same batch again after a failure, with a backoff, up to --max-retries times
+    """
+    for attempt in range(1, args.max_retries + 2):
+        try:
+            run_batch(pool, inserts, updates, deletes)
+            return
+        except Exception:
+            with reporter.lock:
+                counts["error"] += 1
+            if attempt > args.max_retries:
+                raise
+            logger.warning(
+                f"Batch failed, retrying ({attempt}/{args.max_retries})", exc_info=True
+            )
+            time.sleep(min(2**attempt * 0.1, 5))
+
+
+def worker(pool, sample, reporter, counts, stop) -> None:
+    while not stop.is_set():
+        with reporter.lock:
+            due = int(args.rate * reporter.elapsed) - reporter.rows - counts["reserved"]
+            size = min(due, args.batch_size)
+            if size > 0:
+                counts["reserved"] += size
+        if size <= 0:
+            time.sleep(min(1 / args.rate, 0.1))
+            continue
+
+        inserts, updates, deletes = [], [], []
+        try:
+            inserts, updates, deletes = build_batch(sample, size)
+            run_batch_with_retries(pool, reporter, counts, inserts, updates, deletes)
+        except Exception:
+            # The deleted keys still exist, the inserted ones were never added
+            sample.add([key for (key,) in deletes])
+            logger.exception(f"Batch failed after {args.max_retries} retries, stopping")
+            stop.set()
+            return
+        finally:
+            with reporter.lock:
+                counts["reserved"] -= size
+
+        sample.add([order[1] for order in inserts])
+        reporter.add(size)
+        with reporter.lock:
+            counts["insert"] += len(inserts)
+            counts["update"] += len(updates)
+            counts["delete"] += len(deletes)
+
+
+pool = ThreadedConnectionPool(1, args.connections, dsn)
+print("connected")
+sample = load_key_sample(pool)
+reporter = ThroughputReporter(report_every=args.report_every, unit="ops")
+counts = Counter()
+stop = threading.Event()
+threads = [
+    threading.Thread(
+        target=worker, args=(pool, sample, reporter, counts, stop), daemon=True
+    )
+    for _ in range(args.connections)
+]
+for thread in threads:
+    thread.start()
+
+try:
+    deadline = time.monotonic() + args.duration if args.duration else None
+    while not stop.is_set() and (deadline is None or time.monotonic() < deadline):
+        time.sleep(0.5)
+except KeyboardInterrupt:
+    pass
+finally:
+    stop.set()
+    for thread in threads:
+        thread.join()
+    reporter.summary()
+    print(
+        f"inserts={counts['insert']} updates={counts['update']} deletes={counts['delete']} "
+        f"failed attempts={counts['error']}"
+    )
+    pool.closeall()
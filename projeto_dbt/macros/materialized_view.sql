@@ -0,0 +1,87 @@
+{#-
+    Redshift materialized view, created once and refreshed on the following runs.
+    With auto_refresh=true Redshift also refreshes it in the background when its base
+    tables change. The refresh is incremental when the query only reads local tables
+    and uses aggregates such as sum and count (no count distinct, no Spectrum tables),
+    so build these views on top of local marts like conversion.
+
+    REFRESH keeps the definition the view was created with, so the md5 of the compiled
+    SQL and its dist/sort/auto_refresh config is kept in the schema's
+    materialized_view_definitions table. The view is recreated when it differs, e.g.
+    after a model change.
+
+    {{ config(materialized='materialized_view', dist='cookie_id', sort=['event_timestamp'], auto_refresh=true) }}
+-#}
+
+{% materialization materialized_view, adapter='redshift' %}
+
+    {%- set target_relation = this.incorporate(type='view') -%}
+    {%- set existing_relation = load_relation(this) -%}
+    {%- set dist = config.get('dist') -%}
+    {%- set sort = config.get('sort') -%}
+    {%- set sort = [sort] if sort is string else sort -%}
+    {%- set auto_refresh = config.get('auto_refresh', false) -%}
+
+    {%- set definitions = api.Relation.create(
+        database=this.database,
+        schema=this.schema,
+        identifier='materialized_view_definitions',
+        type='table'
+    ) -%}
+    {%- set definition = [sql, dist, sort, auto_refresh] | join('\n') | replace("'", "''") -%}
+
+    {{ run_hooks(pre_hooks) }}
+
+    {% call statement('create_definitions') %}
+        create table if not exists {{ definitions }} (
+            view_name varchar(127) not null,
+            definition_md5 char(32) not null
+        )
+    {% endcall %}
+
+    {% set stored_definition_query %}
+        select count(*)
+        from {{ definitions }}
+        where view_name = '{{ this.identifier }}'
+            and definition_md5 = md5('{{ definition }}')
+    {% endset %}
+    {%- set definition_changed = run_query(stored_definition_query).columns[0].values()[0] == 0 -%}
+
+    {% if existing_relation is none or flags.FULL_REFRESH or definition_changed %}
+
+        {% if existing_relation is not none %}
+            {% call statement('drop_existing') %}
+                drop materialized view if exists {{ existing_relation }}
+            {% endcall %}
+        {% endif %}
+
+        {% call statement('main') %}
+            create materialized view {{ target_relation }}
+            backup no
+            {% if dist is not none %}distkey({{ dist }}){% endif %}
+            {% if sort %}sortkey({{ sort | join(', ') }}){% endif %}
+            auto refresh {{ 'yes' if auto_refresh else 'no' }}
+            as
+            {{ sql }}
+        {% endcall %}
+
+        {% call statement('store_definition') %}
+            delete from {{ definitions }} where view_name = '{{ this.identifier }}';
+            insert into {{ definitions }} values ('{{ this.identifier }}', md5('{{ definition }}'))
+        {% endcall %}
+
+    {% else %}
+
+        {% call statement('main') %}
+            refresh materialized view {{ target_relation }}
+        {% endcall %}
+
+    {% endif %}
+
+    {{ run_hooks(post_hooks) }}
+
+    {{ adapter.commit() }}
+
+    {{ return({'relations': [target_relation]}) }}
+
+{% endmaterialization %}
@@ -1,15 +1,114 @@
 {{
     config(
-        materialized='table'
+        materialized='incremental',
+        unique_key='event_id',
+        dist='cookie_id',
+        sort='event_timestamp'
     )
 }}
 
-with source as (
+{#-
+    Incremental runs only look for new events in the last `conversion_lookback_days`
+    landing_date partitions. A cookie whose last existing event is within the 30 minute
+    inactivity window of its first new event resumes that open session: it is
+    sessionized again from the session start, keeping its session_idx, so it gets the
+    same session_id and conversion flags as a full refresh. Any other cookie starts a
+    new session at its first new event, numbered after its existing sessions.
+-#}
 
-    select * from {{ ref('stg__atomic_events') }}
+with
+
+{% if is_incremental() %}
+
+scan_window as (
+
+    select dateadd(day, -{{ var('conversion_lookback_days') }}, max(landing_date)) as window_start
+    from {{ this }}
+
+),
+
+new_events as (
+
+    select
+        cookie_id,
+        min(event_timestamp) as first_new_event_at
+    from {{ ref('stg__atomic_events') }}
+    where landing_date >= (select window_start from scan_window)
+    group by 1
 
 ),
 
+last_sessions as (
+
+    select
+        new_events.cookie_id,
+        new_events.first_new_event_at,
+        max(existing.event_timestamp) as last_event_at,
+        max(existing.session_idx) as session_idx,
+        max(existing.session_start_at) as session_start_at
+    from new_events
+    left join {{ this }} as existing
+        on existing.cookie_id = new_events.cookie_id
+        and existing.event_timestamp < new_events.first_new_event_at
+    group by 1, 2
+
+),
+
+resume_points as (
+
+    select
+        cookie_id,
+        date_diff('minute', last_event_at, first_new_event_at) < 30 as is_open_session,
+        case
+            when date_diff('minute', last_event_at, first_new_event_at) < 30 then session_idx
+            else coalesce(session_idx + 1, 0)
+        end as session_idx_offset,
+        case
+            when date_diff('minute', last_event_at, first_new_event_at) < 30 then session_start_at
+            else first_new_event_at
+        end as resume_at
+    from last_sessions
+
+),
+
+source as (
+
+    select
+        events.*,
+        resume_points.session_idx_offset
+    from {{ ref('stg__atomic_events') }} as events
+    inner join resume_points
+        on events.cookie_id = resume_points.cookie_id
+    where events.event_timestamp >= resume_points.resume_at
+        -- Only open sessions reach back before the lookback window
+        and events.landing_date >= (
+            select dateadd(
+                day,
+                -{{ var('conversion_landing_delay_days') }},
+                least(
+                    (select window_start from scan_window),
+                    coalesce(min(resume_at)::date, (select window_start from scan_window))
+                )
+            )
+            from resume_points
+            where is_open_session
+        )
+
+),
+
+{% else %}
+
+source as (
+
+    select
+        *,
+        0 as session_idx_offset
+    from {{ ref('stg__atomic_events') }}
+
+),
+
+{% endif %}
+
 get_previous_timestamp as (
 
     select
@@ -32,7 +131,7 @@ get_session_idx as (
 
     select
         *,
-        SUM(new_session) OVER (PARTITION BY cookie_id ORDER BY event_timestamp ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW) AS session_idx
+        session_idx_offset + SUM(new_session) OVER (PARTITION BY cookie_id ORDER BY event_timestamp ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW) AS session_idx
     from flag_new_session
 
 ),
@@ -49,6 +148,9 @@ from get_session_idx
 calculate_conversion as (
 
     select
+        event_id,
+        event_timestamp,
+        landing_date,
         session_id,
         cookie_id,
         session_idx,
@@ -59,4 +161,4 @@ calculate_conversion as (
 
 )
 
-select * from calculate_conversion
\ No newline at end of file
+select * from calculate_conversion
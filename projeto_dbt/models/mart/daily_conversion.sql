@@ -0,0 +1,19 @@
+{{
+    config(
+        materialized='materialized_view',
+        sort=['event_date'],
+        auto_refresh=true
+    )
+}}
+
+{#-
+    Dashboard aggregate served from local storage. It only reads the local conversion
+    table with sum/count, so Redshift refreshes it incrementally after each load.
+-#}
+
+select
+    trunc(event_timestamp) as event_date,
+    count(*) as events,
+    sum(case when is_conversion then 1 else 0 end) as conversions
+from {{ ref('conversion') }}
+group by 1
@@ -1,6 +1,69 @@
-with source as (
+{{
+    config(
+        materialized=var('staging_materialization'),
+        sort='landing_date'
+    )
+}}
+
+{#-
+    Firehose used to deliver gzipped JSON to atomic_events, partitioned by arrival date
+    (landing_date). It now writes parquet to atomic_events_parquet, partitioned by the
+    date of the event (event_date). Every event was delivered to only one of them, so
+    both are read and landing_date is the raw partition date of either source.
+
+    The parquet days older than compaction_lag_days are read from
+    atomic_events_parquet_compacted, whose few large files Spectrum scans faster than
+    Firehose's small ones. The newer days may not be compacted yet, so they are read
+    from atomic_events_parquet.
+
+    staging_lookback_days limits the partitions read from the raw bucket, so Spectrum
+    prunes them instead of scanning the whole history. Leave it unset to read
+    everything, e.g. on a full refresh of the marts.
+-#}
+
+{%- set lookback_days = var('staging_lookback_days') -%}
+{%- if lookback_days is not none -%}
+{%- set since = (modules.datetime.date.today() - modules.datetime.timedelta(days=lookback_days | int)).isoformat() -%}
+{%- endif -%}
+{%- set compacted_until = (modules.datetime.date.today() - modules.datetime.timedelta(days=var('compaction_lag_days') | int)).isoformat() -%}
+
+with json_history as (
 
     select * from {{ source('data_lake_raw', 'atomic_events') }}
+    {% if lookback_days is not none %}
+    where landing_date >= '{{ since }}'
+    {% endif %}
+
+),
+
+parquet_compacted as (
+
+    select * from {{ source('data_lake_raw', 'atomic_events_parquet_compacted') }}
+    where event_date < '{{ compacted_until }}'
+    {% if lookback_days is not none %}
+        and event_date >= '{{ since }}'
+    {% endif %}
+
+),
+
+parquet as (
+
+    select * from {{ source('data_lake_raw', 'atomic_events_parquet') }}
+    where event_date >= '{{ compacted_until }}'
+    {% if lookback_days is not none %}
+        and event_date >= '{{ since }}'
+    {% endif %}
+
+),
+
+source as (
+
+    -- The tables have the same columns followed by their partition key
+    select * from json_history
+    union all
+    select * from parquet_compacted
+    union all
+    select * from parquet
 
 )
 
@@ -35,5 +98,5 @@ select
     utm_content::varchar,
     utm_medium::varchar,
     utm_source::varchar,
-	landing_date::date
+    landing_date::date
 from source
@@ -0,0 +1,196 @@
+import io
+import json
+
+import boto3
+import pytest
+from botocore.response import StreamingBody
+from botocore.stub import ANY, Stubber
+
+from data_platform.athena.client import AthenaQueryRunner, normalize_sql
+
+WORKGROUP = "workgroup"
+OUTPUT = "s3://results/athena/"
+
+
+def body(data: bytes) -> StreamingBody:
+    return StreamingBody(io.BytesIO(data), len(data))
+
+
+@pytest.fixture
+def clients():
+    athena = boto3.client("athena", region_name="us-east-1")
+    s3 = boto3.client("s3", region_name="us-east-1")
+    with Stubber(athena) as athena_stub, Stubber(s3) as s3_stub:
+        yield athena, athena_stub, s3, s3_stub
+        athena_stub.assert_no_pending_responses()
+        s3_stub.assert_no_pending_responses()
+
+
+def runner(athena, s3, **kwargs):
+    return AthenaQueryRunner(
+        workgroup=WORKGROUP,
+        athena_client=athena,
+        s3_client=s3,
+        poll_interval_seconds=0,
+        **kwargs,
+    )
+
+
+def add_work_group(athena_stub):
+    athena_stub.add_response(
+        "get_work_group",
+        {
+            "WorkGroup": {
+                "Name": WORKGROUP,
+                "Configuration": {"ResultConfiguration": {"OutputLocation": OUTPUT}},
+            }
+        },
+        {"WorkGroup": WORKGROUP},
+    )
+
+
+def add_execution(athena_stub, query_execution_id: str, query_string=ANY):
+    athena_stub.add_response(
+        "start_query_execution",
+        {"QueryExecutionId": query_execution_id},
+        {"QueryString": query_string, "WorkGroup": WORKGROUP},
+    )
+    athena_stub.add_response(
+        "get_query_execution",
+        {
+            "QueryExecution": {
+                "QueryExecutionId": query_execution_id,
+                "Status": {"State": "SUCCEEDED"},
+                "ResultConfiguration": {
+                    "OutputLocation": f"{OUTPUT}{query_execution_id}.csv"
+                },
+            }
+        },
+        {"QueryExecutionId": query_execution_id},
+    )
+
+
+def add_cache_miss(s3_stub):
+    s3_stub.add_client_error("get_object", service_error_code="NoSuchKey")
+
+
+def test_normalize_sql_ignores_quotes_inside_comments():
+    sql = """
+        SELECT a -- the user's events
+        FROM t /* it's */ WHERE b = 'x'
+    """
+
+    assert normalize_sql(sql) == "select a from t where b = 'x'"
+
+
+def test_normalize_sql_keeps_literals_and_quoted_identifiers():
+    sql = "SELECT \"Col\" FROM t WHERE b = 'It''s -- not a comment' ;"
+
+    assert (
+        normalize_sql(sql) == "select \"Col\" from t where b = 'It''s -- not a comment'"
+    )
+
+
+def test_query_reuses_the_output_of_the_same_normalized_query(clients):
+    athena, athena_stub, s3, s3_stub = clients
+    add_work_group(athena_stub)
+    add_cache_miss(s3_stub)
+    add_execution(athena_stub, "q1")
+    s3_stub.add_response("put_object", {})
+    s3_stub.add_response("get_object", {"Body": body(b'"a"\n"1"\n')})
+    s3_stub.add_response("get_object", {"Body": body(b'"a"\n"1"\n')})
+    athena_runner = runner(athena, s3)
+
+    first = list(athena_runner.query("SELECT a FROM t", watermark="2021-05-20"))
+    second = list(athena_runner.query("select a\nfrom t;", watermark="2021-05-20"))
+
+    assert first == second == [{"a": "1"}]
+
+
+def test_query_reads_the_cache_index_of_another_runner(clients):
+    athena, athena_stub, s3, s3_stub = clients
+    output = f"{OUTPUT}q1.csv"
+    add_work_group(athena_stub)
+    s3_stub.add_response(
+        "get_object", {"Body": body(json.dumps({"output": output}).encode())}
+    )
+    s3_stub.add_response("head_object", {}, {"Bucket": "results", "Key": "athena/q1.csv"})
+    s3_stub.add_response("get_object", {"Body": body(b'"a"\n"1"\n')})
+
+    rows = list(runner(athena, s3).query("SELECT a FROM t", watermark="2021-05-20"))
+
+    assert rows == [{"a": "1"}]
+
+
+def test_iter_results_pages_drop_only_the_header_row(clients):
+    athena, athena_stub, s3, s3_stub = clients
+    metadata = {"ColumnInfo": [{"Name": "a", "Type": "varchar"}]}
+    athena_stub.add_response(
+        "get_query_results",
+        {
+            "ResultSet": {
+                "Rows": [
+                    {"Data": [{"VarCharValue": "a"}]},
+                    {"Data": [{"VarCharValue": "1"}]},
+                ],
+                "ResultSetMetadata": metadata,
+            },
+            "NextToken": "page-2",
+        },
+        {"QueryExecutionId": "q1", "MaxResults": 2},
+    )
+    athena_stub.add_response(
+        "get_query_results",
+        {
+            "ResultSet": {
+                "Rows": [{"Data": [{"VarCharValue": "a"}]}, {"Data": [{}]}],
+                "ResultSetMetadata": metadata,
+            }
+        },
+        {"QueryExecutionId": "q1", "MaxResults": 2, "NextToken": "page-2"},
+    )
+
+    rows = list(runner(athena, s3, page_size=2).iter_results("q1"))
+
+    # A value equal to the column name on a later page is data
+    assert rows == [{"a": "1"}, {"a": "a"}, {"a": None}]
+
+
+def test_unload_writes_parquet_under_the_key_and_reuses_it(clients):
+    athena, athena_stub, s3, s3_stub = clients
+    add_work_group(athena_stub)
+    athena_runner = runner(athena, s3)
+    sql = "SELECT a FROM t;"
+    key = athena_runner.cache_key(sql, "2021-05-20", result_format="parquet")
+    location = f"{OUTPUT}unload/{key}/"
+    add_cache_miss(s3_stub)
+    s3_stub.add_response(
+        "list_objects_v2",
+        {"Contents": [{"Key": f"athena/unload/{key}/part-0.parquet"}]},
+        {"Bucket": "results", "Prefix": f"athena/unload/{key}/"},
+    )
+    s3_stub.add_response(
+        "delete_objects",
+        {},
+        {
+            "Bucket": "results",
+            "Delete": {"Objects": [{"Key": f"athena/unload/{key}/part-0.parquet"}]},
+        },
+    )
+    add_execution(
+        athena_stub,
+        "q1",
+        query_string=f"UNLOAD (SELECT a FROM t) TO '{location}' "
+        "WITH (format = 'PARQUET', compression = 'SNAPPY')",
+    )
+    s3_stub.add_response("put_object", {})
+
+    assert athena_runner.unload(sql, watermark="2021-05-20") == location
+    assert athena_runner.unload("select a from t", watermark="2021-05-20") == location
+
+
+def test_unload_rejects_statements_other_than_select(clients):
+    athena, _, s3, _ = clients
+
+    with pytest.raises(ValueError):
+        runner(athena, s3).unload("DROP TABLE t")
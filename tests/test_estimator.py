@@ -0,0 +1,56 @@
+import os
+
+import pytest
+
+from data_platform.estimator import estimate
+
+CDK_OUT = os.path.join(os.path.dirname(__file__), "fixtures", "cdk.out")
+
+
+def writer(report, name):
+    return next(w for w in report["writers"] if w["name"] == f"fixture-stack/{name}")
+
+
+def test_dms_cdc_files_flush_on_the_batch_interval_when_the_rate_is_low():
+    # 10 orders/s * 120 bytes never fill the 1000 KB minimum in 120 s
+    report = estimate(CDK_OUT, events_per_second=0, orders_per_second=10)
+    dms = writer(report, "dmss3endpoint")
+
+    assert dms["layer"] == "raw"
+    assert dms["settings"].startswith("cdc batch 120s/1000KB")
+    assert dms["files_per_hour"] == pytest.approx(30)
+
+
+def test_dms_cdc_files_flush_on_the_minimum_size_when_the_rate_is_high():
+    # 1000 orders/s * 120 bytes fill 1000 KB in about 8.5 s
+    report = estimate(CDK_OUT, events_per_second=0, orders_per_second=1000)
+    dms = writer(report, "dmss3endpoint")
+
+    assert dms["files_per_hour"] == pytest.approx(3600 / (1000 * 1024 / 120000))
+
+
+def test_dms_cdc_files_are_split_across_tables():
+    report = estimate(CDK_OUT, events_per_second=0, orders_per_second=10, cdc_tables=2)
+
+    assert writer(report, "dmss3endpoint")["files_per_hour"] == pytest.approx(60)
+
+
+def test_firehose_flushes_one_buffer_per_active_partition():
+    report = estimate(
+        CDK_OUT, events_per_second=100, orders_per_second=0, active_partitions=2
+    )
+    firehose = writer(report, "firehoseraw")
+
+    assert firehose["settings"] == "buffer 60s/64MB, PARQUET, 2 partition(s)"
+    assert firehose["files_per_hour"] == pytest.approx(2 * 60)
+
+
+def test_athena_and_compute():
+    report = estimate(CDK_OUT, events_per_second=0, orders_per_second=0)
+
+    assert report["athena"] == [
+        {"name": "fixture-stack/analytics", "cutoff_bytes": 1e12, "worst_case_usd": 5.0}
+    ]
+    assert report["compute"] == {
+        "fixture-stack/redshiftcluster": "2 x dc2.large, 4 slices"
+    }
@@ -0,0 +1,103 @@
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "local_scripts"))
+
+from firehose_producer import FirehoseProducer  # noqa: E402
+
+
+class StubFirehose:
+    """
+    Records every put_record_batch call. `errors` lists what each call does in order:
+    an exception to raise, a set of record indexes to reject, or None to accept all
+    """
+
+    def __init__(self, errors=None):
+        self.errors = list(errors or [])
+        self.batches = []
+        self.delivered = []
+        self.lock = threading.Lock()
+
+    def put_record_batch(self, DeliveryStreamName, Records):
+        with self.lock:
+            self.batches.append(Records)
+            error = self.errors.pop(0) if self.errors else None
+        if isinstance(error, Exception):
+            raise error
+        rejected = error or set()
+        responses = []
+        for index, record in enumerate(Records):
+            if index in rejected:
+                responses.append({"ErrorCode": "ServiceUnavailableException"})
+            else:
+                responses.append({"RecordId": str(index)})
+                with self.lock:
+                    self.delivered.append(record["Data"])
+        return {"FailedPutCount": len(rejected), "RequestResponses": responses}
+
+
+def producer(client, **kwargs):
+    options = {
+        "delivery_stream_name": "stub",
+        "max_workers": 1,
+        "linger_seconds": 60,
+        "retry_backoff_seconds": 0,
+    }
+    options.update(kwargs)
+    return FirehoseProducer(client, **options)
+
+
+def test_sends_full_batches_and_the_remainder_on_close():
+    client = StubFirehose()
+    with producer(client, max_batch_records=10) as firehose:
+        for index in range(25):
+            firehose.put({"index": index})
+
+    assert [len(batch) for batch in client.batches] == [10, 10, 5]
+    assert firehose.records_sent == 25
+    assert firehose.records_failed == 0
+
+
+def test_retries_only_the_rejected_records():
+    client = StubFirehose(errors=[{0, 3}])
+    with producer(client, max_batch_records=5) as firehose:
+        for index in range(5):
+            firehose.put_record(str(index).encode())
+
+    assert [len(batch) for batch in client.batches] == [5, 2]
+    assert sorted(client.delivered) == [b"0", b"1", b"2", b"3", b"4"]
+    assert firehose.records_sent == 5
+
+
+def test_retries_a_batch_whose_call_raises():
+    client = StubFirehose(errors=[RuntimeError("ThrottlingException")])
+    with producer(client, max_batch_records=10) as firehose:
+        for index in range(20):
+            firehose.put({"index": index})
+
+    assert len(client.delivered) == 20
+    assert firehose.records_sent == 20
+    assert firehose.records_failed == 0
+
+
+def test_counts_records_as_failed_after_the_retries():
+    client = StubFirehose(errors=[RuntimeError("ServiceUnavailable")] * 3)
+    with producer(client, max_batch_records=10, max_retries=2) as firehose:
+        for index in range(10):
+            firehose.put({"index": index})
+
+    assert len(client.batches) == 3
+    assert firehose.records_sent == 0
+    assert firehose.records_failed == 10
+
+
+def test_record_bigger_than_the_batch_is_sent_alone():
+    client = StubFirehose()
+    with producer(client, max_batch_bytes=10) as firehose:
+        firehose.put_record(b"x" * 20)
+        firehose.put_record(b"y" * 4)
+
+    assert all(client.batches)
+    assert [len(batch) for batch in client.batches] == [1, 1]
+    assert firehose.records_sent == 2